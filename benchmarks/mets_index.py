@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+"""Compare what the butler does with the METS after a step: reloading and
+querying it with ``ocrd_models`` against updating a
+:class:`~ocrd_butler.execution.mets.MetsIndex` from the added file group.
+
+Run with ``python -m benchmarks.mets_index [--pages 5000 --groups 4]``,
+which makes a METS file with ``pages * groups`` files.
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from ocrd_models import OcrdMets
+
+from ocrd_butler.execution.mets import MetsIndex
+
+
+def make_mets(path: str, pages: int, groups: int) -> str:
+    """ Write a METS file with a file in every group for every page, the
+    last group being the output of a processor. Returns that group. It is
+    written as text, as adding that many files with ``ocrd_models`` takes
+    long. """
+    file_grps = [f"OCR-D-GRP-{group}" for group in range(groups)]
+    with open(path, "w") as fh:
+        fh.write('<mets:mets xmlns:mets="http://www.loc.gov/METS/" '
+                 'xmlns:xlink="http://www.w3.org/1999/xlink">\n'
+                 '<mets:fileSec>\n')
+        for file_grp in file_grps:
+            fh.write(f'<mets:fileGrp USE="{file_grp}">\n')
+            for page in range(1, pages + 1):
+                fh.write(
+                    f'<mets:file ID="{file_grp}_{page:05}" '
+                    f'MIMETYPE="image/tiff"><mets:FLocat LOCTYPE="OTHER" '
+                    f'OTHERLOCTYPE="FILE" xlink:href="{file_grp}/'
+                    f'{file_grp}_{page:05}.tif"/></mets:file>\n'
+                )
+            fh.write('</mets:fileGrp>\n')
+        fh.write('</mets:fileSec>\n<mets:structMap TYPE="PHYSICAL">\n'
+                 '<mets:div TYPE="physSequence">\n')
+        for page in range(1, pages + 1):
+            fh.write(f'<mets:div TYPE="page" ID="PHYS_{page:05}">')
+            for file_grp in file_grps:
+                fh.write(f'<mets:fptr FILEID="{file_grp}_{page:05}"/>')
+            fh.write('</mets:div>\n')
+        fh.write('</mets:div>\n</mets:structMap>\n</mets:mets>\n')
+    return file_grps[-1]
+
+
+def reload_and_query(path: str, input_file_grp: str, output_file_grp: str):
+    """ The former way: parse the METS again and ask it for the pages and
+    the files of the input and output groups with their page. """
+    mets = OcrdMets(filename=path)
+    pages = mets.physical_pages
+    for file_grp in (input_file_grp, output_file_grp):
+        files = {}
+        for ocrd_file in mets.find_files(fileGrp=file_grp):
+            files.setdefault(ocrd_file.pageId, []).append(ocrd_file)
+    return pages, files
+
+
+def update_and_query(index: MetsIndex, path: str, input_file_grp: str,
+                     output_file_grp: str):
+    """ The indexed way: read the output group again and ask the index. """
+    index.update(path, [output_file_grp])
+    for file_grp in (input_file_grp, output_file_grp):
+        files = index.by_page(file_grp)
+    return index.pages, files
+
+
+def timed(function, *args) -> float:
+    started = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--pages", type=int, default=5000)
+    parser.add_argument("--groups", type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "mets.xml")
+        output_file_grp = make_mets(path, args.pages, args.groups)
+        input_file_grp = "OCR-D-GRP-0"
+        size = os.path.getsize(path)
+        print(f"METS with {args.pages * args.groups} files, "
+              f"{size / 1024 ** 2:.1f} MiB")
+
+        index = timed(MetsIndex.from_file, path)
+        print(f"build index:          {index:8.3f}s (once per task)")
+        index = MetsIndex.from_file(path)
+        print(f"update index + query: "
+              f"{timed(update_and_query, index, path, input_file_grp, output_file_grp):8.3f}s")
+        print(f"reload + query:       "
+              f"{timed(reload_and_query, path, input_file_grp, output_file_grp):8.3f}s")
+
+
+if __name__ == "__main__":
+    main()
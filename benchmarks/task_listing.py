@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+"""Compare serializing a listing of tasks with ``Task.to_json``, loading
+the workflow of every task on its own, against the serializers of the API,
+which load the workflows along with the tasks or give their IDs alone.
+
+Run with ``python -m benchmarks.task_listing [--tasks 5000]``, which fills a
+SQLite database with synthetic tasks of some workflows.
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from flask import jsonify
+from sqlalchemy import event
+
+from ocrd_butler.api.serializers import (
+    json_response,
+    serialize_tasks,
+    task_query,
+)
+from ocrd_butler.config import TestingConfig
+from ocrd_butler.database import db
+from ocrd_butler.database.models import (
+    Task,
+    Workflow,
+)
+from ocrd_butler.factory import create_app
+
+
+def fill(tasks: int, workflows: int = 10):
+    """ Add the workflows, with some processors each, and the tasks. """
+    db.session.add_all(
+        Workflow(name=f"Workflow {index}", description="A workflow.",
+                 processors=[
+                     {"name": f"ocrd-processor-{step}",
+                      "parameters": {"model": "GT4HistOCR", "dpi": 300}}
+                     for step in range(8)
+                 ])
+        for index in range(workflows)
+    )
+    db.session.commit()
+    engine = db.get_engine()
+    engine.execute(Task.__table__.insert(), [
+        {
+            "uid": f"task-{index}",
+            "src": f"https://foo.bar/PPN{index}.mets.xml",
+            "workflow_id": index % workflows + 1,
+            "parameters": {},
+            "results": {"result_dir": f"/data/task-{index}"},
+            "status": "SUCCESS",
+            "priority": 0,
+        }
+        for index in range(tasks)
+    ])
+
+
+def former():
+    """ The former way, each task with its workflow and timings. """
+    return jsonify([task.to_json() for task in Task.query.all()])
+
+
+def serialized(fields: set = None):
+    return json_response(
+        serialize_tasks(task_query(fields).all(), fields)
+    )
+
+
+def timed(app, function, *args) -> tuple:
+    """ The seconds and the queries of the function, with a fresh session,
+    and the size of its response. """
+    statements = []
+
+    def count(*args):
+        statements.append(args[2])
+
+    engine = db.get_engine()
+    event.listen(engine, "before_cursor_execute", count)
+    with app.test_request_context():
+        started = time.perf_counter()
+        response = function(*args)
+        seconds = time.perf_counter() - started
+    event.remove(engine, "before_cursor_execute", count)
+    db.session.remove()
+    return seconds, len(statements), len(response.get_data())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--tasks", type=int, default=5000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        class BenchmarkConfig(TestingConfig):
+            SQLALCHEMY_DATABASE_URI = \
+                f"sqlite:///{os.path.join(directory, 'butler.db')}"
+            OCRD_BUTLER_RESULTS = directory
+
+        app = create_app(config=BenchmarkConfig)
+        with app.app_context():
+            fill(args.tasks)
+            print(f"{args.tasks} tasks")
+            print(f"{'serialization':30} {'seconds':>9} {'queries':>8} "
+                  f"{'MiB':>7}")
+            for name, function, function_args in (
+                ("to_json", former, ()),
+                ("all fields", serialized, ()),
+                ("fields=uid,status,workflow_id", serialized,
+                 ({"uid", "status", "workflow_id"},)),
+                ("fields=uid,status", serialized, ({"uid", "status"},)),
+            ):
+                seconds, queries, size = timed(app, function, *function_args)
+                print(f"{name:30} {seconds:8.3f}s {queries:8} "
+                      f"{size / 1024 ** 2:7.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+"""Compare the queries of the API on the ``tasks`` table without its
+indexes, as before the migrations of
+:mod:`ocrd_butler.database.migrations`, and with them.
+
+Run with ``python -m benchmarks.task_store [--rows 200000 --lookups 1000]``,
+which fills a SQLite database with synthetic tasks.
+"""
+
+import argparse
+from datetime import (
+    datetime,
+    timedelta,
+)
+import os
+import random
+import tempfile
+import time
+import uuid
+
+from sqlalchemy import create_engine
+
+from ocrd_butler.database import db
+from ocrd_butler.database.migrations import upgrade
+from ocrd_butler.database.models import Task
+
+
+STATUSES = ["SUCCESS"] * 90 + ["FAILURE"] * 5 + ["CREATED"] * 3 + \
+    ["PENDING", "STARTED"]
+
+
+def fill(engine, rows: int) -> list:
+    """ Insert the synthetic tasks, created one a minute. Returns their
+    uids. """
+    started = datetime(2020, 1, 1)
+    uids = [str(uuid.uuid4()) for _ in range(rows)]
+    for offset in range(0, rows, 10000):
+        engine.execute(Task.__table__.insert(), [
+            {
+                "uid": uids[row],
+                "src": f"https://foo.bar/PPN{row}.mets.xml",
+                "workflow_id": row % 20 + 1,
+                "worker_task_id": f"worker-{uids[row]}",
+                "status": random.choice(STATUSES),
+                "parameters": {},
+                "results": {},
+                "priority": 0,
+                "created": started + timedelta(minutes=row),
+                "updated": started + timedelta(minutes=row),
+            }
+            for row in range(offset, min(offset + 10000, rows))
+        ])
+    return uids
+
+
+def queries(engine, uids: list, lookups: int) -> dict:
+    """ The seconds of the queries of the API. """
+    sample = random.sample(uids, lookups)
+    seconds = {}
+
+    def timed(name, statement, params):
+        started = time.perf_counter()
+        for param in params:
+            engine.execute(statement, param).fetchall()
+        seconds[name] = time.perf_counter() - started
+
+    timed(f"{lookups} tasks by uid",
+          "SELECT * FROM tasks WHERE uid = ?", [(uid,) for uid in sample])
+    timed(f"{lookups} tasks by worker task id",
+          "SELECT * FROM tasks WHERE worker_task_id = ?",
+          [(f"worker-{uid}",) for uid in sample])
+    timed("100 x tasks queued in order",
+          "SELECT id FROM tasks WHERE status IN ('PENDING', 'STARTED') "
+          "ORDER BY id", [()] * 100)
+    timed("100 x last 50 created",
+          "SELECT * FROM tasks ORDER BY created DESC LIMIT 50", [()] * 100)
+    return seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--lookups", type=int, default=1000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(
+            f"sqlite:///{os.path.join(directory, 'butler.db')}"
+        )
+        db.Model.metadata.create_all(bind=engine)
+        indexes = [index.name for index in Task.__table__.indexes]
+        for name in indexes:
+            engine.execute(f"DROP INDEX {name}")
+        started = time.perf_counter()
+        uids = fill(engine, args.rows)
+        print(f"{args.rows} tasks inserted in "
+              f"{time.perf_counter() - started:.1f}s")
+
+        former = queries(engine, uids, args.lookups)
+        started = time.perf_counter()
+        upgrade(engine)
+        print(f"migrated in {time.perf_counter() - started:.1f}s")
+        current = queries(engine, uids, args.lookups)
+
+        print(f"{'query':34} {'no indexes':>11} {'indexes':>11}")
+        for name, seconds in former.items():
+            print(f"{name:34} {seconds:10.3f}s {current[name]:10.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -54,6 +54,27 @@ task_model = api.model("Task Model", {
         required=False,
         description="Results of a processed task.",
         default={}),
+    "priority": fields.Integer(
+        title="Priority",
+        required=False,
+        description=(
+            "Tasks with a priority of at least TASK_PRIORITY_URGENT skip the "
+            "queues of their size."
+        ),
+        default=0),
+})
+
+task_batch_model = api.model("Task Batch Model", {
+    "tasks": fields.List(
+        fields.Nested(task_model),
+        title="Tasks",
+        required=True,
+        description="The tasks to create, like for a single task."),
+    "run": fields.Boolean(
+        title="Run",
+        required=False,
+        description="Run the tasks right away.",
+        default=False),
 })
 
 
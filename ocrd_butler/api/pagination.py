@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+
+"""Filters and keyset pagination of the listing of tasks.
+
+A page ends with a cursor, the sort value and the ID of its last task, from
+which the next page goes on. Unlike an offset, it stays cheap deep into the
+listing, on the indexes of the sort columns, and doesn't skip or repeat
+tasks added in between. Tasks without a value of the sort column come
+first, as if it was the smallest.
+"""
+
+import base64
+import binascii
+from datetime import (
+    datetime,
+    timedelta,
+    timezone,
+)
+import json
+import re
+from typing import (
+    List,
+    Optional,
+    Tuple,
+)
+
+from sqlalchemy import (
+    and_,
+    or_,
+)
+from werkzeug.datastructures import MultiDict
+
+from ocrd_butler.database.models import Task as db_model_Task
+
+
+# The columns tasks can be sorted by, prefixed with "-" for descending.
+SORT_COLUMNS = {
+    "id": db_model_Task.id,
+    "created": db_model_Task.created,
+    "updated": db_model_Task.updated,
+}
+
+# A date of ISO 8601, with a time and an UTC offset optionally.
+ISO_DATE = re.compile(
+    r"(\d{4})-(\d\d)-(\d\d)"
+    r"(?:[T ](\d\d):(\d\d)(?::(\d\d)(?:\.(\d{1,6}))?)?"
+    r"(?:(Z)|([+-])(\d\d):?(\d\d))?)?$"
+)
+
+
+class ListingError(ValueError):
+    """ A parameter of the listing is wrong. """
+
+
+def encode_cursor(values: list) -> str:
+    """ The cursor after the sort values of a task.
+
+    >>> encode_cursor(["2021-03-01T12:00:00", 42])
+    'WyIyMDIxLTAzLTAxVDEyOjAwOjAwIiwgNDJd'
+    """
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> list:
+    """ The sort values of a cursor.
+
+    >>> decode_cursor('WyIyMDIxLTAzLTAxVDEyOjAwOjAwIiwgNDJd')
+    ['2021-03-01T12:00:00', 42]
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ListingError(f"Invalid cursor \"{cursor}\".")
+    if not isinstance(values, list) or not values:
+        raise ListingError(f"Invalid cursor \"{cursor}\".")
+    return values
+
+
+def parse_sort(sort: str) -> Tuple[str, bool]:
+    """ The column and the direction of the sort parameter.
+
+    >>> parse_sort("-created")
+    ('created', True)
+    >>> parse_sort("id")
+    ('id', False)
+    """
+    name = sort.lstrip("-")
+    if name not in SORT_COLUMNS:
+        raise ListingError(
+            f"Unknown sort \"{sort}\", use one of "
+            f"{', '.join(SORT_COLUMNS)}, prefixed with \"-\" for descending."
+        )
+    return name, sort.startswith("-")
+
+
+def from_isoformat(value: str) -> datetime:
+    """ The time of an ISO date, like :meth:`datetime.fromisoformat` of
+    Python 3.7 and later. Raises a :class:`ValueError` for other strings.
+
+    >>> from_isoformat("2021-03-01T13:00:00.5")
+    datetime.datetime(2021, 3, 1, 13, 0, 0, 500000)
+    >>> from_isoformat("2021-03-01 13:00-01:30").utcoffset().total_seconds()
+    -5400.0
+    >>> from_isoformat("2021-03-01T13:00:00Z").tzinfo
+    datetime.timezone.utc
+    """
+    match = ISO_DATE.match(value)
+    if match is None:
+        raise ValueError(f"Invalid ISO date \"{value}\".")
+    year, month, day, hour, minute, second, fraction, utc, sign, hours, \
+        minutes = match.groups()
+    tzinfo = None
+    if utc:
+        tzinfo = timezone.utc
+    elif sign:
+        offset = timedelta(hours=int(hours), minutes=int(minutes))
+        tzinfo = timezone(-offset if sign == "-" else offset)
+    return datetime(
+        int(year), int(month), int(day), int(hour or 0), int(minute or 0),
+        int(second or 0), int((fraction or "0").ljust(6, "0")),
+        tzinfo=tzinfo,
+    )
+
+
+def parse_date(value: str) -> datetime:
+    """ The naive UTC time of an ISO date, as stored.
+
+    >>> parse_date("2021-03-01T13:00:00+01:00")
+    datetime.datetime(2021, 3, 1, 12, 0)
+    >>> parse_date("2021-03-01")
+    datetime.datetime(2021, 3, 1, 0, 0)
+    """
+    try:
+        date = from_isoformat(value)
+    except ValueError:
+        raise ListingError(f"Invalid date \"{value}\", use ISO 8601.")
+    if date.tzinfo is not None:
+        date = date.astimezone(timezone.utc).replace(tzinfo=None)
+    return date
+
+
+def task_filters(args: MultiDict) -> list:
+    """ The criteria of the tasks by the parameters of the listing:
+    ``status`` (repeated or comma-separated), ``workflow_id``, ``src`` (a
+    part of it), ``created_after`` and ``created_before``. """
+    criteria = []
+    statuses = [
+        status for value in args.getlist("status")
+        for status in value.split(",") if status
+    ]
+    if statuses:
+        criteria.append(db_model_Task.status.in_(statuses))
+    if args.get("workflow_id"):
+        try:
+            workflow_id = int(args["workflow_id"])
+        except ValueError:
+            raise ListingError(f"Invalid workflow_id \"{args['workflow_id']}\".")
+        criteria.append(db_model_Task.workflow_id == workflow_id)
+    if args.get("src"):
+        criteria.append(db_model_Task.src.contains(args["src"],
+                                                   autoescape=True))
+    if args.get("created_after"):
+        criteria.append(
+            db_model_Task.created >= parse_date(args["created_after"])
+        )
+    if args.get("created_before"):
+        criteria.append(
+            db_model_Task.created < parse_date(args["created_before"])
+        )
+    return criteria
+
+
+def after_cursor(name: str, descending: bool, values: list):
+    """ The criterion of the tasks after the sort values of the cursor. """
+    try:
+        value, last_id = (None, values[0]) if name == "id" else values
+        last_id = int(last_id)
+        if value is not None:
+            value = from_isoformat(value)
+    except (TypeError, ValueError):
+        raise ListingError("Invalid cursor.")
+    task_id = db_model_Task.id
+    if name == "id":
+        return task_id < last_id if descending else task_id > last_id
+    column = SORT_COLUMNS[name]
+    if descending:
+        if value is None:
+            return and_(column.is_(None), task_id < last_id)
+        return or_(column < value, and_(column == value, task_id < last_id),
+                   column.is_(None))
+    if value is None:
+        return or_(and_(column.is_(None), task_id > last_id),
+                   column.isnot(None))
+    return or_(column > value, and_(column == value, task_id > last_id))
+
+
+def task_page(query, sort: str, cursor: Optional[str], limit: int
+              ) -> Tuple[List[db_model_Task], Optional[str]]:
+    """ The tasks of the query sorted by the sort parameter, up to
+    ``limit`` after the cursor, if given, and the cursor of the next page,
+    ``None`` if there is none. """
+    name, descending = parse_sort(sort)
+    column = SORT_COLUMNS[name]
+    if cursor:
+        query = query.filter(after_cursor(name, descending,
+                                          decode_cursor(cursor)))
+    if name == "id":
+        order = [column.desc() if descending else column]
+    elif descending:
+        order = [column.desc().nullslast(), db_model_Task.id.desc()]
+    else:
+        order = [column.nullsfirst(), db_model_Task.id]
+    tasks = query.order_by(*order).limit(limit + 1).all()
+    if len(tasks) <= limit:
+        return tasks, None
+    tasks = tasks[:limit]
+    last = tasks[-1]
+    if name == "id":
+        return tasks, encode_cursor([last.id])
+    value = getattr(last, name)
+    return tasks, encode_cursor(
+        [value and value.isoformat(), last.id]
+    )
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+
+"""Serialization of tasks for the API.
+
+Unlike :meth:`~ocrd_butler.database.models.Task.to_json`, which the workers
+get, only the fields asked for with ``fields`` are serialized, and the
+workflows of the tasks are loaded along with them in the same query. A task
+refers to its workflow by ID alone with the field ``workflow_id`` instead of
+``workflow``. The JSON is written by ``orjson`` if it is installed.
+"""
+
+from datetime import timezone
+import json
+from typing import (
+    Iterable,
+    List,
+    Optional,
+    Set,
+)
+
+from flask import Response
+from sqlalchemy.orm import joinedload
+from werkzeug.datastructures import MultiDict
+
+from ocrd_butler.api.pagination import ListingError
+from ocrd_butler.database.models import Task as db_model_Task
+from ocrd_butler.execution.states import load_timings
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# The fields of a serialized task, by default.
+TASK_FIELDS = (
+    "id", "uid", "src", "workflow", "parameters", "description",
+    "default_file_grp", "worker_task_id", "status", "results", "batch_id",
+    "priority", "page_count", "created", "updated", "timings",
+)
+
+# The fields of a serialized task only if asked for.
+EXTRA_FIELDS = ("workflow_id",)
+
+
+def _comma_list(args: MultiDict, name: str) -> List[str]:
+    return [
+        item for value in args.getlist(name)
+        for item in value.split(",") if item
+    ]
+
+
+def task_projection(args: MultiDict) -> Optional[Set[str]]:
+    """ The ``fields`` of the tasks asked for, repeated or comma-separated,
+    ``None`` for the default ones.
+
+    >>> sorted(task_projection(MultiDict([("fields", "uid,workflow_id")])))
+    ['uid', 'workflow_id']
+    >>> task_projection(MultiDict()) is None
+    True
+    """
+    fields = _comma_list(args, "fields")
+    unknown = set(fields) - set(TASK_FIELDS + EXTRA_FIELDS)
+    if unknown:
+        raise ListingError(
+            f"Unknown fields {', '.join(sorted(unknown))}, use some of "
+            f"{', '.join(TASK_FIELDS + EXTRA_FIELDS)}."
+        )
+    return set(fields) or None
+
+
+def task_query(fields: Optional[Set[str]] = None):
+    """ The query of the tasks, loading their workflows along if they are
+    among the fields. """
+    query = db_model_Task.query
+    if fields is None or "workflow" in fields:
+        query = query.options(joinedload(db_model_Task.workflow))
+    return query
+
+
+def _date(value):
+    return value and value.replace(tzinfo=timezone.utc).isoformat()
+
+
+def _parameters(value):
+    """ The parameters of a task, stored as a string of JSON. """
+    if isinstance(value, str):
+        return json.loads(value) if orjson is None else orjson.loads(value)
+    return value
+
+
+# The serialization of the fields of a task, the timings aside.
+FIELD_VALUES = {
+    "id": lambda task: task.id,
+    "uid": lambda task: task.uid,
+    "src": lambda task: task.src,
+    "workflow": lambda task: task.workflow and task.workflow.to_json(),
+    "workflow_id": lambda task: task.workflow_id,
+    "parameters": lambda task: _parameters(task.parameters),
+    "description": lambda task: task.description,
+    "default_file_grp": lambda task: task.default_file_grp,
+    "worker_task_id": lambda task: task.worker_task_id,
+    "status": lambda task: task.status,
+    "results": lambda task: task.results,
+    "batch_id": lambda task: task.batch_id,
+    "priority": lambda task: task.priority,
+    "page_count": lambda task: task.page_count,
+    "created": lambda task: _date(task.created),
+    "updated": lambda task: _date(task.updated),
+}
+
+
+def serialize_task(task: db_model_Task, fields: Optional[Set[str]] = None,
+                   timings: dict = None) -> dict:
+    """ The fields of the task, the default ones if ``fields`` is ``None``,
+    with the given ``timings`` of its last run. """
+    data = {}
+    for field in TASK_FIELDS + EXTRA_FIELDS:
+        if field not in (TASK_FIELDS if fields is None else fields):
+            continue
+        if field == "timings":
+            data[field] = timings
+        else:
+            data[field] = FIELD_VALUES[field](task)
+    return data
+
+
+def serialize_tasks(tasks: Iterable[db_model_Task],
+                    fields: Optional[Set[str]] = None) -> List[dict]:
+    """ The fields of the tasks, see :func:`serialize_task`. Their timings
+    are read at once, if asked for. Needs an app context. """
+    tasks = list(tasks)
+    timings = {}
+    if fields is None or "timings" in fields:
+        timings = load_timings(task.uid for task in tasks)
+    return [
+        serialize_task(task, fields, timings.get(task.uid))
+        for task in tasks
+    ]
+
+
+def dumps(data) -> str:
+    """ The data as compact JSON.
+
+    >>> dumps({"uid": "a", "timings": None})
+    '{"uid":"a","timings":null}'
+    """
+    if orjson is not None:
+        return orjson.dumps(data).decode()
+    return json.dumps(data, separators=(",", ":"))
+
+
+def json_response(data, status: int = 200) -> Response:
+    """ A response with the data as JSON. """
+    return Response(dumps(data), status=status, mimetype="application/json")
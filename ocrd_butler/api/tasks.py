@@ -1,40 +1,104 @@
 # -*- coding: utf-8 -*-
 
 """Restx task routes."""
+from datetime import (
+    datetime,
+    timezone,
+)
+from functools import lru_cache
 import glob
 import io
 import json
 import pathlib
 import os
 import shutil
+import time
+from typing import (
+    List,
+    Optional,
+    Tuple,
+)
+from urllib.parse import urlencode
 import uuid
 import xml.etree.ElementTree as ET
 import zipfile
 
+from celery import group
+from celery.canvas import Signature
 from flask import (
+    Response,
     current_app,
     make_response,
     jsonify,
     request,
-    send_file
+    send_file,
+    stream_with_context,
 )
 from flask_restx import (
     Resource,
     marshal
 )
 
+from sqlalchemy import (
+    and_,
+    false,
+    func,
+    or_,
+    true,
+)
+from sqlalchemy.orm import joinedload
+from werkzeug.exceptions import HTTPException
+
 from ocrd_models.ocrd_page import parse
 from ocrd_validators import ParameterValidator
 
+from ocrd_butler import celery
 from ocrd_butler.api.restx import api
-from ocrd_butler.api.models import task_model
+from ocrd_butler.api.models import (
+    task_batch_model,
+    task_model,
+)
+from ocrd_butler.api.pagination import (
+    ListingError,
+    task_filters,
+    task_page,
+)
 from ocrd_butler.api.processors import PROCESSORS_CONFIG
+from ocrd_butler.api.serializers import (
+    dumps,
+    json_response,
+    serialize_tasks,
+    task_projection,
+    task_query,
+)
 
 from ocrd_butler.database import db
 from ocrd_butler.database.models import Workflow as db_model_Workflow
 from ocrd_butler.database.models import Task as db_model_Task
+from ocrd_butler.database.models import TaskEvent as db_model_TaskEvent
 
-from ocrd_butler.execution.tasks import run_task
+from ocrd_butler.execution.checkpoints import Checkpoints
+from ocrd_butler.execution.estimate import (
+    estimate_steps,
+    learn_throughput,
+    remaining_seconds,
+)
+from ocrd_butler.execution.routing import (
+    fetch_page_counts,
+    task_queue,
+)
+from ocrd_butler.execution.states import record_queued
+from ocrd_butler.execution.stop import (
+    clear_stop,
+    request_stop,
+)
+from ocrd_butler.execution.tasks import (
+    chain_task_ids,
+    mets_cache,
+    run_task,
+    task_chain,
+    task_dir,
+)
 from ocrd_butler.util import (
     logger,
     to_json,
@@ -69,6 +133,234 @@ task_namespace = api.namespace("tasks", description="Manage OCR-D Tasks")
 # - success event could push to frontend and change rotator gif that indicates the work
 # - downloadable and (even better) live log showing
 
+@lru_cache(maxsize=None)
+def parameter_validator(processor: str) -> ParameterValidator:
+    """ The validator of the parameters of the processor, created once as
+    it compiles the schema. """
+    return ParameterValidator(PROCESSORS_CONFIG[processor])
+
+
+def task_signature(task: dict, **kwargs) -> Signature:
+    """ The Celery signature to run the task with the given arguments for
+    :func:`~ocrd_butler.execution.tasks.run_task`. With ``STEP_CHAIN``
+    configured, it is the chain of its steps, see
+    :func:`~ocrd_butler.execution.tasks.task_chain`. It is sent to the queue
+    for the priority and size of the task, see
+    :func:`~ocrd_butler.execution.routing.task_queue`. An update of the task
+    always runs as a single task. """
+    queue = task_queue(task, current_app.config)
+    if current_app.config["STEP_CHAIN"] and not kwargs.get("update"):
+        return task_chain(task, queue=queue, **kwargs)
+    signature = run_task.si(task, **kwargs)
+    return signature.set(queue=queue) if queue else signature
+
+
+def page_counts(tasks: List[dict]) -> List[Optional[int]]:
+    """ Estimate the sizes of the tasks from the number of pages in their
+    METS files, if ``TASK_ROUTING`` or ``TASK_ESTIMATE`` need them. These are kept in the
+    ``METS_CACHE_DIR``, if configured, for the workers to take them from. """
+    config = current_app.config
+    if not config["TASK_ROUTING"] and not config["TASK_ESTIMATE"]:
+        return [None] * len(tasks)
+    return fetch_page_counts(
+        [(task["src"], task["default_file_grp"] or "MAX") for task in tasks],
+        workers=config["DOWNLOAD_WORKERS"],
+        timeout=config["TASK_PAGE_COUNT_TIMEOUT"],
+        cache=mets_cache(),
+    )
+
+
+def stop_task(task: db_model_Task):
+    """ Revoke the task, with all the links of its chain if it runs as one,
+    see :func:`~ocrd_butler.execution.tasks.task_chain`, and ask the worker
+    running it to stop. """
+    task_json = task.to_json()
+    request_stop(task_dir(task_json))
+    if task.worker_task_id:
+        try:
+            celery.control.revoke(
+                chain_task_ids(task_json, task.worker_task_id)
+            )
+        except Exception as exc:
+            logger.warning(f"Can't revoke task {task.uid}: {exc}")
+    task.status = "REVOKED"
+    # States the worker sent before aren't written anymore.
+    task.status_changed = datetime.utcnow()
+    db.session.commit()
+
+
+# The throughput of the processors learned last, see processor_throughput,
+# and the estimates of the steps of the tasks with it, see _step_estimates.
+_throughput = {"learned": None, "throughput": None, "tasks": {}}
+
+
+def processor_throughput() -> dict:
+    """ The throughput of the processors in the last tasks that succeeded,
+    see :func:`~ocrd_butler.execution.estimate.learn_throughput`. It is
+    learned again after ``TASK_ESTIMATE_TTL`` seconds, forgetting the
+    estimates of the tasks. """
+    config = current_app.config
+    now = time.monotonic()
+    if _throughput["learned"] is None\
+            or now - _throughput["learned"] >= config["TASK_ESTIMATE_TTL"]:
+        results = db.session.query(db_model_Task.results)\
+            .filter(db_model_Task.status == "SUCCESS")\
+            .order_by(db_model_Task.id.desc())\
+            .limit(config["TASK_ESTIMATE_HISTORY"])
+        _throughput["throughput"] = learn_throughput(
+            results for results, in results
+        )
+        _throughput["tasks"] = {}
+        _throughput["learned"] = now
+    return _throughput["throughput"]
+
+
+def _step_estimates(task: db_model_Task, throughput: dict) -> tuple:
+    """ The estimates of the steps of the task, ``None`` without former
+    runs of its processors, its checkpoints and when its workspace was
+    prepared, by the checkpoints of its workspace if it runs. Kept for the
+    status of the task until the throughput is learned again. """
+    cached = _throughput["tasks"].get(task.uid)
+    if cached is not None and cached[0] == task.status:
+        return cached[1]
+    prepared, steps = None, []
+    if task.status == "STARTED":
+        checkpoints = Checkpoints(task_dir({"uid": task.uid})).load()
+        prepared, steps = checkpoints.data.get("prepared"), checkpoints.steps
+    estimates = estimate_steps(
+        [processor["name"] for processor in task.workflow.processors],
+        throughput,
+        prepared["pages"] if prepared else task.page_count,
+        prepared.get("megapixels") if prepared else None,
+    )
+    value = (estimates, steps, prepared["finished"] if prepared else None)
+    _throughput["tasks"][task.uid] = (task.status, value)
+    return value
+
+
+def _remaining(task: db_model_Task, throughput: dict,
+               now: float) -> Optional[Tuple[float, float]]:
+    """ The estimated duration of the task and the seconds it still takes. """
+    estimates, steps, started = _step_estimates(task, throughput)
+    if estimates is None:
+        return None
+    return sum(estimates), remaining_seconds(estimates, steps, started, now)
+
+
+def _in_queue(queue: Optional[str], config: dict):
+    """ The criterion of the tasks routed to the queue, see
+    :func:`~ocrd_butler.execution.routing.task_queue`. """
+    if not config["TASK_ROUTING"]:
+        return true()
+    priority = func.coalesce(db_model_Task.priority, 0)
+    page_count = db_model_Task.page_count
+    criteria = []
+    if queue == config["TASK_PRIORITY_QUEUE"]:
+        criteria.append(priority >= config["TASK_PRIORITY_URGENT"])
+    size_queues = config["TASK_SIZE_QUEUES"]
+    for index, (name, limit) in enumerate(size_queues):
+        if name != queue:
+            continue
+        sizes = [page_count > former for _name, former in size_queues[:index]
+                 if former is not None]
+        if any(former is None for _name, former in size_queues[:index]):
+            sizes.append(false())
+        if limit is not None:
+            sizes.append(page_count <= limit)
+        size = and_(page_count.isnot(None), *sizes)
+        if index == len(size_queues) - 1:
+            size = or_(size, page_count.is_(None))
+        criteria.append(and_(priority < config["TASK_PRIORITY_URGENT"], size))
+    return or_(*criteria) if criteria else false()
+
+
+def task_estimate(task: db_model_Task) -> Optional[dict]:
+    """ Estimate the ``duration`` of the task, the seconds it still takes
+    (``remaining``) and waits for the tasks ``queued_ahead`` of it in its
+    queue (``waiting``), and when it finishes (``eta``), if it hasn't
+    finished yet. ``None`` without former runs of its processors. """
+    if task.status not in ("CREATED", "PENDING", "STARTED"):
+        return None
+    config = current_app.config
+    throughput = processor_throughput()
+    now = time.time()
+    estimate = _remaining(task, throughput, now)
+    if estimate is None:
+        return None
+    duration, remaining = estimate
+    if task.status == "CREATED":
+        return {"duration": duration, "remaining": remaining,
+                "waiting": None, "queued_ahead": None, "eta": None}
+
+    waiting, ahead = 0.0, 0
+    if task.status == "PENDING":
+        queue = task_queue(
+            {"priority": task.priority, "page_count": task.page_count}, config
+        )
+        others = db_model_Task.query.options(
+            joinedload(db_model_Task.workflow)
+        ).filter(
+            or_(db_model_Task.status == "STARTED",
+                and_(db_model_Task.status == "PENDING",
+                     db_model_Task.id < task.id)),
+            _in_queue(queue, config),
+        )
+        for other in others:
+            ahead += 1
+            other_estimate = _remaining(other, throughput, now)
+            if other_estimate is not None:
+                waiting += other_estimate[1]
+        if config["TASK_ROUTING"]:
+            workers = config["TASK_QUEUE_WEIGHTS"].get(queue) or 1
+        else:
+            workers = config["TASK_ESTIMATE_WORKERS"]
+        waiting = round(waiting / workers, 1)
+
+    eta = datetime.fromtimestamp(now + waiting + remaining, timezone.utc)
+    return {
+        "duration": duration,
+        "remaining": round(remaining, 1),
+        "waiting": waiting,
+        "queued_ahead": ahead,
+        "eta": eta.isoformat(timespec="seconds"),
+    }
+
+
+# The parameters of the listing of tasks.
+LISTING_PARAMS = {
+    "status": "Statuses of the tasks, comma-separated.",
+    "workflow_id": "ID of the workflow of the tasks.",
+    "src": "A part of the source of the tasks.",
+    "created_after": "Tasks created since, ISO 8601.",
+    "created_before": "Tasks created before, ISO 8601.",
+    "sort": "One of id, created, updated, prefixed with \"-\" for "
+            "descending. Defaults to -id.",
+    "cursor": "The cursor of the page, given in the link to the next one.",
+    "limit": "The number of tasks of the page.",
+    "fields": "The fields of the tasks, comma-separated, e.g. workflow_id "
+              "for the ID of the workflow alone. Defaults to all but "
+              "workflow_id.",
+}
+
+
+def task_response(task_uid: str):
+    """ The task with the uid, with the ``fields`` asked for. """
+    try:
+        fields = task_projection(request.args)
+    except ListingError as exc:
+        task_namespace.abort(
+            400, "Wrong parameter.",
+            status=str(exc),
+            statusCode="400")
+    task = task_query(fields).filter_by(uid=task_uid).first()
+    if task is None:
+        task_namespace.abort(
+            404, "Wrong parameter",
+            status=f"Can't find a task with the uid \"{task_uid}\".",
+            statusCode="404")
+    return json_response(serialize_tasks([task], fields)[0])
+
+
 class TasksBase(Resource):
     """Base methods for tasks."""
 
@@ -83,16 +375,20 @@ class TasksBase(Resource):
             "download_alto",
             "download_alto_with_images",
             "log",
+            "steps",
+            "events",
         )
         self.post_actions = (
             "run",
             "rerun",
             "stop",
+            "update",
             "page_to_alto",
         )
 
-    def task_data(self, json_data):
-        """ Validate and prepare task input. """
+    def task_data(self, json_data, workflows: dict = None):
+        """ Validate and prepare task input. The ``workflows`` known already
+        can be given by their ID as string, to not look them up again. """
         data = marshal(data=json_data, fields=task_model, skip_none=False)
 
         if "parameters" not in data or data["parameters"] is None:
@@ -104,7 +400,10 @@ class TasksBase(Resource):
                                  status="Missing workflow for task.",
                                  statusCode="400")
         else:
-            workflow = db_model_Workflow.get(id=data["workflow_id"])
+            if workflows is not None:
+                workflow = workflows.get(str(data["workflow_id"]))
+            else:
+                workflow = db_model_Workflow.get(id=data["workflow_id"])
             if workflow is None:
                 task_namespace.abort(
                     400, "Wrong parameter.",
@@ -113,7 +412,7 @@ class TasksBase(Resource):
                 )
 
         for processor in data["parameters"].keys():
-            validator = ParameterValidator(PROCESSORS_CONFIG[processor])
+            validator = parameter_validator(processor)
             report = validator.validate(data["parameters"][processor])
             if not report.is_valid:
                 task_namespace.abort(
@@ -124,6 +423,7 @@ class TasksBase(Resource):
 
         data["parameters"] = json.dumps(data["parameters"])
         data["uid"] = uuid.uuid4().__str__()
+        data["priority"] = data["priority"] or 0
 
         return data
 
@@ -136,39 +436,202 @@ class TaskRoot(TasksBase):
     @api.expect(task_model)
     def post(self):
         """Create a new Task."""
-        task = db_model_Task.add(
-            **self.task_data(request.json)
-        )
+        data = self.task_data(request.json)
+        data["page_count"], = page_counts([data])
+        task = db_model_Task.add(**data)
 
-        return make_response({
+        response = {
             "message": "Task created.",
             "id": task.id,
             "uid": task.uid,
-        }, 201)
+        }
+        if current_app.config["TASK_ESTIMATE"]:
+            response["estimate"] = task_estimate(task)
+        return make_response(response, 201)
 
-    @api.doc(reponses={200: "Found"})
+    @api.doc(responses={200: "Found", 400: "Wrong parameter"},
+             params=LISTING_PARAMS)
     def get(self):
-        """ Get all tasks.
+        """ Get a page of tasks, with the timings of their last run, and the
+        link to the ``next`` page, ``None`` after the last one. All tasks
+        are streamed by ``/api/tasks/export``.
         """
-        return jsonify(
-            [
-                task.to_json()
-                for task in db_model_Task.get_all()
-            ]
+        config = current_app.config
+        limit = request.args.get("limit", config["TASK_PAGE_SIZE"], type=int)
+        limit = max(1, min(limit, config["TASK_PAGE_SIZE_MAX"]))
+        try:
+            fields = task_projection(request.args)
+            tasks, cursor = task_page(
+                task_query(fields).filter(*task_filters(request.args)),
+                request.args.get("sort", "-id"),
+                request.args.get("cursor"), limit,
+            )
+        except ListingError as exc:
+            task_namespace.abort(
+                400, "Wrong parameter.",
+                status=str(exc),
+                statusCode="400")
+        next_url = None
+        if cursor is not None:
+            args = request.args.to_dict(flat=False)
+            args["cursor"] = cursor
+            next_url = f"{request.base_url}?{urlencode(args, doseq=True)}"
+        return json_response({
+            "tasks": serialize_tasks(tasks, fields),
+            "next": next_url,
+        })
+
+
+@task_namespace.route("/export")
+class TaskExport(TasksBase):
+    """Export all tasks."""
+
+    @api.doc(responses={200: "Found", 400: "Wrong parameter"},
+             params={key: value for key, value in LISTING_PARAMS.items()
+                     if key not in ("sort", "cursor", "limit")})
+    def get(self):
+        """ Stream the tasks matching the filters of the listing in order,
+        one JSON object a line, read ``TASK_EXPORT_BATCH`` at a time.
+        """
+        try:
+            fields = task_projection(request.args)
+            filters = task_filters(request.args)
+        except ListingError as exc:
+            task_namespace.abort(
+                400, "Wrong parameter.",
+                status=str(exc),
+                statusCode="400")
+        batch = current_app.config["TASK_EXPORT_BATCH"]
+
+        def export():
+            cursor = None
+            while True:
+                tasks, cursor = task_page(
+                    task_query(fields).filter(*filters), "id", cursor, batch
+                )
+                yield "".join(
+                    dumps(task) + "\n"
+                    for task in serialize_tasks(tasks, fields)
+                )
+                # Don't keep the tasks written in the session.
+                db.session.expunge_all()
+                if cursor is None:
+                    break
+
+        return Response(stream_with_context(export()),
+                        mimetype="application/x-ndjson")
+
+
+@task_namespace.route("/batch")
+class TaskBatch(TasksBase):
+    """Create many tasks at once."""
+
+    @api.doc(responses={201: "Created", 400: "Missing parameter"})
+    @api.expect(task_batch_model)
+    def post(self):
+        """ Create the given tasks in one transaction and run them in one
+        group, if ``run`` is set. Returns the ID of the batch, to get its
+        progress from. """
+        specs = request.json.get("tasks") or []
+        if not specs:
+            task_namespace.abort(400, "Wrong parameter.",
+                                 status="Missing tasks for batch.",
+                                 statusCode="400")
+
+        workflow_ids = {str(spec.get("workflow_id")) for spec in specs}
+        workflows = {
+            str(workflow.id): workflow
+            for workflow in db_model_Workflow.query.filter(
+                db_model_Workflow.id.in_(workflow_ids)
+            )
+        }
+        batch_id = str(uuid.uuid4())
+        tasks = []
+        for index, spec in enumerate(specs):
+            try:
+                data = self.task_data(spec, workflows=workflows)
+            except HTTPException as exc:
+                task_namespace.abort(
+                    400, "Wrong parameter.",
+                    status=f"Task {index}: {exc.data['status']}",
+                    statusCode="400")
+            tasks.append(data)
+        tasks = [
+            db_model_Task.create(batch_id=batch_id, page_count=page_count,
+                                 **data)
+            for data, page_count in zip(tasks, page_counts(tasks))
+        ]
+        db.session.add_all(tasks)
+        # Serialize the tasks before the commit expires them.
+        db.session.flush()
+        tasks_json = [task.to_json() for task in tasks]
+        db.session.commit()
+        logger.info(f"Created batch {batch_id} of {len(tasks)} tasks.")
+
+        if request.json.get("run"):
+            queued = datetime.utcnow()
+            record_queued(task["uid"] for task in tasks_json)
+            results = group(
+                task_signature(task) for task in tasks_json
+            ).apply_async()
+            db.session.bulk_update_mappings(db_model_Task, [
+                {
+                    "id": task["id"],
+                    "worker_task_id": result.task_id,
+                    "status": result.status,
+                    "status_changed": queued,
+                }
+                for task, result in zip(tasks_json, results.results)
+            ])
+            db.session.commit()
+            logger.info(f"Started batch {batch_id}.")
+
+        return make_response({
+            "message": "Tasks created.",
+            "batch_id": batch_id,
+            "uids": [task["uid"] for task in tasks_json],
+        }, 201)
+
+
+@task_namespace.route("/batch/<string:batch_id>")
+class TaskBatchProgress(TasksBase):
+    """Progress of a batch of tasks."""
+
+    @api.doc(responses={200: "Found", 404: "Unknown batch"})
+    def get(self, batch_id):
+        """ Get the number of tasks of the batch per status. """
+        counts = dict(
+            db.session.query(db_model_Task.status, func.count(db_model_Task.id))
+            .filter(db_model_Task.batch_id == batch_id)
+            .group_by(db_model_Task.status)
         )
+        if not counts:
+            task_namespace.abort(
+                404, "Unknown batch.",
+                status=f"Unknown batch \"{batch_id}\".",
+                statusCode="404")
+        total = sum(counts.values())
+        finished = sum(counts.get(status, 0)
+                       for status in ("SUCCESS", "FAILURE", "REVOKED"))
+        return jsonify({
+            "batch_id": batch_id,
+            "total": total,
+            "finished": finished,
+            "status": counts,
+        })
 
 
 @task_namespace.route("/<string:task_uid>")
 class Task(TasksBase):
     """Run actions on the task."""
 
-    @api.doc(reponses={200: "Found", 404: "Unknown task"})
+    @api.doc(reponses={200: "Found", 404: "Unknown task"},
+             params={"fields": LISTING_PARAMS["fields"]})
     def get(self, task_uid=None):
         """ Get one task.
         """
         if task_uid is not None:
-            task = db_model_Task.get(uid=task_uid)
-            return jsonify(task.to_json())
+            return task_response(task_uid)
 
         task_namespace.abort(
             404, "Unknown task.",
@@ -191,6 +654,7 @@ class TaskActions(TasksBase):
         * run
         * rerun
         * stop
+        * update
         * page_to_alto
 
         TODO: Return the actions as OPTIONS.
@@ -236,6 +700,8 @@ class TaskActions(TasksBase):
         * download_page
         * download_alto
         * log
+        * steps
+        * events
 
         TODO: Return the actions as OPTIONS.
         """
@@ -276,9 +742,17 @@ class TaskActions(TasksBase):
     def run(self, task: db_model_Task):
         """ Run this task. """
         logger.info(f"Action 'run' called for task: {task.to_json()}")
-
+        return self._start(task)
+
+    def _start(self, task: db_model_Task, **kwargs):
+        """ Send the task to the workers, with the given arguments for
+        :func:`~ocrd_butler.execution.tasks.run_task`, see
+        :func:`task_signature`. """
+        clear_stop(task_dir(task.to_json()))
+        queued = datetime.utcnow()
+        record_queued([task.uid])
         # celery_worker_task = run_task(task.to_json())  # use for debugging
-        celery_worker_task = run_task.delay(task.to_json())
+        celery_worker_task = task_signature(task.to_json(), **kwargs).apply_async()
         # celery_worker_task = run_task.apply_async(args=[task.to_json()],
         #                                    countdown=20)
         # if '__dict__' in dir(celery_worker_task):
@@ -287,6 +761,8 @@ class TaskActions(TasksBase):
 
         task.worker_task_id = celery_worker_task.task_id
         task.status = celery_worker_task.status
+        # States the worker sent since are written over this one.
+        task.status_changed = queued
         db.session.commit()
 
         result = {
@@ -297,21 +773,71 @@ class TaskActions(TasksBase):
 
         return jsonify(result)
 
-    def rerun(self, task):
-        """ Run this task once again. """
-        # Basically delete all and run again.
-        raise NotImplementedError
+    def rerun(self, task: db_model_Task):
+        """ Run this task once again, resuming at the first step that didn't
+        complete in the former run. The workspace and the results of the
+        completed steps are used again. """
+        logger.info(f"Action 'rerun' called for task: {task.to_json()}")
+        if task.status in ("PENDING", "STARTED"):
+            raise Exception(f"Task {task.uid} is still running.")
+        return self._start(task, resume=True)
+
+    def update(self, task: db_model_Task):
+        """ Process the pages of the METS file of this task which are new or
+        changed since its last run, and take over the results of the other
+        pages, see :mod:`~ocrd_butler.execution.update`. """
+        logger.info(f"Action 'update' called for task: {task.to_json()}")
+        if task.status != "SUCCESS":
+            raise Exception(f"Task {task.uid} didn't succeed, run it first.")
+        return self._start(task, update=True)
+
+    def stop(self, task: db_model_Task):
+        """ Stop this task. It is revoked if it is still queued, a running
+        one stops with its current processor, which is killed along with its
+        children, see :mod:`~ocrd_butler.execution.stop`. """
+        logger.info(f"Action 'stop' called for task: {task.uid}")
+        if task.status not in ("PENDING", "STARTED"):
+            raise Exception(f"Task {task.uid} is not running.")
+        stop_task(task)
+        return jsonify({
+            "worker_task_id": task.worker_task_id,
+            "status": task.status,
+        })
 
     def status(self, task):
-        """ Get the status of this task. """
-        return jsonify({
+        """ Get the status of this task, and with ``TASK_ESTIMATE`` how long
+        it takes and when it finishes, see :func:`task_estimate`. """
+        status = {
             "status": task.status
-        })
+        }
+        if current_app.config["TASK_ESTIMATE"]:
+            status["estimate"] = task_estimate(task)
+        return jsonify(status)
 
     def results(self, task):
         """ Get the results of this task. """
         return jsonify(task.results)
 
+    def steps(self, task):
+        """ Get the steps of this task, with the resources each one used.
+
+        While the task runs, the steps are taken from its checkpoints.
+        """
+        dst_dir = f"{current_app.config['OCRD_BUTLER_RESULTS']}/{task.uid}"
+        steps = Checkpoints(dst_dir).load().steps
+        if not steps and task.results:
+            steps = task.results.get("steps", [])
+        return jsonify(steps)
+
+    def events(self, task):
+        """ Get the states of this task, when they changed and on which
+        worker. """
+        return jsonify([
+            event.to_json() for event in db_model_TaskEvent.query.filter_by(
+                task_uid=task.uid
+            ).order_by(db_model_TaskEvent.timestamp, db_model_TaskEvent.id)
+        ])
+
     def page_to_alto(self, task):
         """ Convert page files to alto. """
         page_to_alto_util(task.uid, task.results['result_dir'])
@@ -485,7 +1011,12 @@ class TaskActions(TasksBase):
 
 
     def log(self, task):
-        """ Get the log file of the task. """
+        """ Get the log file of the task.
+
+        The log is written while the task runs. To follow it, pass the
+        ``X-Log-Offset`` header of the last response as ``offset`` parameter
+        to get only the part written since then.
+        """
         log_file_path = pathlib.Path(
             f"{current_app.config['LOGGER_PATH']}/task-{task.uid}.log"
         )
@@ -500,15 +1031,18 @@ class TaskActions(TasksBase):
                 "msg": f"Can't find log file for task {task.uid}"
             })
 
-        with open(log_file_path, 'r') as fh:
+        offset = request.args.get("offset", 0, type=int)
+        with open(log_file_path, 'rb') as fh:
+            fh.seek(max(offset, 0))
             data = fh.read()
-            fh.close()
+            offset = fh.tell()
 
-        response = make_response(str(data), 200)
+        response = make_response(data.decode("utf-8", errors="replace"), 200)
         response.mimetype = "text/txt"
         response.headers.extend({
             "Content-Disposition":
-            "attachment;filename=fulltext_%s.txt" % task.uid
+            "attachment;filename=fulltext_%s.txt" % task.uid,
+            "X-Log-Offset": str(offset),
         })
         return response
 
@@ -519,14 +1053,7 @@ class Task(TasksBase):
     @api.doc(responses={200: "OK", 400: "Unknown task uid"})
     def get(self, task_uid):
         """Get the task by given uid."""
-        task = db_model_Task.query.filter_by(uid=task_uid).first()
-        if task is None:
-            task_namespace.abort(
-                404, "Wrong parameter",
-                status=f"Can't find a task with the uid \"{task_uid}\".",
-                statusCode="404")
-
-        return jsonify(task.to_json())
+        return task_response(task_uid)
 
     @api.doc(responses={200: "OK", 404: "Unknown task uid"})
     def put(self, task_uid):
@@ -540,7 +1067,7 @@ class Task(TasksBase):
                 status=f"Can't find a task with the uid \"{task_uid}\".",
                 statusCode="404")
 
-        fields = task.to_json().keys()
+        fields = task.to_json().keys() - {"created", "updated"}
         for field in fields:
             if field in request.json:
                 setattr(task, field, request.json[field])
@@ -563,12 +1090,16 @@ class Task(TasksBase):
                 status=f"Can't find a task with the uid \"{task_uid}\".",
                 statusCode="404")
 
+        if task.status in ("PENDING", "STARTED"):
+            stop_task(task)
+
         result_dir = f"{current_app.config['OCRD_BUTLER_RESULTS']}/{task.uid}"
         if os.path.exists(result_dir):
             shutil.rmtree(result_dir, ignore_errors=True)
             logger.info(f"Result dir '{result_dir}' deleted.")
 
         res.delete()
+        db_model_TaskEvent.query.filter_by(task_uid=task_uid).delete()
         message = f"Task \"{task.uid}\" deleted."
         db.session.commit()
 
@@ -31,12 +31,160 @@ class Config(object):
     """
     DEBUG = False
     SQLALCHEMY_DATABASE_URI = None
+    # Apply the migrations of the database missing when the app starts, in
+    # every process of the app and the workers, see
+    # ``ocrd_butler.database.migrations``. Without, run ``make migrate``
+    # after an update, before the app and the workers start.
+    DATABASE_MIGRATE = False
     CELERY_RESULT_BACKEND_URL = "redis://localhost:6379"
     CELERY_BROKER_URL = "redis://localhost:6379"
     OCRD_BUTLER_RESULTS = "/data/ocrd_butler_results"
     SBB_CONTENT_SERVER_HOST = "content.staatsbibliothek-berlin.de"
     LOGGER_PATH = "/data/log"
 
+    # Parallel image downloads while preparing the workspace of a task.
+    DOWNLOAD_WORKERS = 8
+    DOWNLOAD_RETRIES = 3
+    DOWNLOAD_TIMEOUT = 60
+    DOWNLOAD_DEFAULT_HOST_CONCURRENCY = 4
+    DOWNLOAD_HOST_CONCURRENCY = {
+        SBB_CONTENT_SERVER_HOST: 8,
+    }
+
+    # Images shared between the tasks of a worker host, keyed by URL and
+    # content. Set a directory, ideally on the file system of the results,
+    # to enable it. Entries older than the maximal age (seconds) are fetched
+    # again, ``None`` keeps them until they are evicted.
+    IMAGE_CACHE_DIR = None
+    IMAGE_CACHE_MAX_SIZE = 50 * 1024 ** 3
+    IMAGE_CACHE_MAX_AGE = None
+
+    # METS files of the tasks, keyed by URL, along with a summary of their
+    # pages and files. Set a directory to enable it. They are revalidated
+    # with conditional requests if they were older than the maximal age
+    # (seconds), so unchanged ones aren't downloaded again.
+    METS_CACHE_DIR = None
+    METS_CACHE_MAX_SIZE = 5 * 1024 ** 3
+    METS_CACHE_MAX_AGE = 0
+
+    # Output files of workflow steps per page, keyed by the processor
+    # version, its parameters and the content of the input files, so pages
+    # processed the same way before are not processed again. Set a directory
+    # to enable it. Only used if the steps are not pipelined.
+    STEP_CACHE_DIR = None
+    STEP_CACHE_MAX_SIZE = 100 * 1024 ** 3
+
+    # Stream batches of this many pages through the steps of a workflow, so
+    # that a batch is in step k+1 while the next one is still in step k. A
+    # step holds at most ``PIPELINE_QUEUE_SIZE`` batches finished by the
+    # previous step. ``None`` runs the steps one after the other.
+    PIPELINE_BATCH_SIZE = None
+    PIPELINE_QUEUE_SIZE = 2
+
+    # The output of the processors goes to the task log while they run, only
+    # its last bytes are kept in memory, e.g. for the error of a failed step.
+    PROCESSOR_OUTPUT_LIMIT = 1024 ** 2
+
+    # Run tasks in workspaces on local scratch space, e.g. an SSD or tmpfs,
+    # instead of ``OCRD_BUTLER_RESULTS``. Only the METS file, the images of
+    # the task, the output of its last step and the file groups below are
+    # published there when it succeeded. Not used with ``STEP_CHAIN``.
+    SCRATCH_DIR = None
+    SCRATCH_PUBLISH_FILE_GRPS = []
+
+    # Run every step of a workflow as a Celery task of its own, routed to
+    # the ``queue`` of its processor (see ``PROCESSOR_SETTINGS``). Preparing
+    # and finishing a task, and steps without a queue, go to
+    # ``STEP_CHAIN_QUEUE``, ``None`` being the default queue. All workers
+    # have to share ``OCRD_BUTLER_RESULTS``. Steps are not pipelined then.
+    STEP_CHAIN = False
+    STEP_CHAIN_QUEUE = None
+
+    # Send tasks to queues by their priority and size, instead of all of
+    # them to the default queue. Tasks with a priority of at least
+    # ``TASK_PRIORITY_URGENT`` go to ``TASK_PRIORITY_QUEUE``, the others to
+    # the first of the ``TASK_SIZE_QUEUES`` whose limit is not below the
+    # number of pages of the task, counted in its METS file when it is
+    # created. Tasks of unknown size go to the last one. Every queue gets
+    # as many worker processes as its weight in ``TASK_QUEUE_WEIGHTS`` with
+    # ``make run-celery-queues``, so big tasks keep their share of workers.
+    TASK_ROUTING = False
+    TASK_PRIORITY_URGENT = 5
+    TASK_PRIORITY_QUEUE = "urgent"
+    TASK_SIZE_QUEUES = [
+        ("small", 50),
+        ("medium", 500),
+        ("large", None),
+    ]
+    TASK_QUEUE_WEIGHTS = {
+        "urgent": 2,
+        "small": 4,
+        "medium": 2,
+        "large": 2,
+    }
+    TASK_PAGE_COUNT_TIMEOUT = 10
+
+    # Estimate how long tasks take and when they finish, from the throughput
+    # of the processors in the last ``TASK_ESTIMATE_HISTORY`` tasks that
+    # succeeded, learned again after ``TASK_ESTIMATE_TTL`` seconds, along
+    # with the estimates of the steps of the tasks, by the checkpoints of
+    # the running ones. The pages of a task are counted when it is created
+    # then. The tasks queued ahead of a task are shared by the worker
+    # processes of its queue, its weight in ``TASK_QUEUE_WEIGHTS`` with
+    # ``TASK_ROUTING`` or else ``TASK_ESTIMATE_WORKERS``.
+    TASK_ESTIMATE = False
+    TASK_ESTIMATE_HISTORY = 200
+    TASK_ESTIMATE_TTL = 60
+    TASK_ESTIMATE_WORKERS = 1
+
+    # Where the workers send the states of their tasks to be written to the
+    # database in batches of up to ``TASK_STATE_BATCH_SIZE``, gathered for
+    # ``TASK_STATE_INTERVAL`` seconds: ``None`` writes every state at once,
+    # ``"local"`` writes them in a thread of every worker process, which
+    # waits for them when a task finished and before it exits, a Redis URL
+    # pushes them to a list drained by a single writer
+    # (``make run-state-writer``). The states gathered by a worker process
+    # that is killed are lost with ``"local"``, and the ones in Redis until
+    # the writer runs are written late.
+    TASK_STATE_CHANNEL = None
+    TASK_STATE_BATCH_SIZE = 100
+    TASK_STATE_INTERVAL = 0.5
+
+    # The tasks of a page of ``GET /api/tasks`` if no ``limit`` is given, and
+    # the most a page may have. ``/api/tasks/export`` streams all of them,
+    # reading ``TASK_EXPORT_BATCH`` at a time.
+    TASK_PAGE_SIZE = 50
+    TASK_PAGE_SIZE_MAX = 500
+    TASK_EXPORT_BATCH = 1000
+
+    # Seconds a processor may run besides its ``timeout_per_page`` (see
+    # ``PROCESSOR_SETTINGS``) for every page, before it is killed.
+    PROCESSOR_TIMEOUT_BASE = 60
+
+    # Run a processor only if the host has the cores and memory it needs,
+    # given by ``cores`` and ``memory`` (bytes) in ``PROCESSOR_SETTINGS`` or
+    # learned from its former runs, the defaults below before its first one.
+    # A processor busy with all the cores it was limited to gets one more.
+    # Set a directory on the host, shared by its workers, to enable it. The
+    # resources of the host are detected if not set.
+    HOST_RESOURCES_DIR = None
+    HOST_CORES = None
+    HOST_MEMORY = None
+    PROCESSOR_DEFAULT_CORES = 1
+    PROCESSOR_DEFAULT_MEMORY = 2 * 1024 ** 3
+    # Bind every processor to as many CPUs as it reserved cores, spread over
+    # the CPUs of the host.
+    PIN_CPUS = False
+
+    # Processors running at once on the host, e.g. the concurrency of its
+    # workers, to limit the threads of processors to their share of its cores
+    # without ``HOST_RESOURCES_DIR`` (see ``threads`` of
+    # ``PROCESSOR_SETTINGS``). No limit if not set.
+    PROCESSOR_CONCURRENCY = None
+
+    # Resident workers kept per worker process, see ``PROCESSOR_SETTINGS``.
+    RESIDENT_WORKERS_MAX = 4
+
     PROCESSORS = [
         "ocrd-eynollah-segment",
 
@@ -124,6 +272,25 @@ class Config(object):
         "ocrd-dummy",
     ]
 
+    # Overrides of the processor defaults, taken over into the processors of
+    # new workflows. Besides the processor specification, the butler knows:
+    # * ``parallel``: number of page ranges of a step processed at once, each
+    #   by its own subprocess (defaults to 1). With ``PIPELINE_BATCH_SIZE``
+    #   it is the number of batches the step processes at once.
+    # * ``resident``: the processor class as ``module:Class``, e.g.
+    #   ``ocrd.processor.builtin.dummy_processor:DummyProcessor``. The
+    #   processor is then kept loaded by a resident worker process for every
+    #   set of parameters, instead of starting its executable for every step.
+    #   There are at most ``RESIDENT_WORKERS_MAX`` of them per worker process.
+    # * ``queue``: the Celery queue the steps of the processor are sent to
+    #   with ``STEP_CHAIN``, e.g. for workers with enough memory for it.
+    # * ``timeout_per_page``: seconds the processor may take per page, on
+    #   top of ``PROCESSOR_TIMEOUT_BASE``. It is killed after that and the
+    #   step fails. Runs without a time limit by default.
+    # * ``threads``: threads the processor may start, set as
+    #   ``OMP_THREAD_LIMIT``, ``OMP_NUM_THREADS``, ``TF_NUM_INTRAOP_THREADS``
+    #   and the like. Defaults to the cores it reserved with
+    #   ``HOST_RESOURCES_DIR``, or its share of ``PROCESSOR_CONCURRENCY``.
     PROCESSOR_SETTINGS = {
         "ocrd-calamari-recognize": {
             "parameters": {
@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+
+"""Migrations of the schema of the database.
+
+``db.create_all`` creates the tables missing, but doesn't change the ones
+there. Every migration below brings the tables of a former version of the
+butler up to date, and is applied once, in order, recorded in the table
+``schema_migrations``. The steps of a migration look at the tables first,
+so a database created with the current models is left as it is.
+
+Run with ``python -m ocrd_butler.database.migrations`` (i.e. ``make
+migrate``) before the app and the workers start, or at the start of the app
+with ``DATABASE_MIGRATE``. Processes starting at once apply them one after
+the other, locked by a file on the host, see :func:`migration_lock`.
+"""
+
+from contextlib import contextmanager
+from datetime import datetime
+import fcntl
+import hashlib
+import os
+import tempfile
+from typing import (
+    Callable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    bindparam,
+    inspect,
+    or_,
+    select,
+    text,
+)
+from sqlalchemy.engine import (
+    Connection,
+    Engine,
+)
+from sqlalchemy.exc import (
+    OperationalError,
+    ProgrammingError,
+)
+
+from ocrd_butler.database.models import Task as db_model_Task
+from ocrd_butler.util import logger
+
+
+class MigrationError(Exception):
+    """ Raised if a migration can't be applied to the data in the
+    database. """
+
+
+schema_migrations = Table(
+    "schema_migrations", MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("description", String(255)),
+    Column("applied", DateTime),
+)
+
+
+def add_columns(connection: Connection, table: Table, *names: str):
+    """ Add the columns of the model table with the given names if they
+    are missing. """
+    existing = {
+        column["name"] for column in inspect(connection).get_columns(
+            table.name
+        )
+    }
+    for name in names:
+        if name in existing:
+            continue
+        column = table.columns[name]
+        column_type = column.type.compile(dialect=connection.dialect)
+        try:
+            connection.execute(
+                f"ALTER TABLE {table.name} ADD COLUMN {name} {column_type}"
+            )
+        except (OperationalError, ProgrammingError):
+            # Added by another process in the meantime.
+            if name not in {column["name"] for column in
+                            inspect(connection).get_columns(table.name)}:
+                raise
+
+
+def create_indexes(connection: Connection, table: Table, *names: str):
+    """ Create the indexes of the model table with the given names if they
+    are missing. """
+    existing = {
+        index["name"] for index in inspect(connection).get_indexes(table.name)
+    }
+    indexes = {index.name: index for index in table.indexes}
+    for name in names:
+        if name in existing:
+            continue
+        try:
+            indexes[name].create(bind=connection)
+        except (OperationalError, ProgrammingError):
+            # Created by another process in the meantime.
+            if name not in {index["name"] for index in
+                            inspect(connection).get_indexes(table.name)}:
+                raise
+
+
+def task_batches(connection: Connection):
+    """ The columns of the batches and the priorities of tasks. """
+    tasks = db_model_Task.__table__
+    add_columns(connection, tasks, "batch_id", "priority")
+    connection.execute("UPDATE tasks SET priority = 0 WHERE priority IS NULL")
+    create_indexes(connection, tasks, "ix_tasks_batch_id")
+
+
+def task_page_count(connection: Connection):
+    """ The column of the page counts of tasks. """
+    add_columns(connection, db_model_Task.__table__, "page_count")
+
+
+def task_status_changed(connection: Connection):
+    """ The column of the time of the last status of tasks. """
+    add_columns(connection, db_model_Task.__table__, "status_changed")
+
+
+def task_indexes(connection: Connection):
+    """ The indexes of the lookups of tasks. """
+    duplicates = connection.execute(
+        "SELECT uid, COUNT(*) AS count FROM tasks GROUP BY uid "
+        "HAVING COUNT(*) > 1 ORDER BY uid"
+    ).fetchall()
+    if duplicates:
+        listed = ", ".join(f"{row.uid} ({row.count} times)"
+                           for row in duplicates[:10])
+        raise MigrationError(
+            f"The index ix_tasks_uid needs unique uids of tasks, but "
+            f"{len(duplicates)} are used more than once: {listed}. Delete "
+            "or rename the tasks with these uids and migrate again."
+        )
+    create_indexes(
+        connection, db_model_Task.__table__, "ix_tasks_uid",
+        "ix_tasks_workflow_id", "ix_tasks_worker_task_id",
+        "ix_tasks_status_id",
+    )
+
+
+def task_timestamps(connection: Connection):
+    """ When tasks were created and updated, taken from their first and
+    last event for the tasks there, if any. """
+    tasks = db_model_Task.__table__
+    add_columns(connection, tasks, "created", "updated")
+    connection.execute(
+        "UPDATE tasks SET created = (SELECT MIN(timestamp) FROM task_events "
+        "WHERE task_events.task_uid = tasks.uid) WHERE created IS NULL"
+    )
+    connection.execute(
+        "UPDATE tasks SET updated = (SELECT MAX(timestamp) FROM task_events "
+        "WHERE task_events.task_uid = tasks.uid) WHERE updated IS NULL"
+    )
+    create_indexes(connection, tasks, "ix_tasks_created", "ix_tasks_updated")
+
+
+def _result_times(results) -> List[float]:
+    """ The times the workspace of a task was prepared and its steps
+    finished, by the checkpoints in its results. """
+    if not isinstance(results, dict):
+        return []
+    checkpoints = [results.get("prepared")] + list(results.get("steps") or [])
+    return [
+        checkpoint["finished"] for checkpoint in checkpoints
+        if isinstance(checkpoint, dict)
+        and isinstance(checkpoint.get("finished"), (int, float))
+    ]
+
+
+def task_timestamps_fallback(connection: Connection):
+    """ When the tasks without events were created and updated, taken from
+    the checkpoints in their results and the time of their last status.
+    Tasks without any are taken as created when the next task with a time
+    was, or now, to keep their order. """
+    tasks = db_model_Task.__table__
+    rows = connection.execute(
+        select([tasks.c.id, tasks.c.results, tasks.c.status_changed,
+                tasks.c.created, tasks.c.updated])
+        .where(or_(tasks.c.created.is_(None), tasks.c.updated.is_(None)))
+    ).fetchall()
+    for row in rows:
+        times = [datetime.utcfromtimestamp(value)
+                 for value in _result_times(row.results)]
+        if row.status_changed is not None:
+            times.append(row.status_changed)
+        if not times:
+            continue
+        connection.execute(
+            tasks.update().where(tasks.c.id == row.id).values(
+                created=row.created or min(times),
+                updated=row.updated or max(times),
+            )
+        )
+    connection.execute(
+        "UPDATE tasks SET created = (SELECT MIN(later.created) FROM tasks "
+        "AS later WHERE later.id > tasks.id AND later.created IS NOT NULL) "
+        "WHERE created IS NULL"
+    )
+    connection.execute(
+        text("UPDATE tasks SET created = :now WHERE created IS NULL")
+        .bindparams(bindparam("now", datetime.utcnow(), type_=DateTime))
+    )
+    connection.execute(
+        "UPDATE tasks SET updated = created WHERE updated IS NULL"
+    )
+
+
+# The migrations in order, by their version.
+MIGRATIONS: List[Tuple[int, Callable[[Connection], None]]] = [
+    (1, task_batches),
+    (2, task_page_count),
+    (3, task_status_changed),
+    (4, task_indexes),
+    (5, task_timestamps),
+    (6, task_timestamps_fallback),
+]
+
+
+def applied_versions(connection: Connection) -> set:
+    """ The versions of the migrations applied to the database. """
+    return {
+        row.version
+        for row in connection.execute(schema_migrations.select())
+    }
+
+
+def lock_path(engine: Engine) -> str:
+    """ The file locking the migrations of the database of the engine, next
+    to a SQLite database or else in the temporary directory. """
+    url = engine.url
+    if url.get_backend_name() == "sqlite" and url.database \
+            and url.database != ":memory:":
+        return f"{os.path.abspath(url.database)}.migrate.lock"
+    digest = hashlib.sha256(str(url).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(tempfile.gettempdir(),
+                        f"ocrd_butler-migrate-{digest}.lock")
+
+
+@contextmanager
+def migration_lock(engine: Engine, path: Optional[str] = None
+                   ) -> Iterator[None]:
+    """ Lock the migrations of the database against the other processes on
+    the host, by the file at ``path``, see :func:`lock_path`. """
+    with open(path or lock_path(engine), "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def upgrade(engine: Engine) -> List[int]:
+    """ Apply the migrations missing in the database, each in a
+    transaction of its own, one process at a time. The tables of the models
+    have to be created before. Returns the versions applied. """
+    with migration_lock(engine):
+        schema_migrations.create(bind=engine, checkfirst=True)
+        with engine.connect() as connection:
+            applied = applied_versions(connection)
+        done = []
+        for version, migration in MIGRATIONS:
+            if version in applied:
+                continue
+            description = " ".join(migration.__doc__.split())
+            logger.info(f"Migrate the database to version {version}: "
+                        f"{description}")
+            with engine.begin() as connection:
+                migration(connection)
+                connection.execute(schema_migrations.insert().values(
+                    version=version, description=description,
+                    applied=datetime.utcnow(),
+                ))
+            done.append(version)
+    return done
+
+
+if __name__ == "__main__":
+    from ocrd_butler.app import flask_app
+    from ocrd_butler.database import db
+    with flask_app.app_context():
+        db.create_all()
+        versions = upgrade(db.get_engine(flask_app))
+    print(f"Applied migrations: {versions or 'none'}")
@@ -1,6 +1,10 @@
 # -*- coding: utf-8 -*-
 """OCRD Butler database models."""
 
+from datetime import (
+    datetime,
+    timezone,
+)
 from typing import List
 import uuid
 
@@ -15,17 +19,34 @@ from ocrd_butler.util import (
 class Task(db.Model):
     """ Database model for our tasks. """
     __tablename__ = "tasks"
+    # Changes of the schema need a migration in ``migrations.py``.
+    __table_args__ = (
+        # Tasks by status in order, e.g. the ones queued ahead of a task.
+        db.Index("ix_tasks_status_id", "status", "id"),
+    )
     id = db.Column(db.Integer, primary_key=True)
-    uid = db.Column(db.String(64))
+    uid = db.Column(db.String(64), unique=True, index=True)
     src = db.Column(db.String(255))
-    workflow_id = db.Column(db.Integer, db.ForeignKey('workflows.id'))
+    workflow_id = db.Column(db.Integer, db.ForeignKey('workflows.id'),
+                            index=True)
     description = db.Column(db.String(1024))
     parameters = db.Column(db.JSON)
     default_file_grp = db.Column(db.String(64))
-    worker_task_id = db.Column(db.String(64))
+    worker_task_id = db.Column(db.String(64), index=True)
     status = db.Column(db.String(64))
     # Change this "results" to postres specific JSON, if we switch.
     results = db.Column(db.JSON)
+    # Tasks submitted together, see ``POST /api/tasks/batch``.
+    batch_id = db.Column(db.String(64), index=True)
+    priority = db.Column(db.Integer, default=0)
+    # Number of pages in the METS file when the task was created.
+    page_count = db.Column(db.Integer)
+    # When the worker changed the status last, see
+    # ``ocrd_butler.execution.states``.
+    status_changed = db.Column(db.DateTime)
+    created = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    updated = db.Column(db.DateTime, default=datetime.utcnow,
+                        onupdate=datetime.utcnow, index=True)
 
     workflow = db.relationship(
         "Workflow",
@@ -35,7 +56,8 @@ class Task(db.Model):
     def __init__(
         self, src, workflow_id, uid=None, parameters={}, description="",
         default_file_grp="MAX", worker_task_id=None,
-        status="CREATED", results={}
+        status="CREATED", results={}, batch_id=None, priority=0,
+        page_count=None
     ):
         if uid is None:
             uid = uuid.uuid4().__str__()
@@ -48,6 +70,9 @@ class Task(db.Model):
         self.worker_task_id = worker_task_id
         self.status = status
         self.results = results
+        self.batch_id = batch_id
+        self.priority = priority
+        self.page_count = page_count
 
     def to_json(self):
         return {
@@ -61,6 +86,13 @@ class Task(db.Model):
             "worker_task_id": self.worker_task_id,
             "status": self.status,
             "results": self.results,
+            "batch_id": self.batch_id,
+            "priority": self.priority,
+            "page_count": self.page_count,
+            "created": self.created and self.created.replace(
+                tzinfo=timezone.utc).isoformat(),
+            "updated": self.updated and self.updated.replace(
+                tzinfo=timezone.utc).isoformat(),
         }
 
     def __repr__(self):
@@ -73,6 +105,37 @@ class Task(db.Model):
         # self.uid, self.src, self.workflow.name, desc)
 
 
+class TaskEvent(db.Model):
+    """ Database model for the states of the tasks, one for every change,
+    see ``ocrd_butler.execution.states``. """
+    __tablename__ = "task_events"
+    id = db.Column(db.Integer, primary_key=True)
+    task_uid = db.Column(db.String(64), index=True)
+    state = db.Column(db.String(64))
+    timestamp = db.Column(db.DateTime)
+    # The worker the task ran on, if sent by one.
+    hostname = db.Column(db.String(255))
+
+    def __init__(self, task_uid, state, timestamp, hostname=None):
+        self.task_uid = task_uid
+        self.state = state
+        self.timestamp = timestamp
+        self.hostname = hostname
+
+    def to_json(self):
+        return {
+            "state": self.state,
+            "timestamp": self.timestamp.replace(
+                tzinfo=timezone.utc).isoformat(),
+            "hostname": self.hostname,
+        }
+
+    def __repr__(self):
+        return "TaskEvent {0} - {1} at {2}".format(
+            self.task_uid, self.state, self.timestamp
+        )
+
+
 class Workflow(db.Model):
     """ Database model for our workflow.
 
@@ -172,7 +235,7 @@ def _add_model_operations():
     """ equip both db model classes with convenience functions for creation,
     deletion, item count, and so on.
     """
-    for model in [Task, Workflow]:
+    for model in [Task, TaskEvent, Workflow]:
         model.save = save
         for func in [
             get, create, add, count, delete, get_all
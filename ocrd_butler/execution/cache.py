@@ -0,0 +1,393 @@
+# -*- coding: utf-8 -*-
+
+"""Worker side caches shared between tasks."""
+
+from contextlib import contextmanager
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from typing import (
+    Callable,
+    Iterator,
+    List,
+    Optional,
+)
+
+from ocrd_models.utils import handle_oai_response
+import requests
+
+from ocrd_butler.execution.mets import summarize_mets
+from ocrd_butler.util import logger
+
+
+def sha256_file(path: str) -> str:
+    """ Get the SHA-256 hex digest of the file content. """
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(65536), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def sha256_str(value: str) -> str:
+    """ Get the SHA-256 hex digest of a string.
+
+    >>> sha256_str('foo')[:8]
+    '2c26b46b'
+    """
+    return hashlib.sha256(value.encode("utf-8")).hexdigest()
+
+
+# The ioctl cloning a file on Linux, see ioctl_ficlone(2).
+FICLONE = 0x40049409
+
+
+def clone_or_copy(src: str, dst: str):
+    """ Copy ``src`` to ``dst``, sharing the data if the file system can.
+
+    Tries a reflink first, which only Btrfs, XFS and the like support. Then
+    the content is copied with ``copy_file_range``, which stays in the
+    kernel, and finally with a plain copy. Unlike a hardlink, the copy is a
+    file of its own, so writing to it or changing its mode leaves ``src``
+    as it is.
+    """
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    if os.path.exists(dst):
+        os.remove(dst)
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            return
+        except OSError:
+            pass
+        if hasattr(os, "copy_file_range"):
+            try:
+                remaining = os.fstat(fsrc.fileno()).st_size
+                while remaining > 0:
+                    copied = os.copy_file_range(
+                        fsrc.fileno(), fdst.fileno(), remaining)
+                    if copied == 0:
+                        break
+                    remaining -= copied
+                if remaining == 0:
+                    return
+            except OSError:
+                pass
+            fsrc.seek(0)
+            fdst.seek(0)
+            fdst.truncate()
+        shutil.copyfileobj(fsrc, fdst)
+
+
+class ContentCache(object):
+    """ Size bounded store of files addressed by the hash of their content,
+    shared by all worker processes on a host.
+
+    Objects are evicted least recently used first; every hit refreshes the
+    modification time of the object.
+    """
+
+    def __init__(self, directory: str, max_size: int):
+        self.directory = directory
+        self.max_size = max_size
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        for subdir in ("objects", "index", "locks", "tmp"):
+            os.makedirs(os.path.join(directory, subdir), exist_ok=True)
+
+    def object_path(self, digest: str) -> str:
+        """ Path of the object with the given content hash. """
+        return os.path.join(self.directory, "objects", digest[:2], digest)
+
+    def index_path(self, key: str) -> str:
+        """ Path of the index entry for the given key. """
+        return os.path.join(self.directory, "index", f"{sha256_str(key)}.json")
+
+    def read_entry(self, key: str) -> Optional[dict]:
+        """ Read the index entry of the key, if there is one. """
+        try:
+            with open(self.index_path(key), "r") as fh:
+                return json.load(fh)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def write_entry(self, key: str, entry: dict):
+        """ Write the index entry of the key atomically. """
+        fd, tmp = tempfile.mkstemp(dir=os.path.join(self.directory, "tmp"))
+        with os.fdopen(fd, "w") as fh:
+            json.dump(entry, fh)
+        os.replace(tmp, self.index_path(key))
+
+    def add_object(self, path: str) -> str:
+        """ Move the file at ``path`` into the store and return its hash. """
+        digest = sha256_file(path)
+        dst = self.object_path(digest)
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        if os.path.exists(dst):
+            os.remove(path)
+            os.utime(dst)
+        else:
+            os.chmod(path, 0o444)
+            os.replace(path, dst)
+        return digest
+
+    def touch(self, digest: str) -> Optional[str]:
+        """ Mark the object as used and return its path, or ``None`` if it
+        has been evicted. """
+        path = self.object_path(digest)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    @contextmanager
+    def lock(self, key: str) -> Iterator[None]:
+        """ Lock the key against other threads and processes. """
+        name = sha256_str(key)
+        with self._locks_lock:
+            thread_lock = self._locks.setdefault(name, threading.Lock())
+        with thread_lock:
+            lock_path = os.path.join(self.directory, "locks", f"{name}.lock")
+            with open(lock_path, "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def size(self) -> int:
+        """ Summed up size of all objects in bytes. """
+        total = 0
+        for root, _dirs, files in os.walk(
+                os.path.join(self.directory, "objects")):
+            for name in files:
+                total += os.stat(os.path.join(root, name)).st_size
+        return total
+
+    def evict(self) -> int:
+        """ Remove the least recently used objects until the store fits into
+        ``max_size``. Returns the number of removed objects. """
+        objects = []
+        total = 0
+        for root, _dirs, files in os.walk(
+                os.path.join(self.directory, "objects")):
+            for name in files:
+                path = os.path.join(root, name)
+                stat = os.stat(path)
+                objects.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+        removed = 0
+        for _mtime, size, path in sorted(objects):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+        if removed:
+            logger.info(f"Evicted {removed} objects from cache {self.directory}.")
+        return removed
+
+
+class ImageCache(ContentCache):
+    """ Cache for the images downloaded into the workspaces of the tasks,
+    keyed by their URL and the hash of their content.
+
+    Concurrent requests for the same URL are coalesced, so an image is only
+    downloaded once even if several tasks for the same work run at once.
+    Entries older than ``max_age`` seconds are fetched again.
+    """
+
+    def __init__(self, directory: str, max_size: int, max_age: int = None):
+        super().__init__(directory, max_size)
+        self.max_age = max_age
+
+    def lookup(self, url: str) -> Optional[str]:
+        """ Get the path of the cached image for the URL or ``None``. """
+        entry = self.read_entry(url)
+        if entry is None:
+            return None
+        if self.max_age is not None and\
+                time.time() - entry["fetched"] > self.max_age:
+            return None
+        return self.touch(entry["sha256"])
+
+    def fetch(self, url: str, download: Callable[[str, str], None]) -> str:
+        """ Get the path of the cached image for the URL, calling
+        ``download(url, path)`` to fetch it on a miss.
+        """
+        path = self.lookup(url)
+        if path is not None:
+            return path
+        with self.lock(url):
+            # Someone else may have fetched it while we were waiting.
+            path = self.lookup(url)
+            if path is not None:
+                return path
+            fd, tmp = tempfile.mkstemp(dir=os.path.join(self.directory, "tmp"))
+            os.close(fd)
+            try:
+                download(url, tmp)
+                digest = self.add_object(tmp)
+            finally:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+            self.write_entry(url, {
+                "url": url,
+                "sha256": digest,
+                "fetched": time.time(),
+            })
+            return self.object_path(digest)
+
+
+class StepCache(ContentCache):
+    """ Cache for the output files of workflow steps, per page, keyed by the
+    processor, its version and parameters and the content of the input
+    files of the page. See :mod:`~ocrd_butler.execution.memoize`.
+
+    The numbers of hits and misses of all tasks are kept in ``stats.json``.
+    """
+
+    def lookup(self, key: str) -> Optional[List[dict]]:
+        """ Get the cached output files of the key, each one with the
+        ``path`` of its content, or ``None`` if any of them was evicted. """
+        entry = self.read_entry(key)
+        if entry is None:
+            return None
+        files = []
+        for cached_file in entry["files"]:
+            path = self.touch(cached_file["sha256"])
+            if path is None:
+                return None
+            files.append(dict(cached_file, path=path))
+        return files
+
+    def store(self, key: str, files: List[dict]):
+        """ Store the output files of the key. Every file is a dict of the
+        attributes to register it with and the ``path`` of its content. """
+        entry = []
+        for output_file in files:
+            fd, tmp = tempfile.mkstemp(dir=os.path.join(self.directory, "tmp"))
+            os.close(fd)
+            try:
+                clone_or_copy(output_file["path"], tmp)
+                digest = self.add_object(tmp)
+            finally:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+            cached_file = dict(output_file, sha256=digest)
+            del cached_file["path"]
+            entry.append(cached_file)
+        self.write_entry(key, {"files": entry, "stored": time.time()})
+
+    def record(self, hits: int, misses: int) -> dict:
+        """ Add to the statistics and return them. """
+        path = os.path.join(self.directory, "stats.json")
+        with self.lock("stats"):
+            try:
+                with open(path, "r") as fh:
+                    stats = json.load(fh)
+            except (FileNotFoundError, ValueError):
+                stats = {"hits": 0, "misses": 0}
+            stats["hits"] += hits
+            stats["misses"] += misses
+            fd, tmp = tempfile.mkstemp(dir=os.path.join(self.directory, "tmp"))
+            with os.fdopen(fd, "w") as fh:
+                json.dump(stats, fh)
+            os.replace(tmp, path)
+        return stats
+
+
+class MetsCache(ContentCache):
+    """ Cache for the METS files of the tasks, keyed by their URL, along with
+    a summary of their pages and files, see
+    :func:`~ocrd_butler.execution.mets.summarize_mets`.
+
+    Cached METS files are revalidated with a conditional request (by their
+    ``ETag`` and ``Last-Modified`` headers) and only downloaded again if
+    they changed. Entries revalidated less than ``max_age`` seconds ago are
+    used as they are.
+    """
+
+    def __init__(self, directory: str, max_size: int, max_age: int = 0):
+        super().__init__(directory, max_size)
+        self.max_age = max_age
+
+    def lookup(self, url: str) -> Optional[dict]:
+        """ Get the entry of the URL with the ``path`` of the cached METS
+        file, or ``None``. """
+        entry = self.read_entry(url)
+        if entry is None:
+            return None
+        path = self.touch(entry["sha256"])
+        if path is None:
+            return None
+        return dict(entry, path=path)
+
+    def fetch(self, url: str, timeout: int = 60) -> dict:
+        """ Get the entry of the URL, see :meth:`lookup`, fetching the METS
+        file if it isn't cached or changed. The cached one is used if it
+        can't be revalidated. """
+        with self.lock(url):
+            entry = self.lookup(url)
+            if entry is not None and \
+                    time.time() - entry["validated"] < self.max_age:
+                return entry
+            headers = {}
+            if entry is not None:
+                if entry["etag"]:
+                    headers["If-None-Match"] = entry["etag"]
+                if entry["last_modified"]:
+                    headers["If-Modified-Since"] = entry["last_modified"]
+            try:
+                response = requests.get(url, headers=headers, timeout=timeout)
+                if response.status_code != 304:
+                    response.raise_for_status()
+            except requests.RequestException as exc:
+                if entry is None:
+                    raise
+                logger.warning(f"Can't revalidate METS {url}, use the "
+                               f"cached one: {exc}")
+                return entry
+
+            if response.status_code == 304 and entry is not None:
+                logger.info(f"METS {url} not modified.")
+                entry["validated"] = time.time()
+                self.write_entry(url, {
+                    key: value for key, value in entry.items()
+                    if key != "path"
+                })
+                return entry
+
+            content = handle_oai_response(response)
+            fd, tmp = tempfile.mkstemp(dir=os.path.join(self.directory, "tmp"))
+            with os.fdopen(fd, "wb") as fh:
+                fh.write(content)
+            try:
+                digest = self.add_object(tmp)
+            finally:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+            if entry is not None and entry["sha256"] == digest:
+                summary = entry["summary"]
+            else:
+                summary = summarize_mets(content)
+            entry = {
+                "url": url,
+                "sha256": digest,
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "fetched": time.time(),
+                "validated": time.time(),
+                "summary": summary,
+            }
+            self.write_entry(url, entry)
+            return dict(entry, path=self.object_path(digest))
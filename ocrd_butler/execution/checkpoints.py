@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+
+"""Checkpoints of the steps of a task, to resume it after a failure."""
+
+import json
+import os
+import shutil
+import tempfile
+import time
+from typing import List
+
+from ocrd.workspace import Workspace
+
+from ocrd_butler.execution.cache import sha256_str
+from ocrd_butler.execution.mets import (
+    MetsIndex,
+    mets_index,
+)
+from ocrd_butler.util import logger
+
+
+CHECKPOINTS_FILE = "butler-steps.json"
+
+
+def checkpoints_path(dst_dir: str) -> str:
+    """ Path of the checkpoints file of the workspace in ``dst_dir``. """
+    return os.path.join(dst_dir, CHECKPOINTS_FILE)
+
+
+def step_signature(step: dict) -> dict:
+    """ The properties of a workflow step a checkpoint has to match to be
+    taken over, see :func:`~ocrd_butler.execution.tasks.workflow_steps`.
+
+    >>> step_signature({
+    ...     'processor': {'name': 'ocrd-dummy', 'executable': 'ocrd-dummy',
+    ...                   'output_file_grp': 'OUT'},
+    ...     'run_kwargs': {'input_file_grp': 'IN', 'parameter': '{}'},
+    ... })['parameter_hash'][:8]
+    '44136fa3'
+    """
+    processor = step["processor"]
+    parameter = json.loads(step["run_kwargs"]["parameter"] or "{}")
+    return {
+        "name": processor["name"],
+        "executable": processor["executable"],
+        "input_file_grp": step["run_kwargs"]["input_file_grp"],
+        "output_file_grp": processor["output_file_grp"],
+        "parameter_hash": sha256_str(json.dumps(parameter, sort_keys=True)),
+    }
+
+
+class Checkpoints(object):
+    """ The state of the workspace and the steps of a task, saved in the
+    workspace directory after every change.
+    """
+
+    def __init__(self, dst_dir: str):
+        self.path = checkpoints_path(dst_dir)
+        self.data = {"prepared": None, "steps": []}
+
+    def load(self) -> "Checkpoints":
+        """ Load the saved checkpoints, if there are any. """
+        try:
+            with open(self.path, "r") as fh:
+                self.data = json.load(fh)
+        except (FileNotFoundError, ValueError):
+            pass
+        return self
+
+    def save(self):
+        """ Write the checkpoints atomically. """
+        directory = os.path.dirname(self.path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".part")
+        with os.fdopen(fd, "w") as fh:
+            json.dump(self.data, fh, indent=2)
+        os.replace(tmp, self.path)
+
+    @property
+    def steps(self) -> List[dict]:
+        return self.data["steps"]
+
+    def prepared(self, workspace: Workspace, megapixels: float = None):
+        """ Record the workspace as prepared, i.e. downloaded, with the
+        megapixels of its images, if known. """
+        self.data = {
+            "prepared": {
+                "pages": len(mets_index(workspace).pages),
+                "megapixels": megapixels,
+                "finished": time.time(),
+            },
+            "steps": [],
+        }
+        self.save()
+
+    def is_prepared(self, workspace: Workspace) -> bool:
+        """ Check if the prepared workspace can be used again. """
+        prepared = self.data.get("prepared")
+        return prepared is not None and \
+            prepared["pages"] == len(mets_index(workspace).pages)
+
+    def updated(self, workspace: Workspace, megapixels: float = None):
+        """ Record the workspace as updated to a changed METS file, keeping
+        the steps, see :mod:`~ocrd_butler.execution.update`. """
+        self.data["prepared"] = {
+            "pages": len(mets_index(workspace).pages),
+            "megapixels": megapixels,
+            "finished": time.time(),
+        }
+        self.save()
+
+    def is_completed(self, steps: List[dict]) -> bool:
+        """ Check if all the steps completed, configured the same way. """
+        return len(self.steps) == len(steps) and all(
+            entry["status"] == "COMPLETED"
+            and all(entry[key] == value for key, value
+                    in step_signature(step).items())
+            for entry, step in zip(self.steps, steps)
+        )
+
+    def _record(self, index: int, step: dict, status: str, **values) -> dict:
+        entry = dict(step_signature(step), status=status,
+                     finished=time.time(), **values)
+        del self.steps[index:]
+        self.steps.append(entry)
+        self.save()
+        return entry
+
+    def completed(self, index: int, step: dict, workspace: Workspace,
+                  usage: dict = None, cache: dict = None) -> dict:
+        """ Record the step with the given index as completed, along with the
+        resources it used, see
+        :func:`~ocrd_butler.execution.output.wait_with_usage`, and the hits
+        and misses of the step cache, if it was used. The following steps are
+        forgotten. """
+        mets = mets_index(workspace)
+        return self._record(
+            index, step, "COMPLETED",
+            pages=len(mets.pages),
+            files=_output_files(mets, step),
+            usage=usage,
+            cache=cache,
+        )
+
+    def failed(self, index: int, step: dict, usage: dict = None) -> dict:
+        """ Record the step with the given index as failed. """
+        return self._record(index, step, "FAILED", usage=usage)
+
+    def resume_index(self, steps: List[dict], workspace: Workspace) -> int:
+        """ Get the index of the first step that has to run again, i.e. the
+        first one without a matching completed checkpoint. A checkpoint
+        matches if the step is configured the same way and its output file
+        groups are still in the METS with the recorded number of files.
+        """
+        mets = mets_index(workspace)
+        for index, step in enumerate(steps):
+            if index >= len(self.steps):
+                return index
+            entry = self.steps[index]
+            if entry["status"] != "COMPLETED"\
+                    or any(entry[key] != value for key, value
+                           in step_signature(step).items())\
+                    or entry["pages"] != len(mets.pages)\
+                    or entry["files"] != _output_files(mets, step):
+                return index
+        return len(steps)
+
+
+def _output_files(mets: MetsIndex, step: dict) -> int:
+    """ The number of files in the output file groups of the step. """
+    return sum(
+        len(mets.files(output_file_grp))
+        for output_file_grp in step["processor"]["output_file_grp"].split(",")
+    )
+
+
+def remove_outputs(workspace: Workspace, steps: List[dict]) -> List[str]:
+    """ Remove the output file groups of the given steps from the METS and
+    the disk, as a failed or outdated run may have left them behind. Doesn't
+    save the METS. Returns the removed file groups.
+    """
+    removed = []
+    file_groups = mets_index(workspace).file_groups
+    output_file_grps = [
+        output_file_grp for step in steps
+        for output_file_grp in step["processor"]["output_file_grp"].split(",")
+    ]
+    for output_file_grp in output_file_grps:
+        if output_file_grp in file_groups:
+            workspace.remove_file_group(
+                output_file_grp, recursive=True, force=True, keep_files=True
+            )
+            removed.append(output_file_grp)
+        directory = os.path.join(workspace.directory, output_file_grp)
+        if os.path.isdir(directory):
+            shutil.rmtree(directory)
+            if output_file_grp not in removed:
+                removed.append(output_file_grp)
+    if removed:
+        logger.info(f"Removed the output file groups {', '.join(removed)}.")
+    return removed
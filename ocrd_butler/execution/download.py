@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+
+"""Concurrent download of the files of a workspace."""
+
+from concurrent.futures import (
+    ThreadPoolExecutor,
+    as_completed,
+)
+import os
+import threading
+import time
+from typing import (
+    Dict,
+    List,
+)
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from ocrd_models import OcrdFile
+from ocrd_utils import MIME_TO_EXT
+from ocrd.workspace import Workspace
+
+from ocrd_butler.execution.cache import (
+    ImageCache,
+    clone_or_copy,
+)
+from ocrd_butler.util import logger
+
+
+class DownloadError(Exception):
+    """ Raised if files of a workspace can't be downloaded. """
+
+
+class HostLimiter(object):
+    """ Hand out a semaphore per host to limit the number of concurrent
+    requests against a single server.
+
+    >>> limiter = HostLimiter({'foo.bar': 2}, default=1)
+    >>> limiter.limit('http://foo.bar/mets.xml')
+    2
+    >>> limiter.limit('http://bar.foo/mets.xml')
+    1
+    """
+
+    def __init__(self, limits: Dict[str, int] = None, default: int = 4):
+        self.limits = limits or {}
+        self.default = default
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+    def limit(self, url: str) -> int:
+        """ Get the configured number of parallel requests for the host of
+        the given URL. """
+        return self.limits.get(urlparse(url).hostname, self.default)
+
+    def semaphore(self, url: str) -> threading.BoundedSemaphore:
+        """ Get the semaphore guarding the host of the given URL. """
+        host = urlparse(url).hostname
+        with self._lock:
+            if host not in self._semaphores:
+                self._semaphores[host] = threading.BoundedSemaphore(
+                    self.limit(url)
+                )
+            return self._semaphores[host]
+
+
+def create_session(pool_size: int) -> requests.Session:
+    """ Create a HTTP session whose connection pool can keep ``pool_size``
+    connections per host alive. """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def is_remote(url: str) -> bool:
+    """ Check if the given URL has to be fetched via HTTP.
+
+    >>> is_remote('https://content.staatsbibliothek-berlin.de/dc/foo.tif')
+    True
+    >>> is_remote('MAX/FILE_0001_MAX.tif')
+    False
+    """
+    return urlparse(url).scheme in ("http", "https")
+
+
+def local_filename(ocrd_file: OcrdFile) -> str:
+    """ Get the path of a file relative to the workspace directory, in the way
+    ``ocrd.workspace.Workspace.download_file`` names it.
+    """
+    basename = "{}{}".format(
+        ocrd_file.ID, MIME_TO_EXT.get(ocrd_file.mimetype, "")
+    ) if ocrd_file.ID else ocrd_file.basename
+    return os.path.join(ocrd_file.fileGrp, basename)
+
+
+def fetch(
+    session: requests.Session, url: str, dst: str,
+    retries: int = 3, backoff: float = 1.0, timeout: int = 60
+):
+    """ Download the given URL to ``dst``.
+
+    The download is retried on connection errors and server side errors. The
+    file is written to a temporary name first and moved into place when
+    complete, so a partial download never shows up under ``dst``.
+    """
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    part = f"{dst}.part"
+    for attempt in range(retries + 1):
+        try:
+            with session.get(url, stream=True, timeout=timeout) as response:
+                if response.status_code == 429 or response.status_code >= 500:
+                    raise requests.HTTPError(
+                        f"{response.status_code} for url {url}",
+                        response=response
+                    )
+                response.raise_for_status()
+                with open(part, "wb") as part_file:
+                    for chunk in response.iter_content(chunk_size=65536):
+                        part_file.write(chunk)
+            os.replace(part, dst)
+            return dst
+        except requests.RequestException as exc:
+            response = getattr(exc, "response", None)
+            retryable = response is None or response.status_code == 429\
+                or response.status_code >= 500
+            if not retryable or attempt >= retries:
+                if os.path.exists(part):
+                    os.remove(part)
+                raise
+            wait = backoff * 2 ** attempt
+            logger.warning(f"Download of {url} failed ({exc}), "
+                           f"retry {attempt + 1}/{retries} in {wait}s.")
+            time.sleep(wait)
+
+
+def download_files(
+    workspace: Workspace, files: List[OcrdFile], workers: int = 8,
+    host_limits: Dict[str, int] = None, default_host_limit: int = 4,
+    retries: int = 3, backoff: float = 1.0, timeout: int = 60,
+    cache: ImageCache = None,
+) -> List[OcrdFile]:
+    """ Download the given files of the workspace concurrently.
+
+    Up to ``workers`` downloads run in parallel over one keep-alive session,
+    while ``host_limits`` caps the parallel requests per host. Every file is
+    retried on its own. The METS entries of the files are updated only after
+    all downloads are finished; saving the METS is up to the caller.
+
+    If a ``cache`` is given, the files are taken from it or put into it and
+    copied into the workspace. Files which are already local are skipped,
+    files which are not reachable via HTTP are handed over to
+    ``workspace.download_file``.
+    """
+    remote_files = []
+    for ocrd_file in files:
+        if ocrd_file.local_filename:
+            continue
+        if is_remote(ocrd_file.url):
+            remote_files.append(ocrd_file)
+        else:
+            workspace.download_file(ocrd_file)
+
+    if not remote_files:
+        return files
+
+    limiter = HostLimiter(host_limits, default_host_limit)
+    session = create_session(workers)
+
+    def _fetch(url: str, dst: str) -> str:
+        with limiter.semaphore(url):
+            return fetch(session, url, dst, retries=retries,
+                         backoff=backoff, timeout=timeout)
+
+    def _download(ocrd_file: OcrdFile) -> str:
+        dst = os.path.join(workspace.directory, local_filename(ocrd_file))
+        if cache is None:
+            return _fetch(ocrd_file.url, dst)
+        try:
+            clone_or_copy(cache.fetch(ocrd_file.url, _fetch), dst)
+        except FileNotFoundError:
+            # Evicted in the meantime by another task.
+            _fetch(ocrd_file.url, dst)
+        return dst
+
+    logger.info(f"Download {len(remote_files)} files with {workers} workers.")
+    started = time.time()
+    failed = []
+    with session, ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(_download, ocrd_file): ocrd_file
+            for ocrd_file in remote_files
+        }
+        for future in as_completed(futures):
+            ocrd_file = futures[future]
+            try:
+                future.result()
+            except Exception as exc:
+                logger.error(f"Can't download {ocrd_file.url}: {exc}")
+                failed.append(ocrd_file)
+
+    if failed:
+        raise DownloadError(
+            "Can't download file(s) {}.".format(
+                ", ".join(ocrd_file.ID for ocrd_file in failed)
+            )
+        )
+
+    # Changing the METS is not thread safe, so we do it afterwards.
+    for ocrd_file in remote_files:
+        ocrd_file.url = local_filename(ocrd_file)
+        ocrd_file.local_filename = ocrd_file.url
+
+    logger.info(f"Downloaded {len(remote_files)} files in "
+                f"{time.time() - started:.2f}s.")
+    return files
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+
+"""Estimate how long tasks take from the throughput of the processors in
+former runs, in seconds per page and per megapixel of the images.
+
+The throughput is learned from the results of tasks that succeeded, i.e.
+the wall time and the number of pages of their steps (see
+:class:`~ocrd_butler.execution.checkpoints.Checkpoints`) and the megapixels
+of their images, recorded when the workspace is prepared.
+"""
+
+import os
+from statistics import median
+from typing import (
+    Iterable,
+    List,
+    Optional,
+)
+
+from PIL import Image
+
+from ocrd_utils import is_local_filename
+from ocrd.workspace import Workspace
+
+from ocrd_butler.execution.mets import mets_index
+from ocrd_butler.util import logger
+
+
+def image_megapixels(workspace: Workspace, file_grp: str) -> Optional[float]:
+    """ The megapixels of the local images of the file group, read from
+    their headers. ``None`` if there are none. """
+    pixels = 0
+    for mets_file in mets_index(workspace).files(file_grp):
+        url = mets_file["url"]
+        if not url or not is_local_filename(url):
+            continue
+        try:
+            with Image.open(os.path.join(workspace.directory, url)) as image:
+                width, height = image.size
+        except (OSError, ValueError) as exc:
+            logger.warning(f"Can't read the size of image {url}: {exc}")
+            continue
+        pixels += width * height
+    return round(pixels / 1e6, 3) if pixels else None
+
+
+def learn_throughput(results: Iterable[dict]) -> dict:
+    """ Learn the median seconds per page and per megapixel of every
+    processor from the results of tasks that succeeded, and the median
+    number of pages of a task. Updates, which process some pages only, are
+    left out.
+
+    >>> learn_throughput([
+    ...     {"prepared": {"pages": 10, "megapixels": 50.0}, "steps": [
+    ...         {"name": "ocrd-foo", "status": "COMPLETED", "pages": 10,
+    ...          "usage": {"wall": 20.0}}]},
+    ...     {"prepared": {"pages": 20}, "steps": [
+    ...         {"name": "ocrd-foo", "status": "COMPLETED", "pages": 20,
+    ...          "usage": {"wall": 60.0}}]},
+    ...     {"update": {}, "steps": [
+    ...         {"name": "ocrd-foo", "status": "COMPLETED", "pages": 20,
+    ...          "usage": {"wall": 1.0}}]},
+    ... ])
+    {'processors': {'ocrd-foo': {'page': 2.5, 'megapixel': 0.4, 'runs': 2}}, 'pages': 15.0}
+    """
+    per_page = {}
+    per_megapixel = {}
+    pages = []
+    for result in results:
+        if not result or "update" in result:
+            continue
+        prepared = result.get("prepared") or {}
+        megapixels = prepared.get("megapixels")
+        if prepared.get("pages"):
+            pages.append(prepared["pages"])
+        for step in result.get("steps") or []:
+            wall = (step.get("usage") or {}).get("wall")
+            if step.get("status") != "COMPLETED" or not wall \
+                    or not step.get("pages"):
+                continue
+            per_page.setdefault(step["name"], []).append(wall / step["pages"])
+            if megapixels:
+                per_megapixel.setdefault(step["name"], []).append(
+                    wall / megapixels
+                )
+    return {
+        "processors": {
+            name: {
+                "page": round(median(values), 3),
+                "megapixel": round(median(per_megapixel[name]), 3)
+                if name in per_megapixel else None,
+                "runs": len(values),
+            }
+            for name, values in per_page.items()
+        },
+        "pages": median(pages) if pages else None,
+    }
+
+
+def estimate_steps(names: List[str], throughput: dict, pages: Optional[int],
+                   megapixels: Optional[float] = None
+                   ) -> Optional[List[float]]:
+    """ Estimate the seconds of the steps of the processors with the given
+    names, by the megapixels of the images if they and the throughput per
+    megapixel are known, else by the pages. Processors without former runs
+    get the median throughput of the others. Returns ``None`` if nothing is
+    known.
+
+    >>> throughput = {"processors": {
+    ...     "ocrd-foo": {"page": 2.0, "megapixel": 0.5, "runs": 3},
+    ...     "ocrd-bar": {"page": 4.0, "megapixel": None, "runs": 1}},
+    ...     "pages": 15}
+    >>> estimate_steps(["ocrd-foo", "ocrd-bar", "ocrd-new"], throughput, 10)
+    [20.0, 40.0, 30.0]
+    >>> estimate_steps(["ocrd-foo"], throughput, 10, megapixels=100.0)
+    [50.0]
+    >>> estimate_steps(["ocrd-foo"], throughput, None)
+    [30.0]
+    >>> estimate_steps(["ocrd-foo"], {"processors": {}, "pages": None}, 10) is None
+    True
+    """
+    known = throughput["processors"]
+    pages = pages or throughput["pages"]
+    if not known or not pages:
+        return None
+    fallback = median(rates["page"] for rates in known.values())
+    seconds = []
+    for name in names:
+        rates = known.get(name)
+        if rates is None:
+            seconds.append(fallback * pages)
+        elif megapixels and rates["megapixel"] is not None:
+            seconds.append(rates["megapixel"] * megapixels)
+        else:
+            seconds.append(rates["page"] * pages)
+    return [round(value, 1) for value in seconds]
+
+
+def remaining_seconds(estimates: List[float], steps: List[dict],
+                      started: Optional[float], now: float) -> float:
+    """ The seconds the steps with the given estimates still take, if the
+    ones with ``COMPLETED`` checkpoints (``steps``) are done and the next one
+    runs since the last of them finished, or since ``started``.
+
+    >>> remaining_seconds([10.0, 20.0, 30.0],
+    ...     [{"status": "COMPLETED", "finished": 100.0}], 90.0, 105.0)
+    45.0
+    >>> remaining_seconds([10.0, 20.0], [], None, 105.0)
+    30.0
+    """
+    done = 0
+    for step in steps:
+        if step.get("status") != "COMPLETED":
+            break
+        done += 1
+        started = step["finished"]
+    remaining = estimates[done:]
+    if not remaining:
+        return 0.0
+    elapsed = max(0.0, now - started) if started is not None else 0.0
+    return max(0.0, remaining[0] - elapsed) + sum(remaining[1:])
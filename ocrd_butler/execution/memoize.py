@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+
+"""Take the output of workflow steps for pages from a
+:class:`~ocrd_butler.execution.cache.StepCache` instead of running the
+processor on them again.
+
+A page is a hit if the same processor version ran with the same parameters
+on input files with the same content before. The output files of the misses
+are stored after the step.
+"""
+
+from functools import lru_cache
+import json
+import os
+import re
+import shutil
+import subprocess
+from typing import (
+    Callable,
+    Dict,
+    List,
+    Optional,
+)
+
+from ocrd_utils import MIMETYPE_PAGE
+from ocrd.workspace import Workspace
+
+from ocrd_butler.execution.cache import (
+    StepCache,
+    clone_or_copy,
+    sha256_file,
+    sha256_str,
+)
+from ocrd_butler.execution.mets import (
+    mets_index,
+    processed,
+)
+from ocrd_butler.execution.output import add_usage
+from ocrd_butler.util import logger
+
+
+# Files a PAGE-XML file refers to, e.g. its image and derived images.
+REFERENCED_FILE = re.compile(r'\b(?:imageFilename|filename)="([^"]+)"')
+
+# The format of the cache entries, part of the keys, so entries of former
+# formats aren't taken. 2 records the output file group of every file.
+ENTRY_FORMAT = 2
+
+
+@lru_cache(maxsize=None)
+def _version(path: str, mtime: float) -> str:
+    result = subprocess.run(
+        [path, "--version"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT
+    )
+    return result.stdout.decode("utf-8", errors="replace").strip()
+
+
+def processor_version(executable: str) -> str:
+    """ The output of ``executable --version``, asked again if the
+    executable changed. """
+    path = shutil.which(executable) or executable
+    return _version(path, os.stat(path).st_mtime)
+
+
+def referenced_files(path: str) -> List[str]:
+    """ The files a PAGE-XML file refers to, in the order they appear. """
+    with open(path, "r", encoding="utf-8", errors="replace") as fh:
+        return REFERENCED_FILE.findall(fh.read())
+
+
+def _file_key(workspace: Workspace, mets_file: dict) -> Optional[dict]:
+    local_filename = mets_file["url"]
+    path = os.path.join(workspace.directory, local_filename)
+    if not os.path.isfile(path):
+        return None
+    key = {
+        "ID": mets_file["ID"],
+        "local_filename": local_filename,
+        "mimetype": mets_file["mimetype"],
+        "sha256": sha256_file(path),
+    }
+    if mets_file["mimetype"] == MIMETYPE_PAGE:
+        key["references"] = references = {}
+        for reference in referenced_files(path):
+            reference_path = os.path.join(workspace.directory, reference)
+            if os.path.isfile(reference_path):
+                references[reference] = sha256_file(reference_path)
+    return key
+
+
+def page_keys(workspace: Workspace, step: dict, version: str) -> Dict[str, str]:
+    """ Get the cache keys of the pages of the workspace for the step, see
+    :func:`~ocrd_butler.execution.tasks.workflow_steps`. Pages with input
+    files that aren't on disk get no key. """
+    run_kwargs = step["run_kwargs"]
+    signature = {
+        "format": ENTRY_FORMAT,
+        "executable": step["processor"]["executable"],
+        "version": version,
+        "parameter": json.loads(run_kwargs["parameter"] or "{}"),
+        "input_file_grp": run_kwargs["input_file_grp"],
+        "output_file_grp": run_kwargs["output_file_grp"],
+    }
+    mets = mets_index(workspace)
+    inputs = {page: [] for page in mets.pages}
+    for input_file_grp in run_kwargs["input_file_grp"].split(","):
+        for mets_file in mets.files(input_file_grp):
+            if mets_file["pageId"] in inputs:
+                inputs[mets_file["pageId"]].append(
+                    _file_key(workspace, mets_file)
+                )
+
+    return {
+        page: sha256_str(json.dumps(
+            dict(signature, page=page, inputs=files), sort_keys=True
+        ))
+        for page, files in inputs.items()
+        if None not in files
+    }
+
+
+def _add_file(workspace: Workspace, file_grp: str, page: str, ID: str,
+              mimetype: str, local_filename: str):
+    workspace.mets.add_file(
+        file_grp, ID=ID, mimetype=mimetype, pageId=page,
+        url=local_filename, local_filename=local_filename,
+    )
+
+
+def store_pages(workspace: Workspace, cache: StepCache, keys: Dict[str, str],
+                output_file_grp: str, pages: List[str]):
+    """ Store the output files of the pages in the cache, with the one of
+    the output file groups (comma separated) they are in. Pages without
+    output are only stored if there is output of the step for some page,
+    otherwise the outputs weren't found. """
+    mets = mets_index(workspace)
+    outputs = {
+        file_grp: mets.by_page(file_grp)
+        for file_grp in output_file_grp.split(",")
+    }
+    if not any(outputs.values()):
+        logger.warning(f"No output of the step in {output_file_grp}, don't "
+                       f"store its pages in the step cache.")
+        return
+    for page in pages:
+        if page not in keys:
+            continue
+        files = []
+        for file_grp, by_page in outputs.items():
+            for mets_file in by_page.get(page, []):
+                local_filename = mets_file["url"]
+                files.append({
+                    "file_grp": file_grp,
+                    "ID": mets_file["ID"],
+                    "mimetype": mets_file["mimetype"],
+                    "local_filename": local_filename,
+                    "path": os.path.join(workspace.directory, local_filename),
+                })
+        cache.store(keys[page], files)
+
+
+def run_step_cached(
+    workspace: Workspace, step: dict, cache: StepCache,
+    run: Callable[[Optional[str]], subprocess.CompletedProcess],
+) -> subprocess.CompletedProcess:
+    """ Run the step on the pages that aren't in the cache and take the
+    output of the others from it. ``run(page_id)`` runs the processor of the
+    step on the workspace, for the given pages or all if ``None``.
+
+    The output files are added to the METS in page order, like the processor
+    would have added them. The numbers of hits and misses are set as the
+    ``cache`` of the returned result.
+    """
+    processor = step["processor"]
+    output_file_grp = processor["output_file_grp"]
+    pages = mets_index(workspace).pages
+    keys = page_keys(
+        workspace, step, processor_version(processor["executable"])
+    )
+
+    hits = {}
+    for page in pages:
+        cached = cache.lookup(keys[page]) if page in keys else None
+        if cached is not None:
+            hits[page] = cached
+    misses = [page for page in pages if page not in hits]
+    logger.info(f"Step cache has {len(hits)} of {len(pages)} pages for "
+                f"processor {processor['name']}.")
+
+    if misses:
+        result = run(",".join(misses) if hits else None)
+    else:
+        result = subprocess.CompletedProcess(
+            args=[processor["executable"]], returncode=0, stdout=b""
+        )
+        result.usage = add_usage([])
+
+    if result.returncode == 0:
+        processed(workspace, output_file_grp)
+        if hits:
+            _add_hits(workspace, step, hits, with_agent=not misses)
+        store_pages(workspace, cache, keys, output_file_grp, misses)
+
+    stats = cache.record(len(hits), len(misses))
+    logger.info(f"Step cache stats: {json.dumps(stats)}")
+    cache.evict()
+    result.cache = {"hits": len(hits), "misses": len(misses)}
+    return result
+
+
+def _add_hits(workspace: Workspace, step: dict, hits: Dict[str, List[dict]],
+              with_agent: bool):
+    """ Add the cached output files to the METS, with the ones the processor
+    added for the other pages, all of them in page order, group by group. """
+    processor = step["processor"]
+    output_file_grp = processor["output_file_grp"]
+    mets = mets_index(workspace)
+    file_grps = output_file_grp.split(",")
+    outputs = {file_grp: mets.by_page(file_grp) for file_grp in file_grps}
+    for file_grp in file_grps:
+        workspace.mets.remove_file_group(file_grp, recursive=True, force=True)
+
+    for file_grp in file_grps:
+        for page in mets.pages:
+            for cached in hits.get(page, []):
+                if cached["file_grp"] != file_grp:
+                    continue
+                clone_or_copy(cached["path"], os.path.join(
+                    workspace.directory, cached["local_filename"]
+                ))
+                _add_file(workspace, file_grp, page, cached["ID"],
+                          cached["mimetype"], cached["local_filename"])
+            for mets_file in outputs[file_grp].get(page, []):
+                _add_file(workspace, file_grp, page, mets_file["ID"],
+                          mets_file["mimetype"], mets_file["url"])
+
+    if with_agent:
+        workspace.mets.add_agent(
+            name=f"{processor['executable']} (ocrd-butler step cache)",
+            _type="OTHER",
+            othertype="SOFTWARE",
+            role="OTHER",
+            otherrole="preprocessing/optimization",
+            notes=[
+                ({"option": "input-file-grp"},
+                 step["run_kwargs"]["input_file_grp"]),
+                ({"option": "output-file-grp"}, output_file_grp),
+                ({"option": "parameter"},
+                 step["run_kwargs"]["parameter"] or "{}"),
+            ]
+        )
+    workspace.save_mets()
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+
+"""Summaries of METS files, i.e. their pages and the files of their file
+groups, so the butler needn't parse a METS file again to know them.
+
+An :class:`IndexedWorkspace` keeps such a summary as a :class:`MetsIndex`,
+which is updated from the file groups a processor added, instead of parsing
+the whole METS file after every step.
+"""
+
+import io
+from typing import (
+    BinaryIO,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Union,
+)
+import xml.etree.ElementTree as ET
+
+from ocrd_models import OcrdMets
+from ocrd.workspace import Workspace
+
+
+METS_NS = "http://www.loc.gov/METS/"
+XLINK_NS = "http://www.w3.org/1999/xlink"
+
+_FILE_GRP = f"{{{METS_NS}}}fileGrp"
+_FILE = f"{{{METS_NS}}}file"
+_FLOCAT = f"{{{METS_NS}}}FLocat"
+_STRUCT_MAP = f"{{{METS_NS}}}structMap"
+_DIV = f"{{{METS_NS}}}div"
+_FPTR = f"{{{METS_NS}}}fptr"
+_HREF = f"{{{XLINK_NS}}}href"
+
+
+def scan_mets(source: Union[str, BinaryIO],
+              file_grps: Iterable[str] = None) -> dict:
+    """ Read the pages of the METS file (a path or file object) in the order
+    of its physical structure map, and the files of the given file groups,
+    all of them if ``None``, with their page. The file is read as a stream,
+    skipping the files of the other groups. """
+    wanted = None if file_grps is None else set(file_grps)
+    file_groups = {} if wanted is None else {grp: [] for grp in wanted}
+    files = {}
+    pages = []
+    file_grp = physical = page = None
+
+    for event, elem in ET.iterparse(source, events=("start", "end")):
+        tag = elem.tag
+        if event == "start":
+            if tag == _FILE_GRP:
+                file_grp = elem.get("USE")
+                if wanted is None or file_grp in wanted:
+                    file_groups.setdefault(file_grp, [])
+            elif tag == _STRUCT_MAP:
+                physical = elem.get("TYPE") == "PHYSICAL"
+            elif tag == _DIV and physical and elem.get("TYPE") == "page":
+                page = elem.get("ID")
+                pages.append(page)
+            elif tag == _FPTR and page is not None:
+                mets_file = files.get(elem.get("FILEID"))
+                if mets_file is not None:
+                    mets_file["pageId"] = page
+            continue
+
+        if tag == _FILE:
+            if file_grp in file_groups:
+                location = elem.find(_FLOCAT)
+                mets_file = {
+                    "ID": elem.get("ID"),
+                    "mimetype": elem.get("MIMETYPE"),
+                    "url": None if location is None else location.get(_HREF),
+                    "pageId": None,
+                    "checksum": elem.get("CHECKSUM"),
+                }
+                file_groups[file_grp].append(mets_file)
+                files[mets_file["ID"]] = mets_file
+            elem.clear()
+        elif tag == _FILE_GRP:
+            file_grp = None
+        elif tag == _STRUCT_MAP:
+            physical = None
+        elif tag == _DIV and elem.get("ID") == page:
+            page = None
+            elem.clear()
+
+    return {"pages": pages, "file_groups": file_groups}
+
+
+def summarize_mets(mets: bytes) -> dict:
+    """ Get the IDs of the pages of the METS in the order of its physical
+    structure map, and the files of every file group with their page, see
+    :func:`scan_mets`.
+
+    >>> summary = summarize_mets(b'''<mets:mets xmlns:mets="http://www.loc.gov/METS/"
+    ...   xmlns:xlink="http://www.w3.org/1999/xlink">
+    ...   <mets:fileSec><mets:fileGrp USE="DEFAULT">
+    ...     <mets:file ID="F1" MIMETYPE="image/jpeg">
+    ...       <mets:FLocat LOCTYPE="URL" xlink:href="http://foo.bar/1.jpg"/>
+    ...     </mets:file>
+    ...   </mets:fileGrp></mets:fileSec>
+    ...   <mets:structMap TYPE="PHYSICAL"><mets:div TYPE="physSequence">
+    ...     <mets:div TYPE="page" ID="P1"><mets:fptr FILEID="F1"/></mets:div>
+    ...   </mets:div></mets:structMap></mets:mets>''')
+    >>> summary["pages"]
+    ['P1']
+    >>> summary["file_groups"]["DEFAULT"]
+    [{'ID': 'F1', 'mimetype': 'image/jpeg', 'url': 'http://foo.bar/1.jpg', 'pageId': 'P1', 'checksum': None}]
+    """
+    return scan_mets(io.BytesIO(mets))
+
+
+def summary_page_count(summary: dict, file_grp: str) -> Optional[int]:
+    """ Count the files of the file group in the summary, the ``DEFAULT``
+    ones for ``MAX`` if there is no such group (see
+    :func:`~ocrd_butler.execution.tasks.prepare_workspace`).
+
+    >>> summary_page_count({"file_groups": {"DEFAULT": [{}, {}]}}, "MAX")
+    2
+    >>> summary_page_count({"file_groups": {"DEFAULT": [{}, {}]}}, "FOO") is None
+    True
+    """
+    groups = summary["file_groups"]
+    if file_grp == "MAX" and "MAX" not in groups:
+        file_grp = "DEFAULT"
+    if file_grp not in groups:
+        return None
+    return len(groups[file_grp])
+
+
+class MetsIndex(object):
+    """ The pages of a METS file and the files of its file groups, as dicts
+    with the ``ID``, ``mimetype``, ``url``, ``pageId`` and ``checksum`` of
+    every file.
+    """
+
+    def __init__(self, summary: dict):
+        self.pages = summary["pages"]
+        self.groups = summary["file_groups"]
+
+    @classmethod
+    def from_file(cls, path: str) -> "MetsIndex":
+        """ Index the METS file at ``path``. """
+        return cls(scan_mets(path))
+
+    @classmethod
+    def from_mets(cls, mets: OcrdMets) -> "MetsIndex":
+        """ Index the METS as it is in memory. """
+        return cls(summarize_mets(mets.to_xml()))
+
+    @property
+    def file_groups(self) -> List[str]:
+        return list(self.groups)
+
+    def files(self, file_grp: str) -> List[dict]:
+        """ The files of the file group, in the order of the METS. """
+        return self.groups.get(file_grp, [])
+
+    def by_page(self, file_grp: str) -> Dict[str, List[dict]]:
+        """ The files of the file group, by page. """
+        pages = {}
+        for mets_file in self.files(file_grp):
+            pages.setdefault(mets_file["pageId"], []).append(mets_file)
+        return pages
+
+    def update(self, path: str, file_grps: Iterable[str]):
+        """ Read the given file groups from the METS file at ``path`` again,
+        e.g. after a processor added them. Groups which aren't in it any
+        more are dropped. """
+        file_grps = list(file_grps)
+        scanned = scan_mets(path, file_grps)
+        self.pages = scanned["pages"]
+        for file_grp in file_grps:
+            if scanned["file_groups"][file_grp]:
+                self.groups[file_grp] = scanned["file_groups"][file_grp]
+            else:
+                self.groups.pop(file_grp, None)
+
+
+class IndexedWorkspace(Workspace):
+    """ A workspace with a :class:`MetsIndex` of its METS file, the one the
+    butler asks for pages and files. Its METS is only parsed again when it is
+    used after a processor changed it, see :meth:`processed`.
+
+    Saving the METS indexes it again.
+    """
+
+    def __init__(self, resolver, directory: str, mets: OcrdMets = None,
+                 mets_basename: str = "mets.xml", baseurl: str = None):
+        super().__init__(resolver, directory, mets=mets,
+                         mets_basename=mets_basename, baseurl=baseurl)
+        self.index = MetsIndex.from_mets(self.mets)
+
+    @property
+    def mets(self) -> OcrdMets:
+        if self._mets is None:
+            self._mets = OcrdMets(filename=self.mets_target)
+        return self._mets
+
+    @mets.setter
+    def mets(self, mets: OcrdMets):
+        self._mets = mets
+
+    def reload_mets(self):
+        """ Index the METS file again and parse it on its next use. """
+        self._mets = None
+        self.index = MetsIndex.from_file(self.mets_target)
+
+    def save_mets(self):
+        super().save_mets()
+        self.index = MetsIndex.from_mets(self.mets)
+
+    def processed(self, file_grps: Iterable[str]):
+        """ Take over the file groups a processor added to the METS file
+        into the index, and parse the METS on its next use. """
+        self._mets = None
+        self.index.update(self.mets_target, file_grps)
+
+
+def mets_index(workspace: Workspace) -> MetsIndex:
+    """ The index of the workspace, made from its METS unless it keeps one. """
+    if isinstance(workspace, IndexedWorkspace):
+        return workspace.index
+    return MetsIndex.from_mets(workspace.mets)
+
+
+def processed(workspace: Workspace, output_file_grp: str):
+    """ Take over the output file groups (comma separated) a processor
+    added to the METS file of the workspace. """
+    if isinstance(workspace, IndexedWorkspace):
+        workspace.processed(output_file_grp.split(","))
+    else:
+        workspace.reload_mets()
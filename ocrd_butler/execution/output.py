@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+
+"""Run processor subprocesses, with their output read incrementally and
+the resources they use accounted."""
+
+from collections import deque
+import os
+import signal
+import subprocess
+import threading
+import time
+from typing import (
+    Callable,
+    Dict,
+    IO,
+    List,
+    Optional,
+)
+
+
+# Seconds processes get to exit after SIGTERM, before they are killed.
+KILL_GRACE = 5
+
+# Output is read in lines, but never more than this at once, so a single
+# huge line doesn't end up in memory as a whole.
+READ_SIZE = 65536
+
+
+class OutputTail(object):
+    """ Keep the last lines of an output, up to ``limit`` bytes.
+
+    >>> tail = OutputTail(limit=8)
+    >>> for line in (b'foo\\n', b'bar\\n', b'baz\\n'):
+    ...     tail.append(line)
+    >>> tail.getvalue()
+    b'bar\\nbaz\\n'
+    >>> tail.dropped
+    4
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.size = 0
+        self.dropped = 0
+        self._lines = deque()
+
+    def append(self, line: bytes):
+        self._lines.append(line)
+        self.size += len(line)
+        while self.size > self.limit and self._lines:
+            dropped = self._lines.popleft()
+            self.size -= len(dropped)
+            self.dropped += len(dropped)
+
+    def getvalue(self) -> bytes:
+        return b"".join(self._lines)
+
+
+def read_lines(stream: IO[bytes], on_line: Callable[[str], None],
+               limit: int) -> OutputTail:
+    """ Read the stream line by line until it is closed, hand every line
+    over to ``on_line`` as soon as it arrives and return the last ``limit``
+    bytes of it. """
+    tail = OutputTail(limit)
+    for line in iter(lambda: stream.readline(READ_SIZE), b""):
+        tail.append(line)
+        on_line(line.decode("utf-8", errors="replace").rstrip("\n"))
+    return tail
+
+
+def wait_with_usage(process: subprocess.Popen, started: float) -> dict:
+    """ Wait for the process to exit and get the resources it used, i.e.
+    the wall clock time since ``started`` (:func:`time.monotonic`) and its
+    rusage: user and system CPU seconds, peak resident memory and bytes read
+    from and written to block devices.
+    """
+    _, status, rusage = os.wait4(process.pid, 0)
+    if os.WIFSIGNALED(status):
+        process.returncode = -os.WTERMSIG(status)
+    else:
+        process.returncode = os.WEXITSTATUS(status)
+    return {
+        "wall": round(time.monotonic() - started, 3),
+        "utime": round(rusage.ru_utime, 3),
+        "stime": round(rusage.ru_stime, 3),
+        # Kilobytes on Linux.
+        "maxrss": rusage.ru_maxrss * 1024,
+        # Blocks of 512 bytes.
+        "read_bytes": rusage.ru_inblock * 512,
+        "write_bytes": rusage.ru_oublock * 512,
+    }
+
+
+def add_usage(usages: List[dict], wall: float = None) -> dict:
+    """ Add up the resources of several processes, which ran one after the
+    other unless the total ``wall`` time is given.
+
+    >>> add_usage([
+    ...     {'wall': 2, 'utime': 1, 'stime': 1, 'maxrss': 10,
+    ...      'read_bytes': 0, 'write_bytes': 512},
+    ...     {'wall': 3, 'utime': 2, 'stime': 0, 'maxrss': 20,
+    ...      'read_bytes': 512, 'write_bytes': 0},
+    ... ], wall=3)
+    {'wall': 3, 'utime': 3, 'stime': 1, 'maxrss': 20, 'read_bytes': 512, 'write_bytes': 512}
+    """
+    total = {
+        key: sum(usage[key] for usage in usages)
+        for key in ("wall", "utime", "stime", "read_bytes", "write_bytes")
+    }
+    total["maxrss"] = max((usage["maxrss"] for usage in usages), default=0)
+    if wall is not None:
+        total["wall"] = wall
+    return {
+        key: total[key] for key in (
+            "wall", "utime", "stime", "maxrss", "read_bytes", "write_bytes"
+        )
+    }
+
+
+def kill_process_group(pgid: int, sig: int) -> bool:
+    """ Send the signal to all processes of the group. Returns ``False`` if
+    there are none left. """
+    try:
+        os.killpg(pgid, sig)
+        return True
+    except ProcessLookupError:
+        return False
+
+
+class Watchdog(object):
+    """ Watch a process started in a session of its own while it runs, and
+    kill it along with all its children if ``should_stop`` returns true or it
+    runs longer than ``timeout`` seconds. They get ``SIGTERM`` first and
+    ``SIGKILL`` after ``grace`` seconds.
+
+    The reason of the kill is set as ``reason``, ``"stopped"`` or
+    ``"timeout"``.
+    """
+
+    def __init__(self, pgid: int, should_stop: Callable[[], bool] = None,
+                 timeout: float = None, interval: float = 0.5,
+                 grace: float = KILL_GRACE):
+        self.pgid = pgid
+        self.should_stop = should_stop
+        self.deadline = None if timeout is None else time.monotonic() + timeout
+        self.interval = interval
+        self.grace = grace
+        self.reason = None
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._watch, daemon=True)
+
+    def __enter__(self) -> "Watchdog":
+        if self.should_stop is not None or self.deadline is not None:
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._done.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def _watch(self):
+        while not self._done.wait(self.interval):
+            if self.should_stop is not None and self.should_stop():
+                self.reason = "stopped"
+            elif self.deadline is not None and time.monotonic() > self.deadline:
+                self.reason = "timeout"
+            else:
+                continue
+            self.kill()
+            return
+
+    def kill(self):
+        """ Terminate the process group, and kill it if it doesn't exit in
+        time. """
+        if kill_process_group(self.pgid, signal.SIGTERM) and \
+                not self._done.wait(self.grace):
+            kill_process_group(self.pgid, signal.SIGKILL)
+
+
+def bind_cpus(cpus: Optional[List[int]]) -> Optional[Callable[[], None]]:
+    """ The ``preexec_fn`` binding a child process to the CPUs before it
+    runs its command, so none of its threads starts elsewhere. """
+    if not cpus:
+        return None
+
+    def _bind():
+        os.sched_setaffinity(0, cpus)
+
+    return _bind
+
+
+def run_streaming(args: list, on_line: Callable[[str], None], limit: int,
+                  should_stop: Callable[[], bool] = None,
+                  timeout: float = None, env: Dict[str, str] = None,
+                  cpus: List[int] = None) -> subprocess.CompletedProcess:
+    """ Run the command, with ``/dev/stderr`` redirected to ``/dev/stdout``,
+    passing its output line by line to ``on_line`` while it runs.
+
+    Only the last ``limit`` bytes of the output are kept for the ``stdout``
+    of the returned :class:`subprocess.CompletedProcess`. The resources used
+    by the process are set as its ``usage``, see :func:`wait_with_usage`.
+
+    The command runs in a session of its own, which is killed as a whole on
+    ``should_stop`` or after ``timeout`` seconds, see :class:`Watchdog`. The
+    reason is set as ``stopped`` of the result, ``None`` if it ran through.
+
+    The command gets the environment ``env`` if given, and is bound to the
+    ``cpus``, which the processes and threads it starts inherit.
+    """
+    started = time.monotonic()
+    with subprocess.Popen(
+        args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+        start_new_session=True, env=env, preexec_fn=bind_cpus(cpus),
+    ) as process:
+        with Watchdog(process.pid, should_stop, timeout) as watchdog:
+            try:
+                tail = read_lines(process.stdout, on_line, limit)
+            except BaseException:
+                kill_process_group(process.pid, signal.SIGKILL)
+                raise
+            usage = wait_with_usage(process, started)
+    # Don't leave behind children that didn't exit along with the process.
+    kill_process_group(process.pid, signal.SIGKILL)
+    result = subprocess.CompletedProcess(
+        args=args, returncode=process.returncode, stdout=tail.getvalue()
+    )
+    result.usage = usage
+    result.stopped = watchdog.reason
+    return result
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+"""Split a workspace into page ranges and merge the results back."""
+
+import copy
+import os
+import shutil
+from typing import List
+
+from ocrd_models import OcrdMets
+from ocrd.workspace import Workspace
+
+from ocrd_butler.execution.mets import MetsIndex
+
+
+def split_pages(page_ids: List[str], shards: int) -> List[List[str]]:
+    """ Split the pages into at most ``shards`` consecutive ranges of nearly
+    the same size.
+
+    >>> split_pages(['P1', 'P2', 'P3', 'P4', 'P5'], 2)
+    [['P1', 'P2', 'P3'], ['P4', 'P5']]
+
+    >>> split_pages(['P1', 'P2'], 4)
+    [['P1'], ['P2']]
+
+    >>> split_pages([], 4)
+    []
+    """
+    shards = max(1, min(shards, len(page_ids)))
+    size, rest = divmod(len(page_ids), shards)
+    ranges = []
+    start = 0
+    for index in range(shards):
+        end = start + size + (1 if index < rest else 0)
+        if end > start:
+            ranges.append(page_ids[start:end])
+        start = end
+    return ranges
+
+
+def shard_mets_path(workspace: Workspace, name: str) -> str:
+    """ Path of the METS file of a shard of the workspace. """
+    return os.path.join(workspace.directory, f"mets.{name}.xml")
+
+
+def create_shard(workspace: Workspace, name: str) -> str:
+    """ Create a copy of the METS of the workspace, to be processed
+    independently from the other shards, and return its path.
+    """
+    path = shard_mets_path(workspace, name)
+    shutil.copyfile(workspace.mets_target, path)
+    return path
+
+
+def merge_shard(workspace: Workspace, path: str, agents: bool = True) -> int:
+    """ Add the files a processor added to the METS of a shard to the METS of
+    the workspace, in the order they appear in the shard. If ``agents`` is
+    set, the agents added to the shard are taken over as well.
+
+    Returns the number of merged files. The METS of the workspace is not
+    saved.
+    """
+    known = {ocrd_file.ID for ocrd_file in workspace.mets.find_files()}
+
+    merged = 0
+    for file_grp, files in MetsIndex.from_file(path).groups.items():
+        for mets_file in files:
+            if mets_file["ID"] in known:
+                continue
+            workspace.mets.add_file(
+                file_grp,
+                ID=mets_file["ID"],
+                mimetype=mets_file["mimetype"],
+                pageId=mets_file["pageId"],
+                url=mets_file["url"],
+            )
+            merged += 1
+
+    if agents:
+        # pylint: disable=protected-access
+        shard = OcrdMets(filename=path)
+        known_agents = len(workspace.mets.agents)
+        for agent in shard.agents[known_agents:]:
+            placeholder = workspace.mets.add_agent()._el
+            placeholder.getparent().replace(
+                placeholder, copy.deepcopy(agent._el)
+            )
+
+    return merged
+
+
+def remove_shard(path: str):
+    """ Remove the METS file of a shard. """
+    if os.path.exists(path):
+        os.remove(path)
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+"""Stream page batches through the steps of a workflow."""
+
+import os
+import queue
+import threading
+import time
+from typing import (
+    Any,
+    Callable,
+    List,
+    Optional,
+)
+
+from ocrd.workspace import Workspace
+
+from ocrd_butler.execution.mets import mets_index
+from ocrd_butler.execution.pages import (
+    create_shard,
+    merge_shard,
+    remove_shard,
+)
+from ocrd_butler.util import logger
+
+
+# Marks the end of the batches in the queue between two steps.
+_DONE = None
+
+
+def batch_pages(page_ids: List[str], size: int) -> List[List[str]]:
+    """ Split the pages into consecutive batches of ``size`` pages.
+
+    >>> batch_pages(['P1', 'P2', 'P3', 'P4', 'P5'], 2)
+    [['P1', 'P2'], ['P3', 'P4'], ['P5']]
+
+    >>> batch_pages(['P1', 'P2'], 4)
+    [['P1', 'P2']]
+    """
+    size = max(1, size)
+    return [page_ids[start:start + size]
+            for start in range(0, len(page_ids), size)]
+
+
+class PipelineFailure(object):
+    """ The first failure of a step, at ``index`` in the steps, on a
+    batch. """
+
+    def __init__(self, step: Any, batch: int, result: Any = None,
+                 exception: Exception = None, index: int = None):
+        self.step = step
+        self.index = index
+        self.batch = batch
+        self.result = result
+        self.exception = exception
+
+
+def run_pipeline(
+    workspace: Workspace,
+    steps: List[Any],
+    run_step: Callable,
+    output_file_grps: List[str],
+    batch_size: int,
+    queue_size: int = 2,
+    workers: List[int] = None,
+) -> Optional[PipelineFailure]:
+    """ Run the ``steps`` of a workflow over batches of ``batch_size`` pages,
+    so that a batch enters step k+1 while the next one is still in step k.
+
+    Every step has its own thread(s) (``workers`` per step, one by default),
+    connected to the next step by a queue holding at most ``queue_size``
+    batches. A batch is processed on its own copy of the METS file through
+    all steps. ``run_step(step, mets_url, page_id)`` runs one step on one
+    batch and returns a :class:`subprocess.CompletedProcess`.
+
+    After all batches passed through, their files are merged back into the
+    METS of the workspace in page order and the METS is saved, which gives
+    the same METS as running the steps one after the other.
+
+    On the first failed step the pipeline is drained, the METS of the
+    workspace is left untouched and the failure is returned. Exceptions
+    raised by ``run_step`` are raised again after the pipeline is drained.
+    """
+    batches = batch_pages(mets_index(workspace).pages, batch_size)
+    workers = workers or [1] * len(steps)
+    logger.info(f"Run {len(steps)} steps pipelined over {len(batches)} "
+                f"batches of up to {batch_size} pages.")
+
+    # Avoid races of the subprocesses creating the output directories.
+    for output_file_grp in output_file_grps:
+        os.makedirs(os.path.join(workspace.directory, output_file_grp),
+                    exist_ok=True)
+    shards = [
+        create_shard(workspace, f"batch-{index:05}")
+        for index in range(len(batches))
+    ]
+
+    # The input of every step: all batches for the first one, the batches
+    # finished by the previous step for the others.
+    queues = [queue.Queue()] + [
+        queue.Queue(maxsize=queue_size) for _ in steps[1:]
+    ]
+    for batch in range(len(batches)):
+        queues[0].put(batch)
+    for _ in range(workers[0]):
+        queues[0].put(_DONE)
+
+    failures = []
+    failed = threading.Event()
+    lock = threading.Lock()
+    running = list(workers)
+
+    def _stage(index: int):
+        step = steps[index]
+        while True:
+            batch = queues[index].get()
+            if batch is _DONE:
+                break
+            # After a failure the step keeps taking the batches of the
+            # previous step, so that one doesn't block on a full queue.
+            if failed.is_set():
+                continue
+            started = time.time()
+            try:
+                result = run_step(step, shards[batch], ",".join(batches[batch]))
+            except Exception as exc:
+                failure = PipelineFailure(step, batch, exception=exc,
+                                          index=index)
+            else:
+                failure = None
+                if result.returncode != 0:
+                    failure = PipelineFailure(step, batch, result=result,
+                                              index=index)
+            if failure is not None:
+                with lock:
+                    failures.append(failure)
+                failed.set()
+                continue
+            logger.info(f"Step {index + 1} finished batch {batch + 1}/"
+                        f"{len(batches)} in {time.time() - started:.2f}s.")
+            if index + 1 < len(steps):
+                queues[index + 1].put(batch)
+
+        # The last worker of a step tells the workers of the next one.
+        with lock:
+            running[index] -= 1
+            last = running[index] == 0
+        if last and index + 1 < len(steps):
+            for _ in range(workers[index + 1]):
+                queues[index + 1].put(_DONE)
+
+    threads = [
+        threading.Thread(target=_stage, args=(index,), daemon=True)
+        for index, count in enumerate(workers)
+        for _ in range(count)
+    ]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if failures:
+            failure = failures[0]
+            if failure.exception is not None:
+                raise failure.exception
+            return failure
+
+        for index, shard in enumerate(shards):
+            merge_shard(workspace, shard, agents=index == 0)
+        workspace.save_mets()
+    finally:
+        for shard in shards:
+            remove_shard(shard)
+
+    return None
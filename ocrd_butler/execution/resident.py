@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+
+"""Resident workers keeping processors and their models loaded between the
+steps of tasks."""
+
+from collections import OrderedDict
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from typing import (
+    Callable,
+    Dict,
+    List,
+    Optional,
+)
+
+from ocrd_butler.execution.output import (
+    OutputTail,
+    Watchdog,
+    bind_cpus,
+)
+from ocrd_butler.execution.resident_worker import RESULT_PREFIX
+from ocrd_butler.util import logger
+
+
+class ResidentWorkerError(Exception):
+    """ Raised if a resident worker died or can't be started. """
+
+
+class ResidentWorker(object):
+    """ A process running :mod:`~ocrd_butler.execution.resident_worker` for
+    the processor class given as ``module:Class`` and a set of parameters,
+    with the thread ``limits`` (see
+    :func:`~ocrd_butler.execution.resources.thread_limits`) in its
+    environment, bound to the ``cpus`` if given.
+
+    It runs one job at a time, see :meth:`run`.
+    """
+
+    def __init__(self, class_path: str, parameter: dict,
+                 limits: Dict[str, str] = None, cpus: List[int] = None):
+        self.class_path = class_path
+        self.parameter = parameter
+        self.limits = limits or {}
+        self.cpus = cpus
+        self.lock = threading.Lock()
+        self.process = subprocess.Popen(
+            [
+                sys.executable, "-u", "-m",
+                "ocrd_butler.execution.resident_worker",
+                class_path, json.dumps(parameter),
+            ],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            start_new_session=True,
+            env=dict(os.environ, **self.limits) if self.limits else None,
+            preexec_fn=bind_cpus(cpus),
+        )
+        logger.info(f"Started resident worker {self.process.pid} for "
+                    f"{class_path} with parameters {json.dumps(parameter)}.")
+
+    @property
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def run(
+        self, args: list, job: dict, on_line: Callable[[str], None], limit: int,
+        should_stop: Callable[[], bool] = None, timeout: float = None,
+    ) -> subprocess.CompletedProcess:
+        """ Run the job, passing the output of the processor line by line to
+        ``on_line`` while it runs. The result looks like the one of
+        :func:`~ocrd_butler.execution.output.run_streaming` for the command
+        line ``args`` the job stands for, including the worker being killed
+        on ``should_stop`` or after ``timeout`` seconds.
+
+        Raises :class:`ResidentWorkerError` if the worker dies otherwise.
+        """
+        started = time.monotonic()
+        try:
+            self.process.stdin.write((json.dumps(job) + "\n").encode("utf-8"))
+            self.process.stdin.flush()
+        except OSError as exc:
+            raise ResidentWorkerError(f"Can't send job: {exc}")
+
+        tail = OutputTail(limit)
+        with Watchdog(self.process.pid, should_stop, timeout) as watchdog:
+            for line in iter(self.process.stdout.readline, b""):
+                text = line.decode("utf-8", errors="replace").rstrip("\n")
+                if text.startswith(RESULT_PREFIX):
+                    result = json.loads(text[len(RESULT_PREFIX):])
+                    break
+                tail.append(line)
+                on_line(text)
+            else:
+                self.stop()
+                if watchdog.reason is None:
+                    raise ResidentWorkerError(
+                        f"Resident worker {self.process.pid} exited with "
+                        f"{self.process.returncode}."
+                    )
+                result = {"returncode": self.process.returncode, "usage": {
+                    "utime": 0, "stime": 0, "maxrss": 0,
+                    "read_bytes": 0, "write_bytes": 0,
+                }}
+
+        completed = subprocess.CompletedProcess(
+            args=args, returncode=result["returncode"], stdout=tail.getvalue()
+        )
+        completed.usage = dict(
+            wall=round(time.monotonic() - started, 3), **result["usage"]
+        )
+        completed.stopped = watchdog.reason
+        return completed
+
+    def stop(self):
+        """ Let the worker finish and wait for it. """
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self.process.stdout.close()
+        logger.info(f"Stopped resident worker {self.process.pid}.")
+
+
+class ResidentWorkers(object):
+    """ The resident workers of this process, at most ``max_workers``. The
+    ones not used for the longest time are stopped first.
+    """
+
+    def __init__(self, max_workers: int = 4):
+        self.max_workers = max_workers
+        self.workers = OrderedDict()
+        self.lock = threading.Lock()
+
+    def acquire(self, class_path: str, parameter: dict,
+                limits: Dict[str, str] = None,
+                cpus: List[int] = None) -> Optional[ResidentWorker]:
+        """ Get the worker for the processor, parameters, thread limits and
+        CPUs, locked for the caller. Returns ``None`` if it is busy with
+        another job. """
+        key = (
+            class_path, json.dumps(parameter, sort_keys=True),
+            json.dumps(limits or {}, sort_keys=True), tuple(cpus or ()),
+        )
+        with self.lock:
+            worker = self.workers.get(key)
+            if worker is not None and not worker.alive:
+                logger.warning(f"Resident worker {worker.process.pid} for "
+                               f"{class_path} died.")
+                del self.workers[key]
+                worker = None
+            if worker is None:
+                self._make_room()
+                worker = ResidentWorker(class_path, parameter, limits, cpus)
+                self.workers[key] = worker
+            self.workers.move_to_end(key)
+            if not worker.lock.acquire(blocking=False):
+                return None
+            return worker
+
+    def _make_room(self):
+        for key, worker in list(self.workers.items()):
+            if len(self.workers) < self.max_workers:
+                break
+            if worker.lock.acquire(blocking=False):
+                del self.workers[key]
+                worker.stop()
+                worker.lock.release()
+
+    def stop(self):
+        """ Stop all workers. """
+        with self.lock:
+            for worker in self.workers.values():
+                worker.stop()
+            self.workers.clear()
+
+
+# The workers of this process, shared by all tasks it runs.
+resident_workers = ResidentWorkers()
+
+
+def run_resident(
+    class_path: str, parameter: dict, args: list, job: dict,
+    on_line: Callable[[str], None], limit: int,
+    should_stop: Callable[[], bool] = None, timeout: float = None,
+    limits: Dict[str, str] = None, cpus: List[int] = None,
+) -> Optional[subprocess.CompletedProcess]:
+    """ Run the job by the resident worker of the processor, see
+    :meth:`ResidentWorker.run`. A worker is bound to the ``cpus`` when it
+    starts, as the threads it started would keep running anywhere, so it
+    only takes jobs bound to the same ones.
+
+    Returns ``None`` if the job has to run the usual way, i.e. the worker is
+    busy, can't be started or died.
+    """
+    try:
+        worker = resident_workers.acquire(class_path, parameter, limits, cpus)
+    except Exception as exc:
+        logger.warning(f"Can't start resident worker for {class_path}: {exc}")
+        return None
+    if worker is None:
+        logger.info(f"Resident worker for {class_path} is busy.")
+        return None
+    try:
+        return worker.run(args, job, on_line, limit, should_stop, timeout)
+    except ResidentWorkerError as exc:
+        logger.warning(f"{exc}")
+        return None
+    finally:
+        worker.lock.release()
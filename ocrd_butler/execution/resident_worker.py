@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+"""A long-lived process keeping one instance of a processor.
+
+Started by :class:`~ocrd_butler.execution.resident.ResidentWorker` as::
+
+    python -m ocrd_butler.execution.resident_worker module:Class '{"param": 1}'
+
+The processor is instantiated on the first job and kept for all following
+ones, so models are loaded only once. Jobs are read from ``stdin``, one JSON
+object per line. Everything the processor logs or prints goes to ``stdout``
+as it is, the result of a job is written as a line starting with
+:data:`RESULT_PREFIX`.
+"""
+
+import importlib
+import json
+import logging
+import os
+import resource
+import sys
+import traceback
+
+from ocrd_utils import (
+    initLogging,
+    setOverrideLogLevel,
+)
+
+
+RESULT_PREFIX = "\x1eocrd-butler-result "
+
+
+def import_class(class_path: str) -> type:
+    """ Import the class given as ``module:Class``.
+
+    >>> import_class('collections:OrderedDict')
+    <class 'collections.OrderedDict'>
+    """
+    module_name, _, class_name = class_path.partition(":")
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def _usage() -> resource.struct_rusage:
+    return resource.getrusage(resource.RUSAGE_SELF)
+
+
+def _usage_since(before: resource.struct_rusage) -> dict:
+    """ The resources used since ``before``, like
+    :func:`~ocrd_butler.execution.output.wait_with_usage`. The peak memory is
+    the one of the whole process, including the loaded models. """
+    after = _usage()
+    return {
+        "utime": round(after.ru_utime - before.ru_utime, 3),
+        "stime": round(after.ru_stime - before.ru_stime, 3),
+        "maxrss": after.ru_maxrss * 1024,
+        "read_bytes": (after.ru_inblock - before.ru_inblock) * 512,
+        "write_bytes": (after.ru_oublock - before.ru_oublock) * 512,
+    }
+
+
+class ResidentProcessor(object):
+    """ Run jobs with one instance of the processor class. """
+
+    def __init__(self, processor_class: type, parameter: dict):
+        self.processor_class = processor_class
+        self.parameter = parameter
+        self.processor = None
+
+    def run(self, job: dict):
+        """ Run the processor on the workspace and pages of the job, and save
+        the METS like ``ocrd.processor.helpers.run_processor`` does. """
+        # Imported here to have the logging initialized before.
+        from ocrd.resolver import Resolver
+
+        setOverrideLogLevel(job.get("log_level"), silent=True)
+        workspace = Resolver().workspace_from_url(
+            job["mets_url"], dst_dir=job["working_dir"]
+        )
+        page_id = job.get("page_id") or None
+        if self.processor is None:
+            self.processor = self.processor_class(
+                workspace,
+                parameter=self.parameter,
+                input_file_grp=job["input_file_grp"],
+                output_file_grp=job["output_file_grp"],
+                page_id=page_id,
+            )
+        else:
+            os.chdir(workspace.directory)
+            self.processor.workspace = workspace
+            self.processor.input_file_grp = job["input_file_grp"]
+            self.processor.output_file_grp = job["output_file_grp"]
+            self.processor.page_id = page_id
+
+        processor = self.processor
+        processor.process()
+
+        ocrd_tool = processor.ocrd_tool
+        workspace.mets.add_agent(
+            name="%s v%s" % (ocrd_tool["executable"], processor.version),
+            _type="OTHER",
+            othertype="SOFTWARE",
+            role="OTHER",
+            otherrole=ocrd_tool["steps"][0],
+            notes=[({"option": "input-file-grp"}, job["input_file_grp"]),
+                   ({"option": "output-file-grp"}, job["output_file_grp"]),
+                   ({"option": "parameter"}, json.dumps(self.parameter)),
+                   ({"option": "page-id"}, page_id or "")]
+        )
+        workspace.save_mets()
+
+
+def main(class_path: str, parameter: str):
+    protocol = os.fdopen(os.dup(sys.stdout.fileno()), "w")
+    # Nothing but the protocol goes to stdout, but everything ends up in the
+    # same pipe anyway, as the butler reads stderr along with stdout.
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    initLogging()
+
+    resident = ResidentProcessor(import_class(class_path), json.loads(parameter))
+    for line in sys.stdin:
+        job = json.loads(line)
+        before = _usage()
+        try:
+            resident.run(job)
+            returncode = 0
+        except Exception:
+            traceback.print_exc()
+            returncode = 1
+        for handler in logging.getLogger().handlers:
+            handler.flush()
+        sys.stderr.flush()
+        protocol.write(RESULT_PREFIX + json.dumps({
+            "returncode": returncode,
+            "usage": _usage_since(before),
+        }) + "\n")
+        protocol.flush()
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:3])
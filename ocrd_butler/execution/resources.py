@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+
+"""Admit processor runs only if the host has the cores and memory they need,
+shared by all worker processes on the host."""
+
+from contextlib import contextmanager
+import fcntl
+import json
+import math
+import os
+import tempfile
+import time
+from typing import (
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+)
+import uuid
+
+from ocrd_butler.execution.stop import TaskStopped
+from ocrd_butler.util import logger
+
+
+# Learned requirements decay by this factor per run, so they follow
+# processors getting cheaper, while a single peak keeps them up for a while.
+LEARN_DECAY = 0.9
+
+# A run limited to some cores which used this share of them may have needed
+# more, see ResourceLedger.learn.
+CAP_SATURATION = 0.8
+
+
+# The variables limiting the threads of the libraries the processors use,
+# i.e. OpenMP (Tesseract), the BLAS implementations and TensorFlow.
+THREAD_VARIABLES = (
+    "OMP_THREAD_LIMIT",
+    "OMP_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+    "TF_NUM_INTRAOP_THREADS",
+)
+
+
+def thread_limits(threads: int) -> Dict[str, str]:
+    """ The environment variables limiting a processor to ``threads``
+    threads. TensorFlow runs its independent operations one at a time.
+
+    >>> thread_limits(2)["OMP_THREAD_LIMIT"], thread_limits(2)["TF_NUM_INTEROP_THREADS"]
+    ('2', '1')
+    """
+    limits = {variable: str(threads) for variable in THREAD_VARIABLES}
+    limits["TF_NUM_INTEROP_THREADS"] = "1"
+    return limits
+
+
+def assign_cpus(available: List[int], load: Dict[int, int],
+                count: int) -> List[int]:
+    """ Pick ``count`` of the ``available`` CPUs, the ones the fewest
+    processors are bound to (``load``) first.
+
+    >>> assign_cpus([0, 1, 2, 3], {0: 1, 1: 1}, 2)
+    [2, 3]
+    >>> assign_cpus([0, 1, 2, 3], {0: 1, 1: 2, 2: 1, 3: 1}, 3)
+    [0, 2, 3]
+    """
+    count = max(1, min(count, len(available)))
+    return sorted(sorted(
+        available, key=lambda cpu: (load.get(cpu, 0), cpu)
+    )[:count])
+
+
+def host_memory() -> int:
+    """ The physical memory of the host in bytes. """
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+
+
+def pid_alive(pid: int) -> bool:
+    """ Check if the process exists. """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class ResourceLedger(object):
+    """ Reservations of cores and memory of the processors running on the
+    host, kept in ``ledger.json`` in ``directory`` and locked with
+    :func:`fcntl.flock`. Reservations of processes that died are dropped.
+
+    The cores and memory a processor needs are given or learned from its
+    former runs (``learned.json``), see :meth:`learn`.
+
+    With ``pin_cpus``, every reservation gets as many CPUs of the ones this
+    process may run on as it has cores, see :func:`assign_cpus`.
+    """
+
+    def __init__(self, directory: str, cores: float = None,
+                 memory: int = None, default_cores: float = 1,
+                 default_memory: int = 2 * 1024 ** 3, poll: float = 1.0,
+                 pin_cpus: bool = False):
+        self.directory = directory
+        self.cores = cores or os.cpu_count()
+        self.memory = memory or host_memory()
+        self.default_cores = default_cores
+        self.default_memory = default_memory
+        self.poll = poll
+        self.pin_cpus = pin_cpus
+        os.makedirs(directory, exist_ok=True)
+
+    @contextmanager
+    def _locked(self, name: str) -> Iterator[dict]:
+        """ Lock the JSON file, yield its content and write it back. """
+        path = os.path.join(self.directory, f"{name}.json")
+        with open(os.path.join(self.directory, f"{name}.lock"), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                try:
+                    with open(path, "r") as fh:
+                        data = json.load(fh)
+                except (FileNotFoundError, ValueError):
+                    data = {}
+                yield data
+                fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".part")
+                with os.fdopen(fd, "w") as fh:
+                    json.dump(data, fh, indent=2)
+                os.replace(tmp, path)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def requirements(self, executable: str, cores: float = None,
+                     memory: int = None) -> dict:
+        """ The cores and memory to reserve for the processor, the given ones
+        or else the learned ones, capped at the ones of the host. """
+        if cores is None or memory is None:
+            with self._locked("learned") as learned:
+                known = learned.get(executable, {})
+            if cores is None:
+                cores = known.get("cores", self.default_cores)
+            if memory is None:
+                memory = known.get("memory", self.default_memory)
+        return {
+            "cores": min(cores, self.cores),
+            "memory": min(memory, self.memory),
+        }
+
+    def _try_reserve(self, key: str, executable: str,
+                     needed: dict) -> Optional[dict]:
+        with self._locked("ledger") as ledger:
+            reservations = ledger.setdefault("reservations", {})
+            for other, reservation in list(reservations.items()):
+                if not pid_alive(reservation["pid"]):
+                    logger.warning(f"Drop reservation of dead process "
+                                   f"{reservation['pid']}.")
+                    del reservations[other]
+            cores = sum(r["cores"] for r in reservations.values())
+            memory = sum(r["memory"] for r in reservations.values())
+            if cores + needed["cores"] > self.cores or \
+                    memory + needed["memory"] > self.memory:
+                return None
+            reservation = dict(
+                needed, pid=os.getpid(), executable=executable,
+                since=time.time(),
+            )
+            if self.pin_cpus:
+                load = {}
+                for other in reservations.values():
+                    for cpu in other.get("cpus", []):
+                        load[cpu] = load.get(cpu, 0) + 1
+                reservation["cpus"] = assign_cpus(
+                    sorted(os.sched_getaffinity(0)), load,
+                    math.ceil(needed["cores"])
+                )
+            reservations[key] = reservation
+            return reservation
+
+    def release(self, key: str):
+        """ Drop the reservation. """
+        with self._locked("ledger") as ledger:
+            ledger.get("reservations", {}).pop(key, None)
+
+    @contextmanager
+    def reserve(self, executable: str, cores: float = None,
+                memory: int = None,
+                should_stop: Callable[[], bool] = None) -> Iterator[dict]:
+        """ Wait until the host has the resources the processor needs (see
+        :meth:`requirements`), and reserve them while the context lasts.
+        Yields the cores and memory reserved, and the ``cpus`` assigned to
+        the processor if they are pinned.
+
+        Raises :class:`~ocrd_butler.execution.stop.TaskStopped` if
+        ``should_stop`` returns true while waiting.
+        """
+        needed = self.requirements(executable, cores, memory)
+        key = str(uuid.uuid4())
+        waiting = None
+        while True:
+            reservation = self._try_reserve(key, executable, needed)
+            if reservation is not None:
+                break
+            if should_stop is not None and should_stop():
+                raise TaskStopped(f"Stopped waiting for resources for "
+                                  f"{executable}.")
+            if waiting is None:
+                waiting = time.monotonic()
+                logger.info(f"Wait for {needed['cores']} cores and "
+                            f"{needed['memory']} bytes for {executable}.")
+            time.sleep(self.poll)
+        if waiting is not None:
+            logger.info(f"Waited {time.monotonic() - waiting:.1f}s for "
+                        f"resources for {executable}.")
+        try:
+            if "cpus" in reservation:
+                yield dict(needed, cpus=reservation["cpus"])
+            else:
+                yield needed
+        finally:
+            self.release(key)
+
+    def learn(self, executable: str, usage: dict,
+              cap: int = None) -> Optional[dict]:
+        """ Learn the cores and memory the processor needs from the resources
+        one of its runs used, see
+        :func:`~ocrd_butler.execution.output.wait_with_usage`.
+
+        A run limited to ``cap`` cores can't use more of them. If it used
+        (nearly) all, the processor gets one core more than its cap, unless
+        a run with room to spare showed it doesn't use more than the cap.
+        The cores of the last run with room are kept as ``uncapped``.
+        """
+        if not usage or not usage.get("wall"):
+            return None
+        used = (usage["utime"] + usage["stime"]) / usage["wall"]
+        cores = max(1, math.ceil(used))
+        memory = usage["maxrss"]
+        with self._locked("learned") as learned:
+            known = learned.get(executable) or {}
+            uncapped = known.get("uncapped")
+            if cap is None or used < cap * CAP_SATURATION:
+                uncapped = cores
+            elif uncapped is None or uncapped > cap:
+                cores = min(cap + 1, self.cores)
+            if known:
+                cores = max(cores, round(known["cores"] * LEARN_DECAY, 2))
+                memory = max(memory, int(known["memory"] * LEARN_DECAY))
+            learned[executable] = {"cores": cores, "memory": memory,
+                                   "uncapped": uncapped}
+        return learned[executable]
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+"""Route tasks to Celery queues by their priority and size, so small and
+urgent tasks don't wait behind big ones."""
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    Dict,
+    List,
+    Optional,
+    Tuple,
+)
+import xml.etree.ElementTree as ET
+
+import requests
+
+from ocrd_butler.execution.cache import MetsCache
+from ocrd_butler.execution.download import is_remote
+from ocrd_butler.execution.mets import (
+    summarize_mets,
+    summary_page_count,
+)
+from ocrd_butler.util import logger
+
+
+def count_pages(mets: bytes, file_grp: str) -> Optional[int]:
+    """ Count the files of the file group in the METS, see
+    :func:`~ocrd_butler.execution.mets.summary_page_count`.
+
+    >>> count_pages(b'''<mets:mets xmlns:mets="http://www.loc.gov/METS/">
+    ...   <mets:fileSec><mets:fileGrp USE="DEFAULT">
+    ...     <mets:file ID="F1"/><mets:file ID="F2"/>
+    ...   </mets:fileGrp></mets:fileSec></mets:mets>''', 'MAX')
+    2
+    """
+    return summary_page_count(summarize_mets(mets), file_grp)
+
+
+def fetch_page_count(src: str, file_grp: str, timeout: int = 10,
+                     cache: MetsCache = None) -> Optional[int]:
+    """ Get the number of pages of the task source, if it is a METS file.
+    Returns ``None`` if it can't be fetched or parsed. With a ``cache``, the
+    METS file and its summary are taken from it. """
+    try:
+        if cache is not None and is_remote(src):
+            return summary_page_count(
+                cache.fetch(src, timeout=timeout)["summary"], file_grp
+            )
+        response = requests.get(src, timeout=timeout)
+        response.raise_for_status()
+        return count_pages(response.content, file_grp)
+    except (requests.RequestException, ET.ParseError, ValueError) as exc:
+        logger.info(f"Can't count the pages of {src}: {exc}")
+        return None
+
+
+def fetch_page_counts(
+    sources: List[Tuple[str, str]], workers: int = 8, timeout: int = 10,
+    cache: MetsCache = None,
+) -> List[Optional[int]]:
+    """ Get the page counts of the sources, given as ``(src, file_grp)``,
+    concurrently. """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(
+            lambda source: fetch_page_count(
+                *source, timeout=timeout, cache=cache
+            ),
+            sources
+        ))
+
+
+def size_queue(
+    page_count: Optional[int], size_queues: List[Tuple[str, Optional[int]]]
+) -> str:
+    """ Get the queue for the number of pages, i.e. the first one of
+    ``size_queues`` whose limit is at least the number of pages. Tasks of
+    unknown size go to the last one.
+
+    >>> queues = [('small', 50), ('medium', 500), ('large', None)]
+    >>> size_queue(5, queues), size_queue(500, queues), size_queue(2000, queues)
+    ('small', 'medium', 'large')
+    >>> size_queue(None, queues)
+    'large'
+    """
+    if page_count is not None:
+        for queue, limit in size_queues:
+            if limit is None or page_count <= limit:
+                return queue
+    return size_queues[-1][0]
+
+
+def task_queue(task: dict, config: dict) -> Optional[str]:
+    """ Get the queue for the task with the given configuration, ``None``
+    for the default queue if ``TASK_ROUTING`` is disabled. """
+    if not config["TASK_ROUTING"]:
+        return None
+    if (task.get("priority") or 0) >= config["TASK_PRIORITY_URGENT"]:
+        return config["TASK_PRIORITY_QUEUE"]
+    return size_queue(task.get("page_count"), config["TASK_SIZE_QUEUES"])
+
+
+def worker_nodes(weights: Dict[str, int]) -> List[str]:
+    """ Get the arguments of ``celery multi start`` for a node per queue,
+    with as many worker processes as the weight of the queue.
+
+    >>> worker_nodes({'urgent': 2, 'large': 1})
+    ['urgent', 'large', '-Q:urgent', 'urgent', '-c:urgent', '2', '-Q:large', 'large', '-c:large', '1']
+    """
+    args = list(weights)
+    for queue, weight in weights.items():
+        args += [f"-Q:{queue}", queue, f"-c:{queue}", str(weight)]
+    return args
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+"""Run tasks in workspaces on local scratch space, e.g. an SSD or tmpfs,
+and publish their results to the shared results directory at the end.
+
+Only the METS file, the files of the published file groups and some extra
+files like the checkpoints go to the results directory. They are copied
+into a staging directory beside it first, which then takes its place.
+"""
+
+import os
+import shutil
+import socket
+import tempfile
+from typing import (
+    Iterable,
+    List,
+)
+
+from ocrd_models import OcrdMets
+from ocrd_utils import is_local_filename
+from ocrd.workspace import Workspace
+
+from ocrd_butler.execution.mets import mets_index
+from ocrd_butler.execution.resources import pid_alive
+from ocrd_butler.util import logger
+
+
+# The file in a scratch workspace naming the host and process owning it.
+OWNER_FILE = "butler-scratch-owner"
+
+
+def create_scratch(root: str, uid: str) -> str:
+    """ Create the scratch directory of the task, owned by this process, and
+    return its path. An existing one of a former run is removed. """
+    directory = os.path.join(root, uid)
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+    with open(os.path.join(directory, OWNER_FILE), "w") as fh:
+        fh.write(f"{socket.gethostname()} {os.getpid()}")
+    return directory
+
+
+def sweep_scratch(root: str) -> List[str]:
+    """ Remove the scratch directories of processes on this host that died
+    without cleaning up, e.g. killed workers. Returns the removed ones. """
+    removed = []
+    if not os.path.isdir(root):
+        return removed
+    hostname = socket.gethostname()
+    for name in os.listdir(root):
+        directory = os.path.join(root, name)
+        try:
+            with open(os.path.join(directory, OWNER_FILE), "r") as fh:
+                host, pid = fh.read().split()
+        except (OSError, ValueError):
+            continue
+        if host == hostname and not pid_alive(int(pid)):
+            shutil.rmtree(directory, ignore_errors=True)
+            removed.append(directory)
+    if removed:
+        logger.info(f"Removed {len(removed)} abandoned scratch workspaces.")
+    return removed
+
+
+def _copy(src: str, dst: str):
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    shutil.copyfile(src, dst)
+
+
+def publish(workspace: Workspace, dst_dir: str, file_grps: Iterable[str],
+            extra_files: Iterable[str] = ()) -> int:
+    """ Publish the file groups of the workspace and its METS, without the
+    other file groups, to ``dst_dir``, along with the ``extra_files`` of the
+    workspace directory. Whatever was in ``dst_dir`` before is replaced.
+
+    Returns the number of published files.
+    """
+    file_grps = [grp for grp in file_grps if grp]
+    parent, name = os.path.split(dst_dir.rstrip("/"))
+    staging = tempfile.mkdtemp(prefix=f".{name}.publish-", dir=parent)
+    os.chmod(staging, 0o755)
+    try:
+        published = 0
+        index = mets_index(workspace)
+        for file_grp in file_grps:
+            for mets_file in index.files(file_grp):
+                url = mets_file["url"]
+                if not url or not is_local_filename(url):
+                    continue
+                src = os.path.join(workspace.directory, url)
+                if os.path.isfile(src):
+                    _copy(src, os.path.join(staging, url))
+                    published += 1
+
+        mets = OcrdMets(filename=workspace.mets_target)
+        for file_grp in mets.file_groups:
+            if file_grp not in file_grps:
+                mets.remove_file_group(file_grp, recursive=True, force=True)
+        with open(os.path.join(staging, "mets.xml"), "wb") as fh:
+            fh.write(mets.to_xml(xmllint=True))
+
+        for extra_file in extra_files:
+            src = os.path.join(workspace.directory, extra_file)
+            if os.path.isfile(src):
+                _copy(src, os.path.join(staging, extra_file))
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+    # Move the former content out of the way, so the new one takes its place
+    # at once, and put it back if that fails.
+    old = tempfile.mkdtemp(prefix=f".{name}.old-", dir=parent)
+    try:
+        if os.path.exists(dst_dir):
+            os.rename(dst_dir, os.path.join(old, name))
+        try:
+            os.rename(staging, dst_dir)
+        except OSError:
+            if os.path.exists(os.path.join(old, name)):
+                os.rename(os.path.join(old, name), dst_dir)
+            raise
+    finally:
+        shutil.rmtree(old, ignore_errors=True)
+        shutil.rmtree(staging, ignore_errors=True)
+    logger.info(f"Published {published} files of the file groups "
+                f"{', '.join(file_grps)} to {dst_dir}.")
+    return published
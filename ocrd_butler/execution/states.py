@@ -0,0 +1,388 @@
+# -*- coding: utf-8 -*-
+
+"""A channel for the state transitions of tasks, sent by the signal handlers
+of the workers, which are written to the database in bulk instead of one
+transaction per transition.
+
+Every transition carries the time it happened, so a later transition of a
+task isn't overwritten by an earlier one arriving late. All of them are
+kept as :class:`~ocrd_butler.database.models.TaskEvent`, to tell when a task
+was queued, started and finished, see :func:`task_timings`. The channel is
+chosen by ``TASK_STATE_CHANNEL``:
+
+* a Redis URL: the transitions are pushed to a Redis list, which a single
+  writer drains, see :class:`StateWriter` (``make run-state-writer``);
+* ``"local"``: every worker process writes its transitions in a thread of
+  its own, and waits for them to be written when a task finished and
+  before it exits, see :func:`flush_states`, losing them if it is killed;
+* ``None``, the default: every transition is written at once.
+"""
+
+import atexit
+from datetime import (
+    datetime,
+    timezone,
+)
+import json
+import os
+import queue
+import threading
+import time
+from typing import (
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+)
+
+import redis
+
+from ocrd_butler.database import db
+from ocrd_butler.database.models import Task as db_model_Task
+from ocrd_butler.database.models import TaskEvent as db_model_TaskEvent
+from ocrd_butler.util import logger
+
+
+# The Redis list of the transitions.
+STATE_KEY = "ocrd_butler:task-states"
+
+# The states a task ends with.
+FINISHED_STATES = ("SUCCESS", "FAILURE", "REVOKED")
+
+
+def transition(uid: str, state: str, results: dict = None,
+               timestamp: float = None, hostname: str = None) -> dict:
+    """ A transition of the task to the state, with its results if given,
+    on the worker with the hostname. """
+    return {
+        "uid": uid,
+        "state": state,
+        "results": results,
+        "timestamp": time.time() if timestamp is None else timestamp,
+        "hostname": hostname,
+    }
+
+
+def coalesce(transitions: Iterable[dict]) -> List[dict]:
+    """ Reduce the transitions to the last one of every task, along with the
+    last results given.
+
+    >>> coalesce([
+    ...     transition("a", "STARTED", timestamp=1.0),
+    ...     transition("a", "SUCCESS", {"steps": []}, timestamp=3.0),
+    ...     transition("b", "STARTED", timestamp=2.0),
+    ...     transition("a", "STARTED", timestamp=2.0),
+    ... ])
+    [{'uid': 'a', 'state': 'SUCCESS', 'results': {'steps': []}, 'timestamp': 3.0, 'hostname': None}, {'uid': 'b', 'state': 'STARTED', 'results': None, 'timestamp': 2.0, 'hostname': None}]
+    """
+    latest = {}
+    for item in sorted(transitions, key=lambda item: item["timestamp"]):
+        former = latest.get(item["uid"])
+        if item["results"] is None and former is not None:
+            item = dict(item, results=former["results"])
+        latest[item["uid"]] = item
+    return list(latest.values())
+
+
+def apply_transitions(transitions: Iterable[dict]) -> int:
+    """ Write the transitions to the tasks in one transaction, leaving out
+    the ones older than the last state written, and record all of them as
+    events. Needs an app context.
+
+    Returns the number of updated tasks.
+    """
+    transitions = list(transitions)
+    if not transitions:
+        return 0
+    tasks = {
+        task.uid: task for task in db_model_Task.query.filter(
+            db_model_Task.uid.in_({item["uid"] for item in transitions})
+        )
+    }
+    db.session.add_all([
+        db_model_TaskEvent(
+            task_uid=item["uid"], state=item["state"],
+            timestamp=datetime.utcfromtimestamp(item["timestamp"]),
+            hostname=item.get("hostname"),
+        )
+        for item in transitions if item["uid"] in tasks
+    ])
+    updated = 0
+    for item in coalesce(transitions):
+        task = tasks.get(item["uid"])
+        if task is None:
+            logger.warning(f"Can't set status {item['state']} for unknown "
+                           f"task {item['uid']}.")
+            continue
+        changed = datetime.utcfromtimestamp(item["timestamp"])
+        if task.status_changed is not None and task.status_changed > changed:
+            continue
+        task.status = item["state"]
+        task.status_changed = changed
+        if item["results"] is not None:
+            task.results = item["results"]
+        updated += 1
+    db.session.commit()
+    return updated
+
+
+class DirectChannel(object):
+    """ Write every transition at once. """
+
+    def __init__(self, app):
+        self.app = app
+
+    def send(self, item: dict):
+        with self.app.app_context():
+            apply_transitions([item])
+
+    def flush(self):
+        pass
+
+
+class LocalChannel(object):
+    """ Write the transitions of this process in a thread, in batches of up
+    to ``batch_size`` at least every ``interval`` seconds.
+
+    The thread doesn't outlive the process, and the prefork worker
+    processes of Celery exit without ``atexit``, so the worker flushes the
+    channel when a task finished and before the process exits.
+    """
+
+    def __init__(self, app, interval: float = 0.5, batch_size: int = 100):
+        self.app = app
+        self.interval = interval
+        self.batch_size = batch_size
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(
+            target=self._run, name="task-states", daemon=True
+        )
+        self.thread.start()
+        atexit.register(self.flush)
+
+    def send(self, item: dict):
+        self.queue.put(item)
+
+    def _drain(self, first: dict = None) -> List[dict]:
+        batch = [] if first is None else [first]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch: List[dict]):
+        try:
+            with self.app.app_context():
+                apply_transitions(batch)
+        except Exception as exc:
+            logger.error(f"Can't write {len(batch)} task states: {exc}")
+        finally:
+            for _ in batch:
+                self.queue.task_done()
+
+    def _run(self):
+        while True:
+            first = self.queue.get()
+            # Let the transitions of the moment come together.
+            time.sleep(self.interval)
+            self._write(self._drain(first))
+
+    def flush(self):
+        """ Wait until the transitions sent are written. """
+        self.queue.join()
+
+
+class RedisChannel(object):
+    """ Push the transitions to a Redis list for the :class:`StateWriter`.
+    If Redis can't be reached, a transition is written at once. """
+
+    def __init__(self, app, url: str):
+        self.app = app
+        self.redis = redis.Redis.from_url(url)
+
+    def send(self, item: dict):
+        try:
+            self.redis.rpush(STATE_KEY, json.dumps(item))
+        except redis.RedisError as exc:
+            logger.warning(f"Can't send the state of task {item['uid']} "
+                           f"({exc}), write it at once.")
+            with self.app.app_context():
+                apply_transitions([item])
+
+    def flush(self):
+        pass
+
+
+# The channel of this process, see state_channel.
+_channel = {"pid": None, "channel": None}
+
+
+def state_channel(app):
+    """ The channel of this process for the ``TASK_STATE_CHANNEL`` of the
+    app. It is created again in a forked worker process. """
+    if _channel["pid"] != os.getpid():
+        setting = app.config["TASK_STATE_CHANNEL"]
+        if not setting:
+            channel = DirectChannel(app)
+        elif setting == "local":
+            channel = LocalChannel(
+                app, interval=app.config["TASK_STATE_INTERVAL"],
+                batch_size=app.config["TASK_STATE_BATCH_SIZE"],
+            )
+        else:
+            channel = RedisChannel(app, setting)
+        _channel.update(pid=os.getpid(), channel=channel)
+    return _channel["channel"]
+
+
+def send_state(app, uid: str, state: str, results: dict = None,
+               hostname: str = None):
+    """ Send the transition of the task to the state, with its results if
+    given, over the :func:`state_channel`. The last state of a task is
+    written before this returns. """
+    channel = state_channel(app)
+    channel.send(transition(uid, state, results, hostname=hostname))
+    if state in FINISHED_STATES:
+        channel.flush()
+
+
+def flush_states():
+    """ Wait until the transitions this process sent are written, e.g.
+    before it exits. """
+    if _channel["pid"] == os.getpid():
+        _channel["channel"].flush()
+
+
+def record_queued(uids: Iterable[str]):
+    """ Record the tasks as sent to the workers now, to be committed along
+    with the session. """
+    now = datetime.utcnow()
+    db.session.add_all([
+        db_model_TaskEvent(task_uid=uid, state="PENDING", timestamp=now)
+        for uid in uids
+    ])
+
+
+def task_timings(events: List[Tuple[str, float]]) -> dict:
+    """ The timings of the last run of a task from its events, pairs of a
+    state and a timestamp in order: when it was queued (``received``),
+    ``started``, ``succeeded`` or otherwise ``finished``, and the seconds it
+    waited in the queue and ran. A run starts with its ``PENDING`` event.
+
+    >>> task_timings([("PENDING", 10.0), ("STARTED", 12.0),
+    ...               ("FAILURE", 20.0), ("PENDING", 30.0),
+    ...               ("STARTED", 35.0), ("STARTED", 38.0),
+    ...               ("SUCCESS", 45.0)])
+    {'received': 30.0, 'started': 35.0, 'succeeded': 45.0, 'finished': 45.0, 'runtime': 10.0, 'queue_wait': 5.0}
+    >>> task_timings([("PENDING", 10.0), ("STARTED", 12.0)])
+    {'received': 10.0, 'started': 12.0, 'succeeded': None, 'finished': None, 'runtime': None, 'queue_wait': 2.0}
+    """
+    run = 0
+    for index, (state, _) in enumerate(events):
+        if state == "PENDING":
+            run = index
+    timings = dict.fromkeys((
+        "received", "started", "succeeded", "finished", "runtime",
+        "queue_wait",
+    ))
+    for state, timestamp in events[run:]:
+        if state == "PENDING" and timings["received"] is None:
+            timings["received"] = timestamp
+        elif state == "STARTED" and timings["started"] is None:
+            timings["started"] = timestamp
+        elif state in FINISHED_STATES and timings["finished"] is None:
+            timings["finished"] = timestamp
+            if state == "SUCCESS":
+                timings["succeeded"] = timestamp
+    if timings["started"] is not None:
+        if timings["finished"] is not None:
+            timings["runtime"] = round(
+                timings["finished"] - timings["started"], 3
+            )
+        if timings["received"] is not None:
+            timings["queue_wait"] = round(
+                max(0.0, timings["started"] - timings["received"]), 3
+            )
+    return timings
+
+
+def load_timings(uids: Iterable[str] = None) -> Dict[str, dict]:
+    """ The :func:`task_timings` of the tasks with the uids, or of all tasks,
+    from their events. Needs an app context. """
+    query = db_model_TaskEvent.query
+    if uids is not None:
+        uids = list(uids)
+        if not uids:
+            return {}
+        query = query.filter(db_model_TaskEvent.task_uid.in_(uids))
+    events = {}
+    for event in query.order_by(db_model_TaskEvent.timestamp,
+                                db_model_TaskEvent.id):
+        events.setdefault(event.task_uid, []).append((
+            event.state,
+            event.timestamp.replace(tzinfo=timezone.utc).timestamp(),
+        ))
+    return {
+        uid: task_timings(task_events)
+        for uid, task_events in events.items()
+    }
+
+
+class StateWriter(object):
+    """ Write the transitions pushed to Redis by the workers in batches of
+    up to ``batch_size``, waiting ``interval`` seconds for them to come
+    together. A batch that can't be written is pushed back. """
+
+    def __init__(self, app, url: str, interval: float = 0.5,
+                 batch_size: int = 100):
+        self.app = app
+        self.redis = redis.Redis.from_url(url)
+        self.interval = interval
+        self.batch_size = batch_size
+
+    def write_batch(self, timeout: int = 5) -> Optional[int]:
+        """ Wait up to ``timeout`` seconds for transitions and write them.
+        Returns the number of written transitions, ``None`` if there were
+        none. """
+        first = self.redis.blpop(STATE_KEY, timeout=timeout)
+        if first is None:
+            return None
+        time.sleep(self.interval)
+        pipeline = self.redis.pipeline()
+        pipeline.lrange(STATE_KEY, 0, self.batch_size - 2)
+        pipeline.ltrim(STATE_KEY, self.batch_size - 1, -1)
+        rest, _ = pipeline.execute()
+        raw = [first[1]] + rest
+        batch = [json.loads(item) for item in raw]
+        try:
+            with self.app.app_context():
+                apply_transitions(batch)
+        except Exception:
+            self.redis.lpush(STATE_KEY, *reversed(raw))
+            raise
+        return len(batch)
+
+    def run(self):
+        """ Write transitions until interrupted. """
+        logger.info("Write the states of the tasks.")
+        while True:
+            try:
+                written = self.write_batch()
+            except Exception as exc:
+                logger.error(f"Can't write task states: {exc}")
+                time.sleep(self.interval)
+                continue
+            if written:
+                logger.debug(f"Wrote {written} task states.")
+
+
+if __name__ == "__main__":
+    from ocrd_butler.app import flask_app
+    StateWriter(
+        flask_app, flask_app.config["TASK_STATE_CHANNEL"],
+        interval=flask_app.config["TASK_STATE_INTERVAL"],
+        batch_size=flask_app.config["TASK_STATE_BATCH_SIZE"],
+    ).run()
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+"""Stop running tasks cooperatively.
+
+The butler requests a stop by a file in the workspace of the task, which the
+worker running it checks between steps and while a processor runs, see
+:class:`~ocrd_butler.execution.output.Watchdog`.
+"""
+
+import os
+
+
+STOP_FILE = "butler-stop"
+
+
+class TaskStopped(Exception):
+    """ Raised if a task stops on request. """
+
+
+def stop_path(dst_dir: str) -> str:
+    """ Path of the stop request of the workspace in ``dst_dir``. """
+    return os.path.join(dst_dir, STOP_FILE)
+
+
+def request_stop(dst_dir: str):
+    """ Ask the worker running the task of the workspace to stop it. """
+    os.makedirs(dst_dir, exist_ok=True)
+    with open(stop_path(dst_dir), "w"):
+        pass
+
+
+def clear_stop(dst_dir: str):
+    """ Forget a stop request, before the task runs again. """
+    if os.path.exists(stop_path(dst_dir)):
+        os.remove(stop_path(dst_dir))
+
+
+def stop_requested(dst_dir: str) -> bool:
+    """ Check if the task of the workspace was asked to stop. """
+    return os.path.exists(stop_path(dst_dir))
+
+
+def should_stop(dst_dir: str) -> bool:
+    """ Check if the task working on the workspace should stop, because it
+    was asked to or its workspace has been deleted. """
+    return stop_requested(dst_dir) or not os.path.isdir(dst_dir)
@@ -3,7 +3,13 @@
 """Celery tasks definitions."""
 from __future__ import print_function
 
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
 import json
+import math
+import os
+import shutil
 from pathlib import (
     PurePosixPath
 )
@@ -13,28 +19,118 @@ from urllib.parse import (
 )
 import sys
 import subprocess
+import time
+import uuid
+from typing import (
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
 
+from celery import chain
+from celery.canvas import Signature
 from celery.signals import (
     task_failure,
     task_postrun,
     task_prerun,
     task_success,
+    worker_process_shutdown,
 )
 
 from flask import current_app
 
-from ocrd_models import OcrdFile
+from ocrd_models import (
+    OcrdFile,
+    OcrdMets,
+)
+from ocrd_utils import (
+    nth_url_segment,
+    remove_non_path_from_url,
+)
 from ocrd.resolver import Resolver
 from ocrd.workspace import Workspace
 
 from ocrd_butler import celery
-from ocrd_butler.database import db
 from ocrd_butler.database.models import Task as db_model_Task
+from ocrd_butler.execution.cache import (
+    ImageCache,
+    MetsCache,
+    StepCache,
+)
+from ocrd_butler.execution.checkpoints import (
+    CHECKPOINTS_FILE,
+    Checkpoints,
+    remove_outputs,
+)
+from ocrd_butler.execution.download import (
+    download_files,
+    is_remote,
+)
+from ocrd_butler.execution.estimate import image_megapixels
+from ocrd_butler.execution.memoize import run_step_cached
+from ocrd_butler.execution.mets import (
+    IndexedWorkspace,
+    MetsIndex,
+    mets_index,
+    processed,
+)
+from ocrd_butler.execution.pages import (
+    create_shard,
+    merge_shard,
+    remove_shard,
+    split_pages,
+)
+from ocrd_butler.execution.output import (
+    add_usage,
+    run_streaming,
+)
+from ocrd_butler.execution.pipeline import run_pipeline
+from ocrd_butler.execution.resources import (
+    ResourceLedger,
+    thread_limits,
+)
+from ocrd_butler.execution.scratch import (
+    create_scratch,
+    publish,
+    sweep_scratch,
+)
+from ocrd_butler.execution.states import (
+    flush_states,
+    send_state,
+)
+from ocrd_butler.execution.stop import (
+    TaskStopped,
+    should_stop,
+    stop_requested,
+)
+from ocrd_butler.execution.resident import (
+    resident_workers,
+    run_resident,
+)
+from ocrd_butler.execution.update import (
+    SOURCE_FILE,
+    carry_over,
+    changed_pages,
+    copy_agents,
+    load_source,
+    remove_unused,
+    reuse_images,
+    save_source,
+    sort_file_groups,
+    source_pages,
+)
 from ocrd_butler.util import (
     logger,
 )
 
 
+# Bytes of the output of a processor kept in the result of its step.
+OUTPUT_LIMIT = 1024 ** 2
+
+
 def get_task_backend_state(task_id: str) -> str:
     """ Get the current state of the task from the celery backend.
         Currently not used.
@@ -42,18 +138,16 @@ def get_task_backend_state(task_id: str) -> str:
     return celery.backend.get_status(task_id)
 
 
-def update_task(uid: str, state: str, results: dict = None):
+def update_task(uid: str, state: str, results: dict = None,
+                hostname: str = None):
     """ Update the given state of the task in our database.
-        Also set the results if given.
+        Also set the results if given. The state is sent over the channel
+        of ``TASK_STATE_CHANNEL`` to be written along with others, and
+        recorded with the hostname of the worker.
     """
     try:
         from ocrd_butler.app import flask_app
-        with flask_app.app_context():
-            task = db_model_Task.get(uid=uid)
-            task.status = state
-            if results is not None:
-                task.results = results
-            db.session.commit()
+        send_state(flask_app, uid, state, results, hostname=hostname)
     except Exception as exc:
         caller = sys._getframe().f_back.f_code.co_name
         logger.error(f"{caller} -> Can't set status for "
@@ -65,7 +159,7 @@ def task_prerun_handler(task_id, task, *args, **kwargs):
     logger.debug(f"task_prerun_handler -> task: {task_id}, task: {task}, "
                  f"args: {args}, kwargs: {kwargs}")
     uid = kwargs.get('args')[0].get('uid')
-    update_task(uid, 'STARTED')
+    update_task(uid, 'STARTED', hostname=task.request.hostname)
     logger.info(f"Start processing task {uid}.")
 
 
@@ -73,8 +167,14 @@ def task_prerun_handler(task_id, task, *args, **kwargs):
 def task_postrun_handler(task_id, task, retval, state, *args, **kwargs):
     logger.debug(f"task_postrun_handler -> task: {task_id}, task: {task}, "
                  f"args: {args}, kwargs: {kwargs}")
+    if task.name in CHAIN_STEP_TASKS and state == "SUCCESS":
+        # The task goes on with the next link of the chain.
+        return
+    if state == "FAILURE":
+        # Set by task_failure_handler.
+        return
     uid = kwargs.get('args')[-1].get('uid')
-    update_task(uid, state)
+    update_task(uid, state, hostname=task.request.hostname)
     logger.info(f"Finished processing task {uid}.")
 
 
@@ -82,8 +182,11 @@ def task_postrun_handler(task_id, task, retval, state, *args, **kwargs):
 def task_success_handler(result, *args, **kwargs):
     logger.debug(f"task_success_handler -> result: {result}, "
                  f"args: {args}, kwargs: {kwargs}")
+    if kwargs["sender"].name in CHAIN_STEP_TASKS:
+        return
     uid = result.get('uid')
-    update_task(uid, 'SUCCESS', result)
+    update_task(uid, 'SUCCESS', result,
+                hostname=kwargs["sender"].request.hostname)
     logger.info(f"Success on task {uid} with a result of {result}.")
 
 
@@ -95,20 +198,33 @@ def task_failure_handler(task_id, exception, traceback, einfo, *args, **kwargs):
         f"kwargs: {kwargs}"
     )
     uid = kwargs.get('args')[0].get('uid')
-    update_task(uid, 'FAILURE')
+    update_task(uid, 'REVOKED' if isinstance(exception, TaskStopped) else 'FAILURE',
+                hostname=kwargs["sender"].request.hostname)
     logger.error(f"Task {task_id} failed, "
                  f"exception: {exception}, traceback: {traceback}.")
 
 
-def add_max_file_to_workspace(workspace: Workspace, file_name: OcrdFile) -> OcrdFile:
+@worker_process_shutdown.connect
+def worker_process_shutdown_handler(*args, **kwargs):
+    # The process exits without atexit, write the states sent before.
+    try:
+        flush_states()
+    except Exception as exc:
+        logger.error(f"Can't write the task states on shutdown: {exc}")
+
+
+def add_max_file_to_workspace(
+    workspace: Workspace, file_name: OcrdFile, page_id: str = None
+) -> OcrdFile:
     """ Use a remote TIFF representation instead of JPG of a given workspace file,
-    and add the corresponding file entry to the workspace.
+    and add the corresponding file entry to the workspace. The page of the
+    file is looked up in the METS unless given as ``page_id``.
     """
     iiif_max_url = file_name.url.replace('.jpg', '.tif')
     file_id = file_name.ID.replace("DEFAULT", "MAX")
     return workspace.add_file(
         file_grp="MAX",
-        pageId=file_name.pageId,
+        pageId=page_id or file_name.pageId,
         url=iiif_max_url,
         ID=file_id,
         mimetype="image/tiff",
@@ -116,36 +232,125 @@ def add_max_file_to_workspace(workspace: Workspace, file_name: OcrdFile) -> Ocrd
     )
 
 
-def prepare_workspace(task: dict, resolver: Resolver, dst_dir: str) -> Workspace:
-    """Prepare a workspace and return it."""
+def mets_cache() -> Optional[MetsCache]:
+    """ The cache of METS files, if ``METS_CACHE_DIR`` is configured. """
+    config = current_app.config
+    if not config.get("METS_CACHE_DIR"):
+        return None
+    return MetsCache(
+        config["METS_CACHE_DIR"],
+        max_size=config["METS_CACHE_MAX_SIZE"],
+        max_age=config["METS_CACHE_MAX_AGE"],
+    )
+
+
+def mets_baseurl(mets_url: str) -> str:
+    """ The URL relative file locations in the METS file are resolved
+    against, like ``Resolver.workspace_from_url`` determines it.
+
+    >>> mets_baseurl('https://content.staatsbibliothek-berlin.de/dc/PPN1.mets.xml')
+    'https://content.staatsbibliothek-berlin.de/dc'
+    """
+    last_segment = nth_url_segment(mets_url)
+    return remove_non_path_from_url(
+        remove_non_path_from_url(mets_url)[:-len(last_segment)]
+    )
+
+
+def prepare_workspace(
+    task: dict, resolver: Resolver, dst_dir: str, reuse: Dict[str, dict] = None
+) -> Workspace:
+    """Prepare a workspace and return it.
+
+    If ``METS_CACHE_DIR`` is configured, the METS file is taken from a
+    :class:`~ocrd_butler.execution.cache.MetsCache` unless it changed.
+
+    The images of the ``default_file_grp`` are downloaded concurrently, see
+    :func:`~ocrd_butler.execution.download.download_files`. If
+    ``IMAGE_CACHE_DIR`` is configured they are shared with other tasks via
+    an :class:`~ocrd_butler.execution.cache.ImageCache`. The images of a
+    former workspace in ``dst_dir`` are used again if they come from the same
+    source, given as ``reuse`` by page, see
+    :func:`~ocrd_butler.execution.update.reuse_images`. The source of the
+    images is recorded in the workspace for that.
+    """
     mets_basename = "mets.xml"
+    config = current_app.config
+
+    mets_url, src_baseurl = task["src"], None
+    mets = mets_cache()
+    if mets is not None and is_remote(task["src"]):
+        mets_url = mets.fetch(
+            task["src"], timeout=config["DOWNLOAD_TIMEOUT"]
+        )["path"]
+        src_baseurl = mets_baseurl(task["src"])
 
     workspace = resolver.workspace_from_url(
-        task["src"],
+        mets_url,
         dst_dir=dst_dir,
         mets_basename=mets_basename,
-        clobber_mets=True
+        clobber_mets=True,
+        src_baseurl=src_baseurl,
+    )
+    workspace = IndexedWorkspace(
+        resolver, workspace.directory, mets=workspace.mets,
+        mets_basename=mets_basename, baseurl=workspace.baseurl,
     )
+    source = source_pages(workspace.index, task["default_file_grp"])
 
     if task[
         "default_file_grp"
-    ] == "MAX" and "MAX" not in workspace.mets.file_groups:
-        for file_name in workspace.mets.find_files(
-                fileGrp="DEFAULT"
-        ):
-            workspace.download_file(
-                add_max_file_to_workspace(
-                    workspace, file_name
-                )
-            )
+    ] == "MAX" and "MAX" not in workspace.index.file_groups:
+        page_ids = {
+            mets_file["ID"]: mets_file["pageId"]
+            for mets_file in workspace.index.files("DEFAULT")
+        }
+        pages = []
+        files = []
+        for file_name in workspace.mets.find_files(fileGrp="DEFAULT"):
+            pages.append(page_ids.get(file_name.ID))
+            files.append(add_max_file_to_workspace(
+                workspace, file_name, page_id=pages[-1]
+            ))
     else:
-        for file_name in workspace.mets.find_files(
-                fileGrp=task["default_file_grp"]
-        ):
-            if not file_name.local_filename:
-                workspace.download_file(file_name)
+        page_ids = {
+            mets_file["ID"]: mets_file["pageId"]
+            for mets_file in workspace.index.files(task["default_file_grp"])
+        }
+        files = list(workspace.mets.find_files(
+            fileGrp=task["default_file_grp"]
+        ))
+        pages = [page_ids.get(ocrd_file.ID) for ocrd_file in files]
+
+    if reuse:
+        reuse_images(workspace, files, pages, source, reuse)
+
+    cache = None
+    if config.get("IMAGE_CACHE_DIR"):
+        cache = ImageCache(
+            config["IMAGE_CACHE_DIR"],
+            max_size=config["IMAGE_CACHE_MAX_SIZE"],
+            max_age=config["IMAGE_CACHE_MAX_AGE"],
+        )
+
+    download_files(
+        workspace,
+        files,
+        workers=config["DOWNLOAD_WORKERS"],
+        host_limits=config["DOWNLOAD_HOST_CONCURRENCY"],
+        default_host_limit=config["DOWNLOAD_DEFAULT_HOST_CONCURRENCY"],
+        retries=config["DOWNLOAD_RETRIES"],
+        timeout=config["DOWNLOAD_TIMEOUT"],
+        cache=cache,
+    )
 
     workspace.save_mets()
+    save_source(workspace.directory, source)
+
+    if cache is not None:
+        cache.evict()
+    if mets is not None:
+        mets.evict()
 
     return workspace
 
@@ -182,16 +387,61 @@ def determine_input_file_grp(
     )
 
 
+def processor_setting(processor: dict, key: str, default=None):
+    """ look up a setting of the processor in its workflow definition, falling
+    back to its ``PROCESSOR_SETTINGS`` entry in the current configuration and
+    ``default``, respectively.
+    """
+    if key in processor:
+        return processor[key]
+    return current_app.config["PROCESSOR_SETTINGS"].get(
+        processor["name"], {}
+    ).get(key, default)
+
+
+@contextmanager
+def _no_reservation() -> Iterator[None]:
+    """ Reserve nothing, for processors run without a ledger. """
+    yield None
+
+
 def _run_processor(
     executable: str, mets_url: str, resolver: Resolver, workspace: Workspace,
     log_level: str, input_file_grp: str, output_file_grp: str, parameter: dict,
+    page_id: str = None, output_limit: int = OUTPUT_LIMIT,
+    on_line: Callable[[str], None] = None, resident: str = None,
+    timeout_per_page: float = None, timeout_base: float = 0,
+    ledger: ResourceLedger = None, cores: float = None, memory: int = None,
+    threads: int = None, stop_dir: str = None,
 ) -> subprocess.CompletedProcess:
     """ run an OCRD processor executable with the specified configuration, wait for the
     execution to complete, and return a :class:`subprocess.CompletedProcess` object.
 
     Basically the only difference from ``ocrd.processor.helper.run_cli`` is that
     ``/dev/stderr`` is being redirected to ``/dev/stdout``, and ``/dev/stdout`` output
-    of the spawned subprocess is being captured and copied to the current logger.
+    of the spawned subprocess is being copied to the current logger line by line
+    while it runs. Every line is passed to ``on_line`` as well, if given. Only
+    the last ``output_limit`` bytes of the output are kept in the result.
+
+    If the processor class is given as ``resident`` (``module:Class``), the
+    processor is run by a :class:`~ocrd_butler.execution.resident.ResidentWorker`
+    keeping it loaded, unless that one is busy or fails to start.
+
+    The processor is killed along with its children if the task is asked to
+    stop (see :func:`~ocrd_butler.execution.stop.should_stop`, by the results
+    directory ``stop_dir``, the workspace by default), or if it runs
+    longer than ``timeout_base`` plus ``timeout_per_page`` seconds for every
+    page it processes. The reason is set as ``stopped`` of the result.
+
+    With a ``ledger``, the processor waits until the host has the ``cores``
+    and ``memory`` it needs, see
+    :meth:`~ocrd_butler.execution.resources.ResourceLedger.reserve`, and
+    the ledger learns from the resources it used.
+
+    The processor is limited to ``threads`` threads by the environment
+    variables of :func:`~ocrd_butler.execution.resources.thread_limits`,
+    by default to the cores reserved. It is bound to the CPUs the ledger
+    assigned, if any.
 
     """
     args = [
@@ -202,44 +452,203 @@ def _run_processor(
     ]
     if parameter:
         args += ['--parameter', parameter]
+    if page_id:
+        args += ['--page-id', page_id]
     logger.info(f'Start processor subprocess: `{" ".join(args)}`')
-    result = subprocess.run(
-        args, check=False, stdout=subprocess.PIPE, stderr=subprocess.STDOUT
-    )
-    logger.info(f'Processor subprocess completed: `{" ".join(result.args)}')
-    for processor_stdout_line in result.stdout.decode().split('\n'):
+
+    def _on_line(processor_stdout_line: str):
         logger.info(processor_stdout_line)
+        if on_line is not None:
+            on_line(processor_stdout_line)
+
+    timeout = None
+    if timeout_per_page is not None:
+        pages = len(page_id.split(",")) if page_id \
+            else len(mets_index(workspace).pages)
+        timeout = timeout_base + timeout_per_page * pages
+    stop_check = partial(should_stop, stop_dir or workspace.directory)
+
+    reservation = _no_reservation()
+    if ledger is not None:
+        reservation = ledger.reserve(executable, cores, memory, stop_check)
+    with reservation as reserved:
+        # The cores the processor can use at most, to learn from its run.
+        cpus = cap = None
+        if reserved is not None:
+            cpus = reserved.get("cpus")
+            if cpus:
+                cap = len(cpus)
+            if threads is None:
+                threads = cap or max(1, math.ceil(reserved["cores"]))
+                cap = threads
+        limits = thread_limits(threads) if threads else None
+        if limits:
+            logger.info(f'Limit processor subprocess to {threads} threads'
+                        + (f' on CPUs {cpus}' if cpus else '')
+                        + f': {json.dumps(limits)}')
+        result = None
+        if resident:
+            job = dict(
+                mets_url=mets_url, working_dir=workspace.directory,
+                log_level=log_level, input_file_grp=input_file_grp,
+                output_file_grp=output_file_grp, page_id=page_id,
+            )
+            result = run_resident(
+                resident, json.loads(parameter or "{}"), args, job, _on_line,
+                output_limit, stop_check, timeout, limits, cpus
+            )
+        if result is None:
+            result = run_streaming(
+                args, _on_line, output_limit, stop_check, timeout,
+                env=dict(os.environ, **limits) if limits else None,
+                cpus=cpus,
+            )
+    if ledger is not None and not result.stopped:
+        ledger.learn(executable, result.usage, cap=cap)
+    if result.stopped:
+        logger.info(f'Processor subprocess killed: {result.stopped}')
+    logger.info(f'Processor subprocess completed: `{" ".join(result.args)}')
     logger.info(f'Processor subprocess returned with exit code {result.returncode}')
+    logger.info(f'Processor subprocess used {json.dumps(result.usage)}')
     return result
 
 
-@celery.task(bind=True)
-def run_task(self, task: dict) -> dict:
-    """ Create a task an run the given workflow. """
-    logger_path = current_app.config["LOGGER_PATH"]
-    log_file = f"{logger_path}/task-{task['uid']}.log"
-    task_log_handler = logger.add(log_file, format='{message}')
-
-    logger.info(f'Start processing task {task["uid"]}.')
+def _run_processor_parallel(
+    executable: str, mets_url: str, resolver: Resolver, workspace: Workspace,
+    log_level: str, input_file_grp: str, output_file_grp: str, parameter: dict,
+    parallel: int, page_id: str = None, output_limit: int = OUTPUT_LIMIT,
+    on_line: Callable[[str], None] = None, resident: str = None,
+    timeout_per_page: float = None, timeout_base: float = 0,
+    ledger: ResourceLedger = None, cores: float = None, memory: int = None,
+    threads: int = None, stop_dir: str = None,
+) -> subprocess.CompletedProcess:
+    """ run an OCRD processor executable like :func:`_run_processor`, but
+    split the pages of the workspace (or the ones given as ``page_id``)
+    into up to ``parallel`` ranges, each
+    processed by its own subprocess with ``--page-id`` on a copy of the METS
+    file. The files the subprocesses added are merged back into the METS of
+    the workspace in page order, so the result does not differ from a serial
+    run.
 
-    # Create workspace
-    from ocrd_butler.app import flask_app
-    with flask_app.app_context():
-        dst_dir = "{}/{}".format(
-            current_app.config["OCRD_BUTLER_RESULTS"], task["uid"]
+    If any subprocess fails, the METS of the workspace is left untouched and
+    the result of the first failed subprocess is returned.
+    """
+    pages = page_id.split(",") if page_id else mets_index(workspace).pages
+    page_ranges = split_pages(pages, parallel)
+    if len(page_ranges) < 2:
+        return _run_processor(
+            executable, mets_url=mets_url, resolver=resolver,
+            workspace=workspace, log_level=log_level,
+            input_file_grp=input_file_grp, output_file_grp=output_file_grp,
+            parameter=parameter, page_id=page_id, output_limit=output_limit,
+            on_line=on_line, resident=resident,
+            timeout_per_page=timeout_per_page, timeout_base=timeout_base,
+            ledger=ledger, cores=cores, memory=memory, threads=threads,
+            stop_dir=stop_dir,
         )
-        resolver = Resolver()
-        workspace = prepare_workspace(task, resolver, dst_dir)
-        logger.info(f"Prepare workspace for task '{task['uid']}'.")
+    logger.info(f'Run {executable} on {len(page_ranges)} page ranges in parallel.')
 
-    task_processors = task["workflow"]["processors"]
-    mets_url = "{}/mets.xml".format(dst_dir)
+    # Avoid races of the subprocesses creating the output directory.
+    os.makedirs(os.path.join(workspace.directory, output_file_grp), exist_ok=True)
+    shards = [
+        create_shard(workspace, f"{output_file_grp}-{index:03}")
+        for index in range(len(page_ranges))
+    ]
+
+    started = time.monotonic()
+    try:
+        with ThreadPoolExecutor(max_workers=len(shards)) as executor:
+            results = list(executor.map(
+                lambda shard: _run_processor(
+                    executable,
+                    mets_url=shard[0],
+                    resolver=resolver,
+                    workspace=workspace,
+                    log_level=log_level,
+                    input_file_grp=input_file_grp,
+                    output_file_grp=output_file_grp,
+                    parameter=parameter,
+                    page_id=",".join(shard[1]),
+                    output_limit=output_limit // len(shards),
+                    on_line=on_line,
+                    resident=resident,
+                    timeout_per_page=timeout_per_page,
+                    timeout_base=timeout_base,
+                    ledger=ledger,
+                    cores=cores,
+                    memory=memory,
+                    threads=threads,
+                    stop_dir=stop_dir,
+                ),
+                zip(shards, page_ranges)
+            ))
+
+        for result in results:
+            if result.returncode != 0:
+                return result
+
+        for index, shard in enumerate(shards):
+            merge_shard(workspace, shard, agents=index == 0)
+        workspace.save_mets()
+    finally:
+        for shard in shards:
+            remove_shard(shard)
+
+    result = subprocess.CompletedProcess(
+        args=results[0].args,
+        returncode=0,
+        stdout=b"\n".join(result.stdout for result in results),
+    )
+    result.usage = add_usage(
+        [result.usage for result in results],
+        wall=round(time.monotonic() - started, 3)
+    )
+    result.stopped = None
+    return result
+
+
+def resource_ledger() -> Optional[ResourceLedger]:
+    """ The ledger of the resources of the host, if ``HOST_RESOURCES_DIR``
+    is configured. """
+    config = current_app.config
+    if not config["HOST_RESOURCES_DIR"]:
+        return None
+    return ResourceLedger(
+        config["HOST_RESOURCES_DIR"],
+        cores=config["HOST_CORES"],
+        memory=config["HOST_MEMORY"],
+        default_cores=config["PROCESSOR_DEFAULT_CORES"],
+        default_memory=config["PROCESSOR_DEFAULT_MEMORY"],
+        pin_cpus=config["PIN_CPUS"],
+    )
 
-    # TODO: Steps could be saved along the other task information to get a
-    # more informational task.
+
+def processor_threads(processor: dict, ledger: ResourceLedger = None) -> Optional[int]:
+    """ The threads a subprocess of the processor may start, its ``threads``
+    setting or else the cores of the host shared by the
+    ``PROCESSOR_CONCURRENCY`` processors running at once and the subprocesses
+    of a ``parallel`` step. With a ``ledger``, it defaults to the cores
+    reserved, see :func:`_run_processor`. ``None`` for no limit.
+    """
+    threads = processor_setting(processor, "threads")
+    concurrency = current_app.config["PROCESSOR_CONCURRENCY"]
+    if threads is None and ledger is None and concurrency:
+        parallel = processor_setting(processor, "parallel", 1)
+        threads = max(1, os.cpu_count() // (concurrency * parallel))
+    return threads
+
+
+def workflow_steps(
+    task: dict, mets_url: str, resolver: Resolver, workspace: Workspace
+) -> list:
+    """ Get the steps of the workflow of the task, i.e. its processors along
+    with the keyword arguments for :func:`_run_processor`.
+    """
+    steps = []
     previous_processor = None
+    ledger = resource_ledger()
 
-    for processor in task_processors:
+    for processor in task["workflow"]["processors"]:
         input_file_grp = determine_input_file_grp(
             task, processor, previous_processor
         )
@@ -253,34 +662,490 @@ def run_task(self, task: dict) -> dict:
             kwargs["parameter"].update(task["parameters"][processor["name"]])
         parameter = json.dumps(kwargs["parameter"])
 
-        logger.info(f'Start processor {processor["name"]}. {json.dumps(processor)}.')
+        steps.append({
+            "processor": processor,
+            "run_kwargs": dict(
+                mets_url=mets_url,
+                resolver=resolver,
+                workspace=workspace,
+                log_level="DEBUG",
+                input_file_grp=input_file_grp,
+                output_file_grp=processor["output_file_grp"],
+                parameter=parameter,
+                output_limit=current_app.config["PROCESSOR_OUTPUT_LIMIT"],
+                resident=processor_setting(processor, "resident"),
+                timeout_per_page=processor_setting(processor, "timeout_per_page"),
+                timeout_base=current_app.config["PROCESSOR_TIMEOUT_BASE"],
+                ledger=ledger,
+                cores=processor_setting(processor, "cores"),
+                memory=processor_setting(processor, "memory"),
+                threads=processor_threads(processor, ledger),
+                stop_dir=task_dir(task),
+            ),
+        })
 
-        logger.info(f'Run processor {processor["name"]} on METS file {mets_url}.')
-        result = _run_processor(
-            processor["executable"],
-            mets_url=mets_url,
-            resolver=resolver,
-            workspace=workspace,
-            log_level="DEBUG",
-            input_file_grp=input_file_grp,
-            output_file_grp=processor["output_file_grp"],
-            parameter=parameter,
+    return steps
+
+
+def _step_failed(task: dict, processor: dict, result: subprocess.CompletedProcess):
+    logger.info(f'Finished processing task {task["uid"]}.')
+    stopped = getattr(result, "stopped", None)
+    if stopped == "stopped":
+        raise TaskStopped(f"Task {task['uid']} stopped in processor "
+                          f"{processor['name']}.")
+    if stopped == "timeout":
+        raise Exception(f"Processor {processor['name']} timed out.")
+    raise Exception(
+        f"Processor {processor['name']} failed with exit code {result.returncode}."
+    )
+
+
+def _check_stop(task: dict, dst_dir: str, workspace: bool = True):
+    """ Raise :class:`~ocrd_butler.execution.stop.TaskStopped` if the task
+    should stop. Before the ``workspace`` is prepared, only a stop request
+    counts, or the task being deleted along with its results directory. """
+    if stop_requested(dst_dir) or (
+        should_stop(dst_dir) if workspace else _task_deleted(task)
+    ):
+        logger.info(f'Stopped task {task["uid"]}.')
+        raise TaskStopped(f"Task {task['uid']} stopped.")
+
+
+def _task_deleted(task: dict) -> bool:
+    """ Check if the task is gone from the database. """
+    return db_model_Task.query.filter_by(uid=task["uid"]).count() == 0
+
+
+def _run_steps(
+    task: dict, steps: list, workspace: Workspace, checkpoints: Checkpoints,
+    start: int = 0, stop: int = None, page_id: str = None
+):
+    """ Run the steps of the workflow one after the other, beginning with the
+    one at index ``start`` and up to the one before ``stop``. If ``STEP_CACHE_DIR`` is configured, the output
+    of pages processed the same way before is taken from there, see
+    :func:`~ocrd_butler.execution.memoize.run_step_cached`. With ``page_id``
+    only the given pages (comma separated) are processed, without the step
+    cache. """
+    step_cache = None
+    if current_app.config["STEP_CACHE_DIR"] and not page_id:
+        step_cache = StepCache(
+            current_app.config["STEP_CACHE_DIR"],
+            max_size=current_app.config["STEP_CACHE_MAX_SIZE"],
         )
 
-        if result.returncode != 0:
-            logger.info(f'Finished processing task {task["uid"]}.')
-            raise Exception(
-                f"Processor {processor['name']} failed with exit code {result.returncode}."
+    for index, step in enumerate(steps[start:stop], start):
+        _check_stop(task, task_dir(task))
+        processor = step["processor"]
+        run_kwargs = step["run_kwargs"]
+        logger.info(f'Start processor {processor["name"]}. {json.dumps(processor)}.')
+
+        logger.info(f'Run processor {processor["name"]} on METS file '
+                    f'{run_kwargs["mets_url"]}.')
+        parallel = processor_setting(processor, "parallel", 1)
+
+        def run(page_id: str = page_id):
+            if parallel > 1:
+                return _run_processor_parallel(
+                    processor["executable"], parallel=parallel,
+                    page_id=page_id, **run_kwargs
+                )
+            return _run_processor(
+                processor["executable"], page_id=page_id, **run_kwargs
             )
 
-        workspace.reload_mets()
+        if step_cache is not None:
+            result = run_step_cached(workspace, step, step_cache, run)
+        else:
+            result = run()
+
+        if result.returncode != 0:
+            checkpoints.failed(index, step, result.usage)
+            _step_failed(task, processor, result)
+
+        processed(workspace, processor["output_file_grp"])
+        checkpoints.completed(index, step, workspace, result.usage,
+                              cache=getattr(result, "cache", None))
         logger.info(f'Finished processor {processor["name"]} for task {task["uid"]}.')
 
-    logger.info(f'Finished processing task {task["uid"]}.')
-    logger.remove(task_log_handler)
 
+def _run_steps_pipelined(
+    task: dict, steps: list, workspace: Workspace, checkpoints: Checkpoints,
+    batch_size: int, queue_size: int, start: int = 0
+):
+    """ Run the steps of the workflow over batches of pages, beginning with
+    the one at index ``start``, see
+    :func:`~ocrd_butler.execution.pipeline.run_pipeline`. The ``parallel``
+    setting of a processor gives the number of batches its step processes at
+    once.
+    """
+    steps = steps[start:]
+    usages = [[] for _ in steps]
+
+    # The steps go through the pipeline with their index, equal steps of a
+    # workflow are booked apart.
+    def run_step(indexed_step: tuple, mets_url: str, page_id: str):
+        index, step = indexed_step
+        run_kwargs = dict(step["run_kwargs"], mets_url=mets_url)
+        result = _run_processor(
+            step["processor"]["executable"], page_id=page_id, **run_kwargs
+        )
+        usages[index].append(result.usage)
+        return result
+
+    failure = run_pipeline(
+        workspace,
+        list(enumerate(steps)),
+        run_step,
+        output_file_grps=[step["processor"]["output_file_grp"] for step in steps],
+        batch_size=batch_size,
+        queue_size=queue_size,
+        workers=[
+            processor_setting(step["processor"], "parallel", 1)
+            for step in steps
+        ],
+    )
+    if failure is not None:
+        step = steps[failure.index]
+        checkpoints.failed(start + failure.index, step,
+                           add_usage(usages[failure.index]))
+        _step_failed(task, step["processor"], failure.result)
+
+    processed(workspace, ",".join(
+        step["processor"]["output_file_grp"] for step in steps
+    ))
+    # The wall time of a step is the time it was busy with its batches.
+    for index, step in enumerate(steps):
+        checkpoints.completed(
+            start + index, step, workspace, add_usage(usages[index])
+        )
+    names = ", ".join(step["processor"]["name"] for step in steps)
+    logger.info(f'Finished processors {names} for task {task["uid"]}.')
+
+
+def resume_workspace(
+    resolver: Resolver, dst_dir: str, checkpoints: Checkpoints
+) -> Optional[Workspace]:
+    """ Get the workspace a former run of the task prepared, if its
+    checkpoints say it can be used again. """
+    checkpoints.load()
+    if not os.path.exists(os.path.join(dst_dir, "mets.xml")):
+        return None
+    workspace = IndexedWorkspace(resolver, dst_dir)
+    if not checkpoints.is_prepared(workspace):
+        return None
+    return workspace
+
+
+@contextmanager
+def task_log(task: dict) -> Iterator[None]:
+    """ Log to the log file of the task. """
+    logger_path = current_app.config["LOGGER_PATH"]
+    log_file = f"{logger_path}/task-{task['uid']}.log"
+    task_log_handler = logger.add(log_file, format='{message}')
+    try:
+        yield
+    finally:
+        logger.remove(task_log_handler)
+
+
+def task_dir(task: dict) -> str:
+    """ The directory of the workspace of the task. """
+    return "{}/{}".format(
+        current_app.config["OCRD_BUTLER_RESULTS"], task["uid"]
+    )
+
+
+def _prepare(
+    task: dict, resume: bool = False, directory: str = None
+) -> Tuple[Workspace, Checkpoints, list, int]:
+    """ Prepare the workspace of the task in ``directory``, its
+    :func:`task_dir` by default, or take over the one of a former run with
+    ``resume``. Returns the workspace, its checkpoints, the steps of the
+    workflow and the index of the first one to run. """
+    # Create workspace
+    from ocrd_butler.app import flask_app
+    with flask_app.app_context():
+        dst_dir = directory or task_dir(task)
+        resolver = Resolver()
+        checkpoints = Checkpoints(dst_dir)
+        workspace = None
+        if resume:
+            workspace = resume_workspace(resolver, dst_dir, checkpoints)
+        if workspace is None:
+            workspace = prepare_workspace(task, resolver, dst_dir)
+            checkpoints.prepared(workspace, image_megapixels(
+                workspace, task["default_file_grp"]
+            ))
+            logger.info(f"Prepare workspace for task '{task['uid']}'.")
+        else:
+            logger.info(f"Reuse workspace for task '{task['uid']}'.")
+
+    mets_url = "{}/mets.xml".format(dst_dir)
+    steps = workflow_steps(task, mets_url, resolver, workspace)
+
+    start = 0
+    if resume:
+        start = checkpoints.resume_index(steps, workspace)
+        logger.info(f"Resume task '{task['uid']}' at step {start + 1} "
+                    f"of {len(steps)}.")
+        if remove_outputs(workspace, steps[start:]):
+            workspace.save_mets()
+
+    return workspace, checkpoints, steps, start
+
+
+def _task_result(task: dict, checkpoints: Checkpoints) -> dict:
     return {
         "id": task["id"],
         "uid": task["uid"],
-        "result_dir": dst_dir
+        "result_dir": task_dir(task),
+        "prepared": checkpoints.data.get("prepared"),
+        "steps": checkpoints.steps,
+    }
+
+
+def published_file_grps(task: dict, steps: list,
+                        extra: List[str] = ()) -> List[str]:
+    """ The file groups of a task run on scratch space that are published:
+    its images, the output of its last step and the ``extra`` ones.
+
+    >>> published_file_grps(
+    ...     {"default_file_grp": "MAX"},
+    ...     [{"processor": {"output_file_grp": "OCR-D-SEG,OCR-D-IMG"}}],
+    ...     ["OCR-D-IMG", "OCR-D-BIN"]
+    ... )
+    ['MAX', 'OCR-D-SEG', 'OCR-D-IMG', 'OCR-D-BIN']
+    """
+    file_grps = [task["default_file_grp"] or "MAX"]
+    if steps:
+        file_grps += steps[-1]["processor"]["output_file_grp"].split(",")
+    for file_grp in extra:
+        if file_grp not in file_grps:
+            file_grps.append(file_grp)
+    return file_grps
+
+
+def _update(task: dict) -> Tuple[Checkpoints, Dict[str, List[str]]]:
+    """ Update the workspace of the completed former run of the task to the
+    current METS file of its ``src`` and run the workflow on the new and
+    changed pages only, see :mod:`~ocrd_butler.execution.update`. The output
+    of the other pages is kept, the files of removed pages are removed.
+
+    The former METS is restored if the workspace can't be updated. If a step
+    fails, the task can be run again with ``resume``.
+
+    Returns the checkpoints and the pages by change, see
+    :func:`~ocrd_butler.execution.update.changed_pages`.
+    """
+    dst_dir = task_dir(task)
+    mets_url = os.path.join(dst_dir, "mets.xml")
+    resolver = Resolver()
+    checkpoints = Checkpoints(dst_dir).load()
+    if not os.path.exists(mets_url) or not checkpoints.is_completed(
+        workflow_steps(task, mets_url, resolver, None)
+    ):
+        raise Exception(f"Task {task['uid']} has no completed run to update.")
+
+    former_mets = OcrdMets(filename=mets_url)
+    former = MetsIndex.from_mets(former_mets)
+    former_source = load_source(dst_dir)
+    if former_source is None:
+        logger.warning(f"The sources of the pages of task '{task['uid']}' "
+                       "are unknown, all pages are processed again.")
+        former_source = {}
+    images = {
+        mets_file["pageId"]: mets_file["url"]
+        for mets_file in former.files(task["default_file_grp"])
     }
+
+    backup = f"{mets_url}.former"
+    shutil.copyfile(mets_url, backup)
+    try:
+        workspace = prepare_workspace(task, resolver, dst_dir, reuse={
+            page: dict(source, local=images.get(page))
+            for page, source in former_source.items()
+        })
+        changes = changed_pages(former_source, load_source(dst_dir))
+        update = set(changes["new"] + changes["changed"])
+        pages = [page for page in workspace.index.pages if page in update]
+        carry_over(workspace, former, [
+            page for page in workspace.index.pages if page not in update
+        ])
+        copy_agents(workspace, former_mets)
+        workspace.save_mets()
+    except BaseException:
+        os.replace(backup, mets_url)
+        if former_source:
+            save_source(dst_dir, former_source)
+        raise
+    os.remove(backup)
+    remove_unused(workspace, former)
+    checkpoints.updated(workspace, image_megapixels(
+        workspace, task["default_file_grp"]
+    ))
+    logger.info(f"Update task '{task['uid']}' with {len(changes['new'])} "
+                f"new, {len(changes['changed'])} changed and "
+                f"{len(changes['removed'])} removed pages.")
+
+    if pages:
+        steps = workflow_steps(task, mets_url, resolver, workspace)
+        _run_steps(task, steps, workspace, checkpoints,
+                   page_id=",".join(pages))
+        sort_file_groups(workspace, [
+            file_grp for step in steps
+            for file_grp in step["processor"]["output_file_grp"].split(",")
+        ])
+        workspace.save_mets()
+
+    return checkpoints, changes
+
+
+@celery.task(bind=True)
+def run_task(self, task: dict, resume: bool = False,
+             update: bool = False) -> dict:
+    """ Create a task an run the given workflow.
+
+    With ``resume`` the workspace and the output of the steps of a former
+    run are used again as far as its checkpoints allow, see
+    :class:`~ocrd_butler.execution.checkpoints.Checkpoints`.
+
+    If ``SCRATCH_DIR`` is configured, the workspace is created there and
+    only the :func:`published_file_grps`, with the
+    ``SCRATCH_PUBLISH_FILE_GRPS``, are published to the
+    :func:`task_dir` when the task succeeded, see
+    :func:`~ocrd_butler.execution.scratch.publish`. The scratch space is
+    removed in any case, so a task resumes from the start then.
+
+    With ``update`` only the pages of the METS file which are new or changed
+    since the former run are processed, in the :func:`task_dir`, see
+    :func:`_update`.
+    """
+    config = current_app.config
+    with task_log(task):
+        logger.info(f'Start processing task {task["uid"]}.')
+        _check_stop(task, task_dir(task), workspace=False)
+        resident_workers.max_workers = config["RESIDENT_WORKERS_MAX"]
+        if update:
+            checkpoints, changes = _update(task)
+            logger.info(f'Finished processing task {task["uid"]}.')
+            return dict(_task_result(task, checkpoints), update=changes)
+
+        scratch = None
+        if config["SCRATCH_DIR"]:
+            sweep_scratch(config["SCRATCH_DIR"])
+            scratch = create_scratch(config["SCRATCH_DIR"], task["uid"])
+            # Holds a stop request while the task runs.
+            os.makedirs(task_dir(task), exist_ok=True)
+            logger.info(f"Run task '{task['uid']}' in {scratch}.")
+        try:
+            workspace, checkpoints, steps, start = _prepare(
+                task, resume, directory=scratch
+            )
+
+            batch_size = config["PIPELINE_BATCH_SIZE"]
+            if batch_size and len(steps) - start > 1:
+                _run_steps_pipelined(
+                    task, steps, workspace, checkpoints, batch_size,
+                    config["PIPELINE_QUEUE_SIZE"], start=start
+                )
+            else:
+                _run_steps(task, steps, workspace, checkpoints, start=start)
+
+            if scratch is not None:
+                publish(
+                    workspace, task_dir(task),
+                    published_file_grps(
+                        task, steps, config["SCRATCH_PUBLISH_FILE_GRPS"]
+                    ),
+                    [CHECKPOINTS_FILE, SOURCE_FILE]
+                )
+        finally:
+            if scratch is not None:
+                shutil.rmtree(scratch, ignore_errors=True)
+
+        logger.info(f'Finished processing task {task["uid"]}.')
+
+    return _task_result(task, checkpoints)
+
+
+@celery.task(bind=True)
+def prepare_task(self, task: dict, resume: bool = False):
+    """ Prepare the workspace of the task, the first link of the chain of
+    :func:`task_chain`. """
+    with task_log(task):
+        logger.info(f'Start processing task {task["uid"]}.')
+        _check_stop(task, task_dir(task), workspace=False)
+        _prepare(task, resume)
+
+
+@celery.task(bind=True)
+def run_step(self, task: dict, index: int):
+    """ Run the step of the workflow of the task with the given index on
+    the prepared workspace, unless it completed already, see
+    :meth:`~ocrd_butler.execution.checkpoints.Checkpoints.resume_index`. """
+    with task_log(task):
+        resident_workers.max_workers = current_app.config["RESIDENT_WORKERS_MAX"]
+        dst_dir = task_dir(task)
+        _check_stop(task, dst_dir)
+        resolver = Resolver()
+        workspace = IndexedWorkspace(resolver, dst_dir)
+        checkpoints = Checkpoints(dst_dir).load()
+        steps = workflow_steps(
+            task, "{}/mets.xml".format(dst_dir), resolver, workspace
+        )
+        if checkpoints.resume_index(steps, workspace) > index:
+            logger.info(f"Step {index + 1} of task '{task['uid']}' completed "
+                        "already.")
+            return
+        _run_steps(task, steps, workspace, checkpoints,
+                   start=index, stop=index + 1)
+
+
+@celery.task(bind=True)
+def finish_task(self, task: dict) -> dict:
+    """ Get the results of the task, the last link of the chain of
+    :func:`task_chain`. """
+    with task_log(task):
+        logger.info(f'Finished processing task {task["uid"]}.')
+    return _task_result(task, Checkpoints(task_dir(task)).load())
+
+
+# The links of a chain before its last one, which don't finish the task.
+CHAIN_STEP_TASKS = (prepare_task.name, run_step.name)
+
+
+def chain_task_ids(task: dict, task_id: str) -> List[str]:
+    """ The IDs of the links of the chain of :func:`task_chain` with the
+    ``task_id`` of its last link, which is the one the chain is known by.
+    The other links are derived from it, to revoke them all. """
+    return [task_id, f"{task_id}-prepare"] + [
+        f"{task_id}-step-{index}"
+        for index in range(len(task["workflow"]["processors"]))
+    ]
+
+
+def task_chain(task: dict, resume: bool = False, queue: str = None) -> chain:
+    """ Get a chain of Celery tasks running the task like :func:`run_task`,
+    but with every step of the workflow as a task of its own. It is routed
+    to the ``queue`` of the processor in ``PROCESSOR_SETTINGS``, if there is
+    one, so it can run on workers dedicated to the processor. The other
+    links go to ``queue``, ``STEP_CHAIN_QUEUE`` by default. The workers have
+    to share the results directory. The links get the IDs of
+    :func:`chain_task_ids`. """
+    queue = queue or current_app.config["STEP_CHAIN_QUEUE"]
+    last, prepare, *steps = chain_task_ids(task, str(uuid.uuid4()))
+
+    def routed(signature: Signature, queue: Optional[str],
+               task_id: str) -> Signature:
+        signature = signature.set(task_id=task_id)
+        return signature.set(queue=queue) if queue else signature
+
+    signatures = [routed(prepare_task.si(task, resume=resume), queue, prepare)]
+    for index, processor in enumerate(task["workflow"]["processors"]):
+        signatures.append(routed(
+            run_step.si(task, index=index),
+            processor_setting(processor, "queue", queue),
+            steps[index]
+        ))
+    signatures.append(routed(finish_task.si(task), queue, last))
+    return chain(*signatures)
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+
+"""Update the workspace of a task to a changed METS file, e.g. one that
+gained pages, so only the new and changed pages are processed again.
+
+The source of the image of every page, i.e. the URL and checksum of its file
+in the METS file of the task, is recorded in the workspace when it is
+prepared. Comparing it to the current METS file tells which pages are new,
+changed or removed. The output of the other pages is taken over from the
+former METS.
+"""
+
+import copy
+import json
+import os
+from typing import (
+    Dict,
+    Iterable,
+    List,
+    Optional,
+)
+
+from lxml import etree
+from ocrd_models import (
+    OcrdFile,
+    OcrdMets,
+)
+from ocrd_utils import is_local_filename
+from ocrd.workspace import Workspace
+
+from ocrd_butler.execution.mets import (
+    MetsIndex,
+    mets_index,
+)
+from ocrd_butler.util import logger
+
+
+# The file in a workspace with the source of the image of every page.
+SOURCE_FILE = "butler-source.json"
+
+
+def source_file_grp(index: MetsIndex, default_file_grp: str) -> str:
+    """ The file group of the METS the images of the workspace come from,
+    ``DEFAULT`` for ``MAX`` if there is no such group (see
+    :func:`~ocrd_butler.execution.tasks.prepare_workspace`). """
+    if default_file_grp == "MAX" and "MAX" not in index.file_groups:
+        return "DEFAULT"
+    return default_file_grp
+
+
+def source_pages(index: MetsIndex, default_file_grp: str) -> Dict[str, dict]:
+    """ The URL and checksum of the image of every page in the METS, in the
+    order of its file group. """
+    return {
+        mets_file["pageId"]: {
+            "url": mets_file["url"],
+            "checksum": mets_file["checksum"],
+        }
+        for mets_file in index.files(source_file_grp(index, default_file_grp))
+        if mets_file["pageId"]
+    }
+
+
+def save_source(dst_dir: str, pages: Dict[str, dict]):
+    """ Record the source of the pages of the workspace in ``dst_dir``. """
+    with open(os.path.join(dst_dir, SOURCE_FILE), "w") as fh:
+        json.dump({"pages": pages}, fh, indent=2)
+
+
+def load_source(dst_dir: str) -> Optional[Dict[str, dict]]:
+    """ The recorded source of the pages of the workspace in ``dst_dir``, if
+    there is any. """
+    try:
+        with open(os.path.join(dst_dir, SOURCE_FILE), "r") as fh:
+            return json.load(fh)["pages"]
+    except (FileNotFoundError, ValueError, KeyError):
+        return None
+
+
+def same_source(former: Optional[dict], current: Optional[dict]) -> bool:
+    """ Check if the image of a page comes from the same file, i.e. one with
+    the same URL and checksum.
+
+    >>> same_source({"url": "1.jpg", "checksum": None},
+    ...             {"url": "1.jpg", "checksum": None})
+    True
+    >>> same_source({"url": "1.jpg", "checksum": "a"},
+    ...             {"url": "1.jpg", "checksum": "b"})
+    False
+    >>> same_source(None, {"url": "1.jpg", "checksum": None})
+    False
+    """
+    if former is None or current is None:
+        return False
+    return former["url"] == current["url"]\
+        and former.get("checksum") == current.get("checksum")
+
+
+def changed_pages(former: Dict[str, dict],
+                  current: Dict[str, dict]) -> Dict[str, List[str]]:
+    """ Compare the sources of the pages of a workspace to the current ones.
+
+    >>> changed_pages(
+    ...     {"P1": {"url": "1.jpg"}, "P2": {"url": "2.jpg"},
+    ...      "P3": {"url": "3.jpg"}},
+    ...     {"P1": {"url": "1.jpg"}, "P2": {"url": "2a.jpg"},
+    ...      "P4": {"url": "4.jpg"}},
+    ... )
+    {'new': ['P4'], 'changed': ['P2'], 'removed': ['P3']}
+    """
+    return {
+        "new": [page for page in current if page not in former],
+        "changed": [page for page in current if page in former
+                    and not same_source(former[page], current[page])],
+        "removed": [page for page in former if page not in current],
+    }
+
+
+def reuse_images(workspace: Workspace, files: List[OcrdFile],
+                 pages: List[Optional[str]], source: Dict[str, dict],
+                 former: Dict[str, dict]) -> int:
+    """ Take the images of the given files, with their pages, from the
+    former workspace if they come from the same source. ``former`` has the
+    recorded source and the ``local`` file of every page. The files are
+    changed in place, so they aren't downloaded again.
+
+    Returns the number of reused images.
+    """
+    reused = 0
+    for ocrd_file, page in zip(files, pages):
+        image = former.get(page)
+        if not same_source(image, source.get(page)) or not image["local"]\
+                or not os.path.isfile(os.path.join(workspace.directory,
+                                                   image["local"])):
+            continue
+        ocrd_file.url = image["local"]
+        ocrd_file.local_filename = image["local"]
+        reused += 1
+    logger.info(f"Reuse {reused} of {len(files)} images of the former "
+                "workspace.")
+    return reused
+
+
+def carry_over(workspace: Workspace, former: MetsIndex,
+               pages: Iterable[str]) -> int:
+    """ Add the files of the given pages in the file groups of the former
+    METS, which aren't in the METS of the workspace, e.g. the output of the
+    processors. Doesn't save the METS.
+
+    Returns the number of added files.
+    """
+    pages = set(pages)
+    file_groups = mets_index(workspace).file_groups
+    added = 0
+    for file_grp in former.file_groups:
+        if file_grp in file_groups:
+            continue
+        for mets_file in former.files(file_grp):
+            if mets_file["pageId"] not in pages:
+                continue
+            workspace.mets.add_file(
+                file_grp,
+                ID=mets_file["ID"],
+                mimetype=mets_file["mimetype"],
+                pageId=mets_file["pageId"],
+                url=mets_file["url"],
+            )
+            added += 1
+    return added
+
+
+def copy_agents(workspace: Workspace, former: OcrdMets) -> int:
+    """ Add the agents of the former METS, i.e. the processors which ran,
+    the METS of the workspace doesn't have. Doesn't save the METS. """
+    # pylint: disable=protected-access
+    known = {etree.tostring(agent._el) for agent in workspace.mets.agents}
+    copied = 0
+    for agent in former.agents:
+        if etree.tostring(agent._el) in known:
+            continue
+        placeholder = workspace.mets.add_agent()._el
+        placeholder.getparent().replace(placeholder, copy.deepcopy(agent._el))
+        copied += 1
+    return copied
+
+
+def remove_unused(workspace: Workspace, former: MetsIndex) -> int:
+    """ Remove the local files of the former METS that the saved METS of the
+    workspace doesn't refer to any more, e.g. the ones of removed pages.
+
+    Returns the number of removed files.
+    """
+    index = mets_index(workspace)
+    used = {
+        mets_file["url"]
+        for file_grp in index.file_groups
+        for mets_file in index.files(file_grp)
+    }
+    removed = 0
+    for file_grp in former.file_groups:
+        for mets_file in former.files(file_grp):
+            url = mets_file["url"]
+            if not url or url in used or not is_local_filename(url):
+                continue
+            path = os.path.join(workspace.directory, url)
+            if os.path.isfile(path):
+                os.remove(path)
+                removed += 1
+    return removed
+
+
+def sort_file_groups(workspace: Workspace, file_grps: Iterable[str]):
+    """ Order the files of the file groups like the pages, as the ones of
+    new pages were added after the ones taken over. Doesn't save the METS.
+    """
+    index = mets_index(workspace)
+    for file_grp in file_grps:
+        if file_grp not in index.file_groups:
+            continue
+        by_page = index.by_page(file_grp)
+        workspace.mets.remove_file_group(file_grp, recursive=True, force=True)
+        for page in index.pages + [None]:
+            for mets_file in by_page.get(page, []):
+                workspace.mets.add_file(
+                    file_grp,
+                    ID=mets_file["ID"],
+                    mimetype=mets_file["mimetype"],
+                    pageId=page,
+                    url=mets_file["url"],
+                )
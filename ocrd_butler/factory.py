@@ -13,6 +13,7 @@ from ocrd_butler.api.tasks import task_namespace
 from ocrd_butler.api.restx import api
 from ocrd_butler.celery_utils import init_celery
 from ocrd_butler.database import db
+from ocrd_butler.database.migrations import upgrade
 from ocrd_butler.frontend import frontend_blueprint
 from ocrd_butler.frontend.processors import processors_blueprint
 from ocrd_butler.frontend.workflows import workflows_blueprint
@@ -75,6 +76,8 @@ def initialize_app(app):
 
     db.init_app(app)
     db.create_all(app=app)
+    if app.config["DATABASE_MIGRATE"]:
+        upgrade(db.get_engine(app))
 
     if not os.path.exists(app.config["OCRD_BUTLER_RESULTS"]):
         os.makedirs(app.config["OCRD_BUTLER_RESULTS"])
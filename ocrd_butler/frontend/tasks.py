@@ -6,6 +6,7 @@ import os
 import json
 import requests
 import uuid
+from urllib.parse import urlsplit
 from datetime import (
     datetime,
     timedelta
@@ -13,12 +14,12 @@ from datetime import (
 
 from flask import (
     Blueprint,
-    current_app,
     flash,
     redirect,
     render_template,
     request,
-    Response
+    Response,
+    url_for,
 )
 
 from flask_wtf import FlaskForm
@@ -40,7 +41,7 @@ from wtforms.validators import (
     URL
 )
 
-from ocrd_butler.util import host_url, flower_url
+from ocrd_butler.util import host_url
 
 
 tasks_blueprint = Blueprint("tasks_blueprint", __name__)
@@ -58,30 +59,25 @@ def _jinja2_filter_format_date(date):
 def _jinja2_filter_format_delta(delta):
     return delta.__str__()
 
+@tasks_blueprint.app_template_filter('format_seconds')
+def _jinja2_filter_format_seconds(seconds):
+    return timedelta(seconds=round(seconds)).__str__()
 
-def task_information(worker_task_id):
-    """
-    Get information for the task based on its worker task id from flower service.
-    """
-    if worker_task_id is None:
-        return None
-
-    flower_base = flower_url(request)
-    response = requests.get(f"{flower_base}/api/task/info/{worker_task_id}")
-    if response.status_code == 404:
-        current_app.logger.warning("Can't find task '{0}'".format(worker_task_id))
-        return None
-    try:
-        task_info = json.loads(response.content)
-    except json.decoder.JSONDecodeError as exc:
-        current_app.logger.error(f"Can't read response for task '{worker_task_id}'. ({exc.__str__()})")
-        return None
+@tasks_blueprint.app_template_filter('format_bytes')
+def _jinja2_filter_format_bytes(size):
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if size < 1024:
+            break
+        size /= 1024
+    return f"{size:.1f} {unit}" if unit != "B" else f"{size} B"
 
-    task_info["ready"] = task_info["state"] == "SUCCESS"
-    if task_info["result"] is not None:
-        task_info["result"] = json.loads(task_info["result"].replace("'", '"'))
 
-    return task_info
+def task_information(task):
+    """
+    Get the timings of the last run of the task, served by the API from its
+    events, see :func:`ocrd_butler.execution.states.task_timings`.
+    """
+    return task.get("timings")
 
 
 def current_tasks(tasks=None):
@@ -89,7 +85,7 @@ def current_tasks(tasks=None):
     Collect and prepare the current tasks.
     """
     if tasks == None:
-        tasks = requests.get(f'{host_url(request)}api/tasks').json()
+        tasks = requests.get(f'{host_url(request)}api/tasks').json()["tasks"]
 
     results = [
         {
@@ -104,6 +100,7 @@ def current_tasks(tasks=None):
                 "started": "",
                 "succeeded": "",
                 "runtime": "",
+                "queue_wait": "",
                 "log": ""
             },
         }
@@ -115,7 +112,7 @@ def current_tasks(tasks=None):
     for result in results:
         task = {**result}
 
-        task_info = task_information(result.get('worker_task_id'))
+        task_info = task_information(result)
         uid = result.get('uid')
         task["result"].update({
             "log": f"/log/{uid}"
@@ -143,6 +140,10 @@ def current_tasks(tasks=None):
                     "succeeded": datetime.fromtimestamp(task_info["succeeded"]),
                     "runtime": timedelta(seconds=task_info["runtime"])
                 })
+            if task_info.get("queue_wait") is not None:
+                task["result"].update({
+                    "queue_wait": timedelta(seconds=task_info["queue_wait"])
+                })
 
         # A bit hacky, but for devs on localhost.
         flower_host_url = request.host_url.replace("5000", "5555")
@@ -238,9 +239,19 @@ def tasks():
         ).json()
     ]
 
+    # The filters and the page of the listing are passed on to the API.
+    page = requests.get(
+        f'{host_url(request)}api/tasks', params=request.args
+    ).json()
+    next_page = None
+    if page.get("next"):
+        next_page = "{0}?{1}".format(
+            url_for("tasks_blueprint.tasks"), urlsplit(page["next"]).query)
+
     return render_template(
         "tasks.html",
-        tasks=current_tasks(),
+        tasks=current_tasks(page.get("tasks", [])),
+        next_page=next_page,
         form=new_task_form)
 
 
@@ -250,9 +261,16 @@ def task(task_uid):
     task = current_tasks(
         [requests.get(f'{host_url(request)}api/tasks/{task_uid}').json(),]
     )[0]
+    response = requests.get(f'{host_url(request)}api/tasks/{task_uid}/steps')
+    steps = response.json() if response.status_code == 200 else []
+    response = requests.get(f'{host_url(request)}api/tasks/{task_uid}/status')
+    estimate = response.json().get("estimate")\
+        if response.status_code == 200 else None
     return render_template(
         "task.html",
-        task=task
+        task=task,
+        steps=steps,
+        estimate=estimate
     )
 
 
@@ -382,12 +400,16 @@ def download_alto_zip(task_id):
 @tasks_blueprint.route("/log/<string:task_id>")
 def log(task_id):
     """Define route to get the current log of the task."""
-    response = requests.get(f"{host_url(request)}api/tasks/{task_id}/log")
+    response = requests.get(
+        f"{host_url(request)}api/tasks/{task_id}/log",
+        params=request.args
+    )
     return validate_and_wrap_response(
         response, 'text',
         mimetype="text/txt",
         headers={
             "Content-Disposition":
-            f"attachment;filename=task-{task_id}.log"
+            f"attachment;filename=task-{task_id}.log",
+            "X-Log-Offset": response.headers.get("X-Log-Offset", ""),
         }
     )
@@ -65,7 +65,8 @@ class ApiTaskTests(TestCase):
         )
         response = self.client.get('/api/tasks')
         assert response.status_code == 200
-        assert len(response.json) == 1
+        assert len(response.json["tasks"]) == 1
+        assert response.json["next"] is None
 
     def test_get_one_task(self):
         """ test /api/tasks GET response
@@ -79,7 +80,8 @@ class ApiTaskTests(TestCase):
         )
         response = self.client.get(f'/api/tasks/{response.json["uid"]}')
         assert response.status_code == 200
-        assert len(response.json) == 10
+        assert len(response.json) == 16
+        assert response.json['timings'] is None
         assert response.json['src'] == 'http://url'
 
 
@@ -122,6 +124,60 @@ class ApiTaskTests(TestCase):
         assert response.status_code == 404
         assert response.json["message"].startswith("Unknown task")
 
+    def test_create_task_batch(self):
+        """Check if many tasks are created at once."""
+        workflow_id = self.workflow()
+        response = self.client.post("/api/tasks/batch", json=dict(tasks=[
+            dict(workflow_id=workflow_id,
+                 src=f"https://foobar.tdl/PPN{i}.xml")
+            for i in range(5)
+        ]))
+        assert response.status_code == 201
+        assert response.json["message"] == "Tasks created."
+        batch_id = response.json["batch_id"]
+        assert len(response.json["uids"]) == 5
+
+        task = self.client.get(f"/api/tasks/{response.json['uids'][2]}").json
+        assert task["src"] == "https://foobar.tdl/PPN2.xml"
+        assert task["batch_id"] == batch_id
+        assert task["status"] == "CREATED"
+
+        response = self.client.get(f"/api/tasks/batch/{batch_id}")
+        assert response.status_code == 200
+        assert response.json == {
+            "batch_id": batch_id,
+            "total": 5,
+            "finished": 0,
+            "status": {"CREATED": 5},
+        }
+
+    def test_create_task_batch_invalid(self):
+        """Check that no task of a batch with an invalid one is created."""
+        workflow_id = self.workflow()
+        response = self.client.post("/api/tasks/batch", json=dict(tasks=[
+            dict(workflow_id=workflow_id, src="https://foobar.tdl/1.xml"),
+            dict(workflow_id=workflow_id, src="https://foobar.tdl/2.xml",
+                 parameters={"ocrd-tesserocr-recognize": {"foo": "bar"}}),
+        ]))
+        assert response.status_code == 400
+        assert response.json["status"].startswith("Task 1: Unknown parameter")
+        assert self.client.get("/api/tasks").json["tasks"] == []
+
+        response = self.client.post("/api/tasks/batch", json=dict(tasks=[
+            dict(workflow_id=workflow_id + 1, src="https://foobar.tdl/1.xml"),
+        ]))
+        assert response.status_code == 400
+        assert response.json["status"] == \
+            f"Task 0: Unknown workflow with id {workflow_id + 1}."
+
+        response = self.client.post("/api/tasks/batch", json=dict(tasks=[]))
+        assert response.status_code == 400
+
+    def test_task_batch_unknown(self):
+        response = self.client.get("/api/tasks/batch/foobar")
+        assert response.status_code == 404
+        assert response.json["message"].startswith("Unknown batch")
+
     def test_task_model(self):
         assert "src" in task_model
         assert "workflow_id" in task_model
@@ -132,5 +188,10 @@ class ApiTaskTests(TestCase):
         assert "status" in task_model
         assert "results" in task_model
 
+        assert "priority" in task_model
+
         for field in task_model:
-            assert type(task_model[field]) == fields.String
+            if field == "priority":
+                assert type(task_model[field]) == fields.Integer
+            else:
+                assert type(task_model[field]) == fields.String
@@ -7,9 +7,11 @@ import json
 import glob
 import responses
 import shutil
+import tempfile
 from unittest import mock
 
 from flask_testing import TestCase
+from ocrd_models import OcrdMets
 
 from ocrd_butler import celery
 from ocrd_butler.config import TestingConfig
@@ -147,6 +149,392 @@ class ApiTaskActionRunTests(TestCase):
         ).json
         assert run_response['status'] == 'SUCCESS'
 
+        steps = self.client.get(
+            f"/api/tasks/{task_response['uid']}/steps"
+        ).json
+        assert [step['name'] for step in steps] == ['ocrd-dummy']
+        assert steps[0]['pages'] == 3
+        assert steps[0]['usage']['wall'] > 0
+        assert steps[0]['usage']['maxrss'] > 0
+
+        events = self.client.get(
+            f"/api/tasks/{task_response['uid']}/events"
+        ).json
+        assert [event['state'] for event in events] == [
+            'PENDING', 'STARTED', 'SUCCESS', 'SUCCESS'
+        ]
+        timings = self.client.get(
+            f"/api/tasks/{task_response['uid']}"
+        ).json['timings']
+        assert timings['runtime'] > 0
+        assert timings['queue_wait'] >= 0
+
+    @responses.activate
+    @require_ocrd_processors("ocrd-dummy")
+    def test_task_rerun_dummy(self):
+        """ A rerun resumes at the first step without a completed checkpoint.
+        """
+        workflow_response = self.client.post(
+            '/api/workflows',
+            json=dict(
+                name='dummy workflow',
+                description='workflow containing two dummy processor tasks',
+                processors=[
+                    dict(name='ocrd-dummy', output_file_grp='OCR-D-DUMMY-1'),
+                    dict(name='ocrd-dummy', output_file_grp='OCR-D-DUMMY-2'),
+                ]
+            )
+        ).json
+        task_response = self.client.post(
+            '/api/tasks',
+            json=dict(
+                workflow_id=workflow_response['id'],
+                src="http://foo.bar/mets.xml",
+            )
+        ).json
+        uid = task_response['uid']
+        self.add_response_action(uid)
+        assert self.client.post(
+            f"/api/tasks/{uid}/run").json['status'] == 'SUCCESS'
+
+        result_dir = self.client.get(
+            f"/api/tasks/{uid}/results").json["result_dir"]
+        checkpoints_file = os.path.join(result_dir, "butler-steps.json")
+        with open(checkpoints_file) as fh:
+            checkpoints = json.load(fh)
+        assert [step["status"] for step in checkpoints["steps"]] == [
+            "COMPLETED", "COMPLETED"
+        ]
+
+        outputs = sorted(os.listdir(os.path.join(result_dir, "OCR-D-DUMMY-2")))
+
+        # Let the last step look like it failed halfway.
+        checkpoints["steps"][1]["status"] = "FAILED"
+        with open(checkpoints_file, "w") as fh:
+            json.dump(checkpoints, fh)
+        leftover = os.path.join(result_dir, "OCR-D-DUMMY-2", "leftover")
+        with open(leftover, "w") as fh:
+            fh.write("leftover")
+
+        downloads = len(responses.calls)
+        assert self.client.post(
+            f"/api/tasks/{uid}/rerun").json['status'] == 'SUCCESS'
+        # Neither the METS nor the images are downloaded again.
+        assert len(responses.calls) == downloads
+
+        with open(checkpoints_file) as fh:
+            resumed = json.load(fh)
+        assert resumed["prepared"] == checkpoints["prepared"]
+        assert resumed["steps"][0] == checkpoints["steps"][0]
+        assert resumed["steps"][1]["status"] == "COMPLETED"
+        assert resumed["steps"][1]["finished"] > \
+            checkpoints["steps"][1]["finished"]
+        assert not os.path.exists(leftover)
+        assert sorted(os.listdir(
+            os.path.join(result_dir, "OCR-D-DUMMY-2"))) == outputs
+
+    def two_step_task(self):
+        workflow_response = self.client.post(
+            '/api/workflows',
+            json=dict(
+                name='dummy workflow',
+                description='workflow containing two dummy processor tasks',
+                processors=[
+                    dict(name='ocrd-dummy', output_file_grp='OCR-D-DUMMY-1',
+                         queue='dummy'),
+                    dict(name='ocrd-dummy', output_file_grp='OCR-D-DUMMY-2'),
+                ]
+            )
+        ).json
+        return self.client.post(
+            '/api/tasks',
+            json=dict(
+                workflow_id=workflow_response['id'],
+                src="http://foo.bar/mets.xml",
+            )
+        ).json['uid']
+
+    def test_task_chain_queues(self):
+        """ Steps go to the queues of their processors. """
+        from ocrd_butler.database.models import Task
+        from ocrd_butler.execution.tasks import (
+            chain_task_ids,
+            task_chain,
+        )
+        task = Task.get(uid=self.two_step_task()).to_json()
+        with mock.patch.dict(flask_app.config, STEP_CHAIN_QUEUE="butler"):
+            links = task_chain(task).tasks
+        assert [link.task for link in links] == [
+            "ocrd_butler.execution.tasks.prepare_task",
+            "ocrd_butler.execution.tasks.run_step",
+            "ocrd_butler.execution.tasks.run_step",
+            "ocrd_butler.execution.tasks.finish_task",
+        ]
+        assert [link.kwargs.get("index") for link in links] == \
+            [None, 0, 1, None]
+        assert [link.options["queue"] for link in links] == [
+            "butler", "dummy", "butler", "butler"
+        ]
+        # The links can be revoked by the ID of the last one.
+        assert chain_task_ids(task, links[-1].options["task_id"]) == [
+            link.options["task_id"] for link in links[-1:] + links[:-1]
+        ]
+
+    @responses.activate
+    @require_ocrd_processors("ocrd-dummy")
+    def test_task_run_chain_dummy(self):
+        """ With ``STEP_CHAIN`` every step is a Celery task of its own. """
+        uid = self.two_step_task()
+        self.add_response_action(uid)
+        with mock.patch.dict(flask_app.config, STEP_CHAIN=True):
+            run_response = self.client.post(f"/api/tasks/{uid}/run").json
+        assert run_response['status'] == 'SUCCESS'
+
+        status = self.client.get(f"/api/tasks/{uid}/status").json
+        assert status['status'] == 'SUCCESS'
+        results = self.client.get(f"/api/tasks/{uid}/results").json
+        assert [step['output_file_grp'] for step in results['steps']] == [
+            'OCR-D-DUMMY-1', 'OCR-D-DUMMY-2'
+        ]
+        assert all(step['status'] == 'COMPLETED' for step in results['steps'])
+
+        log = self.client.get(f"/api/tasks/{uid}/log").data.decode("utf-8")
+        assert log.count(f"Start processing task {uid}.") == 1
+        assert log.count(f"Finished processing task {uid}.") == 1
+        assert "OCR-D-DUMMY-1" in log and "OCR-D-DUMMY-2" in log
+
+    @responses.activate
+    @require_ocrd_processors("ocrd-dummy")
+    def test_task_run_mets_cache_dummy(self):
+        """ The METS file fetched to count the pages of the task is taken
+        from the ``METS_CACHE_DIR`` when it runs. """
+        with tempfile.TemporaryDirectory() as mets_cache_dir, \
+                mock.patch.dict(flask_app.config, METS_CACHE_DIR=mets_cache_dir,
+                                METS_CACHE_MAX_AGE=60, TASK_ROUTING=True):
+            uid = self.two_step_task()
+            task = self.client.get(f"/api/tasks/{uid}").json
+            assert task['page_count'] == 3
+            self.add_response_action(uid)
+            run_response = self.client.post(f"/api/tasks/{uid}/run").json
+        assert run_response['status'] == 'SUCCESS'
+        mets_calls = [
+            call for call in responses.calls
+            if call.request.url == "http://foo.bar/mets.xml"
+        ]
+        assert len(mets_calls) == 1
+
+    @responses.activate
+    @require_ocrd_processors("ocrd-dummy")
+    def test_task_run_scratch_dummy(self):
+        """ With ``SCRATCH_DIR`` only the images and the output of the last
+        step are published to the results, and the scratch space is gone. """
+        uid = self.two_step_task()
+        self.add_response_action(uid)
+        with tempfile.TemporaryDirectory() as scratch_dir, \
+                mock.patch.dict(flask_app.config, SCRATCH_DIR=scratch_dir):
+            run_response = self.client.post(f"/api/tasks/{uid}/run").json
+            assert os.listdir(scratch_dir) == []
+        assert run_response['status'] == 'SUCCESS'
+
+        result_dir = f"{flask_app.config['OCRD_BUTLER_RESULTS']}/{uid}"
+        assert sorted(os.listdir(result_dir)) == [
+            'MAX', 'OCR-D-DUMMY-2', 'butler-source.json', 'butler-steps.json',
+            'mets.xml'
+        ]
+        assert len(os.listdir(f"{result_dir}/OCR-D-DUMMY-2")) == 3
+        steps = self.client.get(f"/api/tasks/{uid}/steps").json
+        assert [step['status'] for step in steps] == ['COMPLETED'] * 2
+
+    @responses.activate
+    @require_ocrd_processors("ocrd-dummy")
+    def test_task_run_scratch_failed(self):
+        """ The scratch space of a failed task is removed as well. """
+        uid = self.two_step_task()
+        with tempfile.TemporaryDirectory() as scratch_dir, \
+                mock.patch.dict(flask_app.config, SCRATCH_DIR=scratch_dir), \
+                mock.patch("ocrd_butler.execution.tasks._run_processor",
+                           side_effect=Exception("Processor exploded.")):
+            run_response = self.client.post(f"/api/tasks/{uid}/run").json
+            assert os.listdir(scratch_dir) == []
+        assert run_response['status'] == 'FAILURE'
+
+    @responses.activate
+    @require_ocrd_processors("ocrd-dummy")
+    def test_task_update_dummy(self):
+        """ An update processes only the new and changed pages of the METS
+        and keeps the output of the others. """
+        uid = self.two_step_task()
+        self.add_response_action(uid)
+        # Not before the task succeeded.
+        assert self.client.post(f"/api/tasks/{uid}/update").status_code == 500
+        assert self.client.post(
+            f"/api/tasks/{uid}/run").json['status'] == 'SUCCESS'
+        result_dir = f"{flask_app.config['OCRD_BUTLER_RESULTS']}/{uid}"
+        kept = os.path.join(result_dir, "OCR-D-DUMMY-2",
+                            "FILE_0001_OCR-D-DUMMY-2_PAGE.xml")
+        kept_mtime = os.stat(kept).st_mtime_ns
+
+        # Page 2 changed, page 3 is gone and page 4 is new.
+        mets = OcrdMets(filename=os.path.join(
+            CURRENT_DIR, "files", "PPN821881744.mets.xml"
+        ))
+        mets.remove_file(pageId="PHYS_0003")
+        mets.remove_physical_page("PHYS_0003")
+        # pylint: disable=protected-access
+        next(mets.find_files(ID="FILE_0002_DEFAULT"))._el.set(
+            "CHECKSUM", "changed"
+        )
+        page_4 = ("https://content.staatsbibliothek-berlin.de/dc/"
+                  "PPN821881744-00000004/full/max/0/default")
+        mets.add_file("DEFAULT", ID="FILE_0004_DEFAULT", mimetype="image/jpg",
+                      pageId="PHYS_0004", url=f"{page_4}.jpg")
+        responses.remove(responses.GET, "http://foo.bar/mets.xml")
+        responses.add(responses.GET, "http://foo.bar/mets.xml",
+                      body=mets.to_xml(), status=200)
+        with open(os.path.join(CURRENT_DIR, "files", "00000001.jpg"),
+                  "rb") as tfh:
+            responses.add(responses.GET, f"{page_4}.tif", body=tfh.read(),
+                          status=200, content_type="image/tiff")
+        downloads = len(responses.calls)
+
+        assert self.client.post(
+            f"/api/tasks/{uid}/update").json['status'] == 'SUCCESS'
+        results = self.client.get(f"/api/tasks/{uid}/results").json
+        assert results["update"] == {
+            "new": ["PHYS_0004"], "changed": ["PHYS_0002"],
+            "removed": ["PHYS_0003"],
+        }
+        # The METS and the images of the pages 2 and 4.
+        assert len(responses.calls) == downloads + 3
+
+        result = OcrdMets(filename=os.path.join(result_dir, "mets.xml"))
+        assert result.physical_pages == ["PHYS_0001", "PHYS_0002", "PHYS_0004"]
+        for file_grp in ("MAX", "OCR-D-DUMMY-1", "OCR-D-DUMMY-2"):
+            pages = [f.pageId for f in result.find_files(fileGrp=file_grp)]
+            # In page order, the dummy adds images and PAGE files.
+            assert pages == sorted(pages)
+            assert set(pages) == {"PHYS_0001", "PHYS_0002", "PHYS_0004"}
+        assert os.stat(kept).st_mtime_ns == kept_mtime
+        assert sorted(os.listdir(os.path.join(result_dir, "MAX"))) == [
+            "FILE_0001_MAX.tif", "FILE_0002_MAX.tif", "FILE_0004_MAX.tif",
+        ]
+        assert sorted(os.listdir(
+            os.path.join(result_dir, "OCR-D-DUMMY-2"))) == [
+            "FILE_0001_OCR-D-DUMMY-2_PAGE.xml",
+            "FILE_0002_OCR-D-DUMMY-2_PAGE.xml",
+            "FILE_0004_OCR-D-DUMMY-2_PAGE.xml",
+        ]
+        steps = self.client.get(f"/api/tasks/{uid}/steps").json
+        assert [step['files'] for step in steps] == [6, 3]
+
+        # Nothing changed since.
+        assert self.client.post(
+            f"/api/tasks/{uid}/update").json['status'] == 'SUCCESS'
+        results = self.client.get(f"/api/tasks/{uid}/results").json
+        assert results["update"] == {"new": [], "changed": [], "removed": []}
+        assert os.stat(kept).st_mtime_ns == kept_mtime
+
+    @responses.activate
+    @require_ocrd_processors("ocrd-dummy")
+    def test_task_batch_run_dummy(self):
+        """ A batch of tasks is run in one group. """
+        workflow_id = self.client.post(
+            '/api/workflows',
+            json=dict(
+                name='dummy workflow',
+                description='workflow containing only a dummy processor task',
+                processors=[dict(name='ocrd-dummy')]
+            )
+        ).json['id']
+        response = self.client.post('/api/tasks/batch', json=dict(
+            tasks=[dict(workflow_id=workflow_id, src="http://foo.bar/mets.xml")
+                   for _ in range(2)],
+            run=True,
+        ))
+        assert response.status_code == 201
+        for uid in response.json['uids']:
+            self.add_response_action(uid)
+            task = self.client.get(f"/api/tasks/{uid}").json
+            assert task['worker_task_id'] is not None
+            assert task['status'] == 'SUCCESS'
+        progress = self.client.get(
+            f"/api/tasks/batch/{response.json['batch_id']}").json
+        assert progress['finished'] == progress['total'] == 2
+        assert progress['status'] == {'SUCCESS': 2}
+
+    def running_task(self):
+        from ocrd_butler.database.models import Task
+        uid = self.two_step_task()
+        task = Task.get(uid=uid)
+        task.status = "STARTED"
+        task.worker_task_id = "celery-42"
+        db.session.commit()
+        return task
+
+    @mock.patch("ocrd_butler.api.tasks.celery.control.revoke")
+    def test_task_stop(self, revoke):
+        """ Stopping a task revokes it and asks its worker to stop. """
+        from ocrd_butler.execution.stop import stop_requested
+        from ocrd_butler.execution.tasks import task_dir
+        task = self.running_task()
+        response = self.client.post(f"/api/tasks/{task.uid}/stop")
+        assert response.status_code == 200
+        assert response.json["status"] == "REVOKED"
+        # With all the links of its chain, if it runs as one.
+        revoke.assert_called_once_with([
+            "celery-42", "celery-42-prepare", "celery-42-step-0",
+            "celery-42-step-1",
+        ])
+        assert stop_requested(task_dir(task.to_json()))
+        assert self.client.get(
+            f"/api/tasks/{task.uid}/status").json["status"] == "REVOKED"
+
+        response = self.client.post(f"/api/tasks/{task.uid}/stop")
+        assert response.status_code == 500
+        assert "not running" in response.json["status"]
+
+    @mock.patch("ocrd_butler.api.tasks.celery.control.revoke")
+    def test_task_delete_running(self, revoke):
+        """ Deleting a running task stops it. """
+        task = self.running_task()
+        assert self.client.delete(f"/api/tasks/{task.uid}").status_code == 200
+        assert revoke.call_args[0][0][0] == "celery-42"
+
+    def test_task_run_deleted(self):
+        """ A task deleted before its chain starts doesn't run, though its
+        stop request went along with its results directory. """
+        from ocrd_butler.database.models import Task
+        from ocrd_butler.execution.stop import stop_requested
+        from ocrd_butler.execution.tasks import (
+            prepare_task,
+            task_dir,
+        )
+        task = self.running_task()
+        task_json = task.to_json()
+        with mock.patch("ocrd_butler.api.tasks.celery.control.revoke"):
+            assert self.client.delete(
+                f"/api/tasks/{task.uid}").status_code == 200
+        assert not stop_requested(task_dir(task_json))
+        assert Task.get(uid=task_json["uid"]) is None
+        result = prepare_task.apply(args=[task_json])
+        assert result.status == "FAILURE"
+        assert not os.path.exists(task_dir(task_json))
+
+    def test_task_run_stopped(self):
+        """ A task asked to stop before it starts is revoked. """
+        from ocrd_butler.database.models import Task
+        from ocrd_butler.execution.stop import request_stop
+        from ocrd_butler.execution.tasks import (
+            run_task,
+            task_dir,
+        )
+        task = Task.get(uid=self.two_step_task()).to_json()
+        request_stop(task_dir(task))
+        result = run_task.apply(args=[task])
+        assert result.status == "FAILURE"
+        assert Task.get(uid=task["uid"]).status == "REVOKED"
+        shutil.rmtree(task_dir(task))
+
     def add_response_action(self, uid, action='page_to_alto'):
         responses.add(
             method=responses.POST,
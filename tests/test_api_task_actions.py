@@ -153,6 +153,16 @@ class ApiTaskActions(TestCase):
         assert response.content_type == "text/txt; charset=utf-8"
         assert b"Finished processing task foobar" in response.data
 
+        offset = int(response.headers["X-Log-Offset"])
+        assert offset == len(response.data)
+        response = self.client.get(f"/api/tasks/foobar/log?offset={offset}")
+        assert response.status_code == 200
+        assert response.data == b""
+        assert response.headers["X-Log-Offset"] == str(offset)
+
+        response = self.client.get(f"/api/tasks/foobar/log?offset={offset - 32}")
+        assert response.data == b"Finished processing task foobar."
+
     @mock.patch('flask_sqlalchemy._QueryProperty.__get__')
     def test_api_task_results_zip(self, mock_fs):
         """Check if download result files is working."""
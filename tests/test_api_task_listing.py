@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+
+"""Testing the listing and the export of tasks."""
+
+from datetime import datetime
+import json
+from unittest import mock
+from urllib.parse import urlsplit
+
+from flask_testing import TestCase
+from sqlalchemy import event
+
+from ocrd_butler.config import TestingConfig
+from ocrd_butler.database import models as db_model
+from ocrd_butler.factory import create_app, db
+
+
+class TaskListingTests(TestCase):
+    """Test paging through the tasks."""
+
+    def create_app(self):
+        return create_app(config=TestingConfig)
+
+    def setUp(self):
+        db.create_all()
+        self.workflow_ids = [
+            self.client.post("/api/workflows", json=dict(
+                name=f"Workflow {index}",
+                description="Some foobar workflow.",
+                processors=[{"name": "ocrd-tesserocr-recognize"}]
+            )).json["id"]
+            for index in range(2)
+        ]
+        created = [
+            datetime(2021, 3, 1), datetime(2021, 3, 3), None,
+            datetime(2021, 3, 2), datetime(2021, 3, 2), None,
+            datetime(2021, 3, 4),
+        ]
+        self.tasks = []
+        for index, date in enumerate(created):
+            task = db_model.Task.add(
+                uid=f"task-{index}",
+                src=f"http://foo.bar/PPN{index}{'_%' if index == 3 else ''}"
+                    ".mets.xml",
+                workflow_id=self.workflow_ids[index % 2],
+                status="SUCCESS" if index % 3 else "FAILURE",
+            )
+            task.created = date
+            self.tasks.append(task)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    def uids(self, query: str = "", limit: int = 2) -> list:
+        """ The uids of all pages of the listing. """
+        uids = []
+        url = f"/api/tasks?limit={limit}&{query}"
+        while url:
+            response = self.client.get(url)
+            assert response.status_code == 200, response.json
+            assert len(response.json["tasks"]) <= limit
+            uids.extend(task["uid"] for task in response.json["tasks"])
+            url = response.json["next"]
+            if url:
+                parts = urlsplit(url)
+                url = f"{parts.path}?{parts.query}"
+        return uids
+
+    def test_pages(self):
+        assert self.uids() == [f"task-{index}" for index in range(6, -1, -1)]
+        assert self.uids("sort=id", limit=3) == [
+            f"task-{index}" for index in range(7)
+        ]
+
+    def test_sort_created(self):
+        assert self.uids("sort=created") == [
+            "task-2", "task-5", "task-0", "task-3", "task-4", "task-1",
+            "task-6",
+        ]
+        assert self.uids("sort=-created") == [
+            "task-6", "task-1", "task-4", "task-3", "task-0", "task-5",
+            "task-2",
+        ]
+        # Tasks added meanwhile aren't repeated.
+        response = self.client.get("/api/tasks?sort=created&limit=3")
+        db_model.Task.add(uid="task-7", src="http://foo.bar/new.mets.xml",
+                          workflow_id=self.workflow_ids[0])
+        parts = urlsplit(response.json["next"])
+        query = parts.query.replace("limit=3", "limit=10")
+        uids = [task["uid"] for task in self.client.get(
+            f"{parts.path}?{query}"
+        ).json["tasks"]]
+        assert uids == ["task-3", "task-4", "task-1", "task-6", "task-7"]
+
+    def test_filters(self):
+        assert self.uids("status=FAILURE") == ["task-6", "task-3", "task-0"]
+        assert self.uids("status=FAILURE,SUCCESS") == self.uids()
+        assert self.uids("status=FAILURE&status=SUCCESS") == self.uids()
+        assert self.uids(f"workflow_id={self.workflow_ids[1]}") == [
+            "task-5", "task-3", "task-1"
+        ]
+        assert self.uids("src=PPN4") == ["task-4"]
+        assert self.uids("src=_%25") == ["task-3"]
+        assert self.uids(
+            "created_after=2021-03-02&created_before=2021-03-04"
+            "&sort=created"
+        ) == ["task-3", "task-4", "task-1"]
+        assert self.uids("created_after=2021-03-03T01:00:00%2B02:00") == [
+            "task-6", "task-1"
+        ]
+
+    def test_wrong_parameters(self):
+        for query in ("sort=src", "cursor=foo", "created_after=yesterday",
+                      "workflow_id=one"):
+            response = self.client.get(f"/api/tasks?{query}")
+            assert response.status_code == 400, query
+
+    def test_page_size(self):
+        with mock.patch.dict(self.app.config, TASK_PAGE_SIZE=4,
+                             TASK_PAGE_SIZE_MAX=5):
+            assert len(self.client.get("/api/tasks").json["tasks"]) == 4
+            assert len(self.client.get(
+                "/api/tasks?limit=100"
+            ).json["tasks"]) == 5
+
+    def test_export(self):
+        with mock.patch.dict(self.app.config, TASK_EXPORT_BATCH=2):
+            response = self.client.get("/api/tasks/export?status=SUCCESS")
+            assert response.status_code == 200
+            assert response.mimetype == "application/x-ndjson"
+            tasks = [json.loads(line)
+                     for line in response.data.decode().splitlines()]
+        assert [task["uid"] for task in tasks] == [
+            "task-1", "task-2", "task-4", "task-5"
+        ]
+        assert tasks[0]["workflow"]["id"] == self.workflow_ids[1]
+        assert self.client.get(
+            "/api/tasks/export?created_after=yesterday"
+        ).status_code == 400
+
+    def test_fields(self):
+        response = self.client.get("/api/tasks?fields=uid,status&limit=1")
+        assert response.json["tasks"] == [
+            {"uid": "task-6", "status": "FAILURE"}
+        ]
+        response = self.client.get("/api/tasks/task-1?fields=workflow_id,src")
+        assert response.json == {
+            "src": "http://foo.bar/PPN1.mets.xml",
+            "workflow_id": self.workflow_ids[1],
+        }
+        # The ID of the workflow only if asked for.
+        assert "workflow_id" not in self.client.get("/api/tasks/task-1").json
+        for query in ("fields=uid,processors", "fields=workflows"):
+            assert self.client.get(
+                f"/api/tasks?{query}"
+            ).status_code == 400, query
+            assert self.client.get(
+                f"/api/tasks/task-1?{query}"
+            ).status_code == 400, query
+        assert self.client.get("/api/tasks/unknown").status_code == 404
+
+    def test_parameters(self):
+        """ The parameters are JSON, whichever quotes their values have. """
+        parameters = {"ocrd-foo": {"text": "Mother's day", "n": 1}}
+        self.tasks[1].parameters = json.dumps(parameters)
+        db.session.commit()
+        response = self.client.get("/api/tasks/task-1?fields=parameters")
+        assert response.status_code == 200
+        assert response.json == {"parameters": parameters}
+
+    def test_workflow(self):
+        statements = []
+        engine = db.get_engine(self.app)
+
+        def count(*args):
+            statements.append(args[2])
+
+        event.listen(engine, "before_cursor_execute", count)
+        try:
+            tasks = self.client.get(
+                "/api/tasks?limit=10&fields=uid,workflow"
+            ).json["tasks"]
+            joined = statements[:]
+            del statements[:]
+            self.client.get("/api/tasks?limit=10&fields=uid,workflow_id")
+        finally:
+            event.remove(engine, "before_cursor_execute", count)
+        # The tasks along with their workflows, and nothing else.
+        assert len(joined) == 1
+        assert "JOIN workflows" in joined[0]
+        # Or with the ID of their workflows.
+        assert len(statements) == 1
+        assert "JOIN workflows" not in statements[0]
+        assert tasks[0]["workflow"]["name"] == "Workflow 0"
+        assert [processor["name"] for processor in
+                tasks[0]["workflow"]["processors"]] == [
+            "ocrd-tesserocr-recognize"
+        ]
+        task = self.client.get("/api/tasks/task-1").json
+        assert task["workflow"]["name"] == "Workflow 1"
+        assert task["workflow"]["id"] == self.workflow_ids[1]
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+
+"""Testing the worker side caches."""
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest import TestCase
+
+import requests
+import responses
+
+from ocrd_butler.execution.cache import (
+    ImageCache,
+    MetsCache,
+    StepCache,
+    clone_or_copy,
+)
+
+
+class ImageCacheTests(TestCase):
+    """Test the image cache."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = ImageCache(
+            os.path.join(self.directory, "cache"), max_size=1024
+        )
+        self.downloads = []
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def download(self, url, dst):
+        self.downloads.append(url)
+        time.sleep(0.05)
+        with open(dst, "wb") as fh:
+            fh.write(url.encode("utf-8").ljust(100, b"x"))
+
+    def test_fetch(self):
+        assert self.cache.lookup("http://foo.bar/1.tif") is None
+        path = self.cache.fetch("http://foo.bar/1.tif", self.download)
+        assert os.path.exists(path)
+        assert self.cache.fetch("http://foo.bar/1.tif", self.download) == path
+        assert self.cache.lookup("http://foo.bar/1.tif") == path
+        assert self.downloads == ["http://foo.bar/1.tif"]
+
+    def test_fetch_same_content(self):
+        """ Different URLs with the same content share one object. """
+        def download(url, dst):
+            with open(dst, "wb") as fh:
+                fh.write(b"same")
+        first = self.cache.fetch("http://foo.bar/1.tif", download)
+        second = self.cache.fetch("http://foo.bar/2.tif", download)
+        assert first == second
+        assert self.cache.size() == 4
+
+    def test_fetch_coalesced(self):
+        paths = []
+        threads = [
+            threading.Thread(target=lambda: paths.append(
+                self.cache.fetch("http://foo.bar/1.tif", self.download)
+            ))
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(set(paths)) == 1
+        assert self.downloads == ["http://foo.bar/1.tif"]
+
+    def test_fetch_failed(self):
+        def download(url, dst):
+            raise IOError("no connection")
+        with self.assertRaises(IOError):
+            self.cache.fetch("http://foo.bar/1.tif", download)
+        assert self.cache.lookup("http://foo.bar/1.tif") is None
+        assert os.listdir(os.path.join(self.cache.directory, "tmp")) == []
+
+    def test_max_age(self):
+        self.cache.max_age = 0
+        self.cache.fetch("http://foo.bar/1.tif", self.download)
+        self.cache.fetch("http://foo.bar/1.tif", self.download)
+        assert len(self.downloads) == 2
+
+    def test_evict(self):
+        for i in range(15):
+            self.cache.fetch(f"http://foo.bar/{i}.tif", self.download)
+        # Use the first one, so it is the most recently used.
+        first = self.cache.lookup("http://foo.bar/0.tif")
+        assert self.cache.size() == 1500
+        assert self.cache.evict() == 5
+        assert self.cache.size() <= 1024
+        assert os.path.exists(first)
+        assert self.cache.lookup("http://foo.bar/1.tif") is None
+
+    def test_clone_or_copy(self):
+        path = self.cache.fetch("http://foo.bar/1.tif", self.download)
+        dst = os.path.join(self.directory, "workspace", "MAX", "1.tif")
+        clone_or_copy(path, dst)
+        assert os.stat(dst).st_ino != os.stat(path).st_ino
+        # An existing file is replaced.
+        clone_or_copy(path, dst)
+        with open(dst, "rb") as fh:
+            assert fh.read().startswith(b"http://foo.bar/1.tif")
+        # The copy is writable and changing it leaves the cache alone.
+        with open(dst, "wb") as fh:
+            fh.write(b"changed")
+        os.utime(dst, (0, 0))
+        with open(path, "rb") as fh:
+            assert fh.read().startswith(b"http://foo.bar/1.tif")
+        assert os.stat(path).st_mtime > 0
+
+    def test_store_output_writable(self):
+        """ Storing a file of the workspace leaves it writable. """
+        output = os.path.join(self.directory, "OUT_0001.xml")
+        with open(output, "w") as fh:
+            fh.write("<PcGts/>")
+        StepCache(os.path.join(self.directory, "steps"), max_size=1024).store(
+            "key", [{"ID": "OUT_0001", "path": output}]
+        )
+        assert os.access(output, os.W_OK)
+
+
+class StepCacheTests(TestCase):
+    """Test the step cache."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = StepCache(
+            os.path.join(self.directory, "cache"), max_size=1024
+        )
+        self.output = os.path.join(self.directory, "OUT_0001.xml")
+        with open(self.output, "w") as fh:
+            fh.write("<PcGts/>")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_store(self):
+        assert self.cache.lookup("key") is None
+        self.cache.store("key", [{
+            "ID": "OUT_0001", "mimetype": "application/vnd.prima.page+xml",
+            "local_filename": "OUT/OUT_0001.xml", "path": self.output,
+        }])
+        files = self.cache.lookup("key")
+        assert [f["ID"] for f in files] == ["OUT_0001"]
+        assert files[0]["local_filename"] == "OUT/OUT_0001.xml"
+        with open(files[0]["path"]) as fh:
+            assert fh.read() == "<PcGts/>"
+
+    def test_store_evicted(self):
+        self.cache.store("key", [{"ID": "OUT_0001", "path": self.output}])
+        os.remove(self.cache.lookup("key")[0]["path"])
+        assert self.cache.lookup("key") is None
+
+    def test_record(self):
+        assert self.cache.record(2, 1) == {"hits": 2, "misses": 1}
+        assert self.cache.record(1, 0) == {"hits": 3, "misses": 1}
+
+
+METS_URL = "http://foo.bar/mets.xml"
+
+
+class MetsCacheTests(TestCase):
+    """Test the METS cache."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = MetsCache(
+            os.path.join(self.directory, "cache"), max_size=10 * 1024 ** 2
+        )
+        with open(os.path.join(os.path.dirname(__file__), "files",
+                               "PPN821881744.mets.xml"), "rb") as fh:
+            self.mets = fh.read()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    @responses.activate
+    def test_fetch(self):
+        responses.add(responses.GET, METS_URL, body=self.mets,
+                      headers={"ETag": '"v1"'}, content_type="text/xml")
+        entry = self.cache.fetch(METS_URL)
+        with open(entry["path"], "rb") as fh:
+            assert fh.read() == self.mets
+        assert len(entry["summary"]["pages"]) == 3
+        assert len(entry["summary"]["file_groups"]["DEFAULT"]) == 3
+        assert "If-None-Match" not in responses.calls[0].request.headers
+
+    @responses.activate
+    def test_not_modified(self):
+        responses.add(responses.GET, METS_URL, body=self.mets,
+                      headers={"ETag": '"v1"',
+                               "Last-Modified": "Wed, 01 Jul 2020 10:00:00 GMT"},
+                      content_type="text/xml")
+        first = self.cache.fetch(METS_URL)
+        responses.replace(responses.GET, METS_URL, status=304)
+        second = self.cache.fetch(METS_URL)
+        headers = responses.calls[1].request.headers
+        assert headers["If-None-Match"] == '"v1"'
+        assert headers["If-Modified-Since"] == "Wed, 01 Jul 2020 10:00:00 GMT"
+        assert second["path"] == first["path"]
+        assert second["summary"] == first["summary"]
+        assert second["validated"] >= first["validated"]
+
+    @responses.activate
+    def test_modified(self):
+        responses.add(responses.GET, METS_URL, body=self.mets,
+                      headers={"ETag": '"v1"'}, content_type="text/xml")
+        first = self.cache.fetch(METS_URL)
+        changed = self.mets.replace(b'ID="PHYS_0003"', b'ID="PHYS_0004"')
+        responses.replace(responses.GET, METS_URL, body=changed,
+                          headers={"ETag": '"v2"'}, content_type="text/xml")
+        second = self.cache.fetch(METS_URL)
+        assert second["path"] != first["path"]
+        assert second["etag"] == '"v2"'
+        assert "PHYS_0004" in second["summary"]["pages"]
+
+    @responses.activate
+    def test_max_age(self):
+        self.cache.max_age = 60
+        responses.add(responses.GET, METS_URL, body=self.mets,
+                      content_type="text/xml")
+        self.cache.fetch(METS_URL)
+        self.cache.fetch(METS_URL)
+        assert len(responses.calls) == 1
+
+    @responses.activate
+    def test_revalidation_failed(self):
+        responses.add(responses.GET, METS_URL, body=self.mets,
+                      content_type="text/xml")
+        first = self.cache.fetch(METS_URL)
+        responses.replace(responses.GET, METS_URL, status=503)
+        assert self.cache.fetch(METS_URL)["path"] == first["path"]
+        with self.assertRaises(requests.RequestException):
+            self.cache.fetch("http://foo.bar/missing.xml")
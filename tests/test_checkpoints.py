@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+"""Testing the checkpoints of the steps of a task."""
+
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from ocrd_butler.execution.checkpoints import (
+    Checkpoints,
+    remove_outputs,
+)
+
+from .test_pages import create_workspace
+
+
+def step(output_file_grp, parameter=None, input_file_grp="MAX"):
+    return {
+        "processor": {
+            "name": "ocrd-dummy",
+            "executable": "ocrd-dummy",
+            "output_file_grp": output_file_grp,
+        },
+        "run_kwargs": {
+            "input_file_grp": input_file_grp,
+            "parameter": json.dumps(parameter or {}),
+        },
+    }
+
+
+class CheckpointsTests(TestCase):
+    """Test recording and resuming the steps of a task."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.workspace = create_workspace(os.path.join(self.directory, "ws"))
+        self.steps = [step("A"), step("B", input_file_grp="A"),
+                      step("C", input_file_grp="B")]
+        for output_file_grp in "ABC":
+            self.workspace.add_file(
+                output_file_grp, ID=f"{output_file_grp}_0001",
+                pageId="PHYS_0001", mimetype="text/plain",
+                local_filename=f"{output_file_grp}/{output_file_grp}_0001.txt",
+                content="foo",
+            )
+        self.checkpoints = Checkpoints(self.workspace.directory)
+        self.checkpoints.prepared(self.workspace)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_resume_index(self):
+        assert self.checkpoints.resume_index(self.steps, self.workspace) == 0
+        for index, _step in enumerate(self.steps):
+            self.checkpoints.completed(index, _step, self.workspace)
+
+        checkpoints = Checkpoints(self.workspace.directory).load()
+        assert checkpoints.is_prepared(self.workspace)
+        assert checkpoints.resume_index(self.steps, self.workspace) == 3
+
+        checkpoints.failed(2, self.steps[2])
+        assert checkpoints.resume_index(self.steps, self.workspace) == 2
+
+        # Changed parameters of a step invalidate its checkpoint.
+        steps = [self.steps[0], step("B", {"foo": 1}, "A"), self.steps[2]]
+        assert checkpoints.resume_index(steps, self.workspace) == 1
+
+        # So do missing outputs.
+        self.workspace.remove_file("A_0001", force=True)
+        assert checkpoints.resume_index(self.steps, self.workspace) == 0
+
+    def test_completed_forgets_following(self):
+        for index, _step in enumerate(self.steps):
+            self.checkpoints.completed(index, _step, self.workspace)
+        self.checkpoints.completed(1, self.steps[1], self.workspace)
+        assert [entry["output_file_grp"] for entry in
+                self.checkpoints.steps] == ["A", "B"]
+
+    def test_remove_outputs(self):
+        os.makedirs(os.path.join(self.workspace.directory, "D"))
+        removed = remove_outputs(
+            self.workspace, self.steps[1:] + [step("D"), step("E")]
+        )
+        assert removed == ["B", "C", "D"]
+        assert "B" not in self.workspace.mets.file_groups
+        assert "A" in self.workspace.mets.file_groups
+        assert not os.path.exists(os.path.join(self.workspace.directory, "B"))
+
+    def test_multiple_outputs(self):
+        """ A step with several output file groups, comma separated. """
+        steps = [step("A,D"), step("E", input_file_grp="A")]
+        self.workspace.add_file(
+            "D", ID="D_0001", pageId="PHYS_0001", mimetype="text/plain",
+            local_filename="D/D_0001.txt", content="foo",
+        )
+        self.checkpoints.completed(0, steps[0], self.workspace)
+        assert self.checkpoints.steps[0]["files"] == 2
+        assert self.checkpoints.resume_index(steps, self.workspace) == 1
+        self.workspace.remove_file("D_0001", force=True)
+        assert self.checkpoints.resume_index(steps, self.workspace) == 0
+
+        assert remove_outputs(self.workspace, steps) == ["A", "D"]
+        assert "A" not in self.workspace.mets.file_groups
+        assert "B" in self.workspace.mets.file_groups
+        assert not os.path.exists(os.path.join(self.workspace.directory, "A"))
+        assert not os.path.exists(os.path.join(self.workspace.directory, "D"))
@@ -1,4 +1,5 @@
 from flask_testing import TestCase
+from sqlalchemy.exc import IntegrityError
 from ocrd_butler.api.processors import Processors
 
 from ocrd_butler.config import TestingConfig
@@ -54,11 +55,27 @@ class DatabaseModelTests(TestCase):
 
     def test_get_all_tasks(self):
         for i in range(3):
-            models.Task.add(**task_data)
+            models.Task.add(**dict(task_data, uid=f"00{i}"))
         tasks = models.Task.get_all()
         assert models.Task.count() == len(tasks)
         assert type(tasks[0]) == models.Task
 
+    def test_task_uid_unique(self):
+        models.Task.add(**task_data)
+        with self.assertRaises(IntegrityError):
+            models.Task.add(**task_data)
+        db.session.rollback()
+        assert models.Task.count() == 1
+
+    def test_task_timestamps(self):
+        task = models.Task.add(**task_data)
+        assert task.created is not None
+        created, updated = task.created, task.updated
+        task.status = "STARTED"
+        db.session.commit()
+        assert task.created == created
+        assert task.updated > updated
+
     def test_delete_task(self):
         task = models.Task.create(**task_data).save()
         assert models.Task.count() > 0
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+
+"""Testing the concurrent download of workspace files."""
+
+from http.server import (
+    BaseHTTPRequestHandler,
+    ThreadingHTTPServer,
+)
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest import TestCase
+
+from ocrd.resolver import Resolver
+from ocrd.workspace import Workspace
+from ocrd_models import OcrdMets
+
+from ocrd_butler.execution.cache import ImageCache
+from ocrd_butler.execution.download import (
+    DownloadError,
+    HostLimiter,
+    download_files,
+)
+
+
+LATENCY = 0.1
+
+
+class SlowContentServer(BaseHTTPRequestHandler):
+    """ Stand-in for the content server, answering every request after
+    ``LATENCY`` seconds. Paths starting with ``/flaky`` fail on the first
+    request, paths starting with ``/missing`` always fail.
+    """
+    requested = {}
+
+    def do_GET(self):
+        time.sleep(LATENCY)
+        count = self.requested.get(self.path, 0)
+        self.requested[self.path] = count + 1
+        if self.path.startswith("/missing"):
+            self.send_response(404)
+            self.end_headers()
+            return
+        if self.path.startswith("/flaky") and count == 0:
+            self.send_response(503)
+            self.end_headers()
+            return
+        body = self.path.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "image/tiff")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class DownloadTests(TestCase):
+    """Test the download of the workspace files."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), SlowContentServer)
+        cls.base_url = "http://127.0.0.1:{}".format(cls.server.server_port)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        SlowContentServer.requested.clear()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def workspace(self, prefix="img", pages=16):
+        workspace = Workspace(
+            Resolver(), self.directory, mets=OcrdMets.empty_mets()
+        )
+        files = [
+            workspace.add_file(
+                "MAX",
+                ID=f"FILE_{i:04}_MAX",
+                pageId=f"PHYS_{i:04}",
+                mimetype="image/tiff",
+                url=f"{self.base_url}/{prefix}/{i:04}.tif",
+            )
+            for i in range(1, pages + 1)
+        ]
+        return workspace, files
+
+    def test_download_files(self):
+        workspace, files = self.workspace(pages=3)
+        download_files(workspace, files, workers=2, backoff=0)
+        for i, ocrd_file in enumerate(files, start=1):
+            assert ocrd_file.local_filename == f"MAX/FILE_{i:04}_MAX.tif"
+            assert ocrd_file.url == ocrd_file.local_filename
+            path = os.path.join(self.directory, ocrd_file.local_filename)
+            with open(path, "rb") as img_file:
+                assert img_file.read() == f"/img/{i:04}.tif".encode("utf-8")
+        assert not any(name.endswith(".part") for name in
+                       os.listdir(os.path.join(self.directory, "MAX")))
+
+    def test_download_files_concurrently(self):
+        workspace, files = self.workspace(prefix="serial")
+        started = time.time()
+        download_files(workspace, files, workers=1)
+        serial = time.time() - started
+
+        workspace, files = self.workspace(prefix="parallel")
+        started = time.time()
+        download_files(
+            workspace, files, workers=8,
+            host_limits={"127.0.0.1": 8}
+        )
+        parallel = time.time() - started
+
+        assert serial >= 16 * LATENCY
+        assert parallel < serial / 3
+
+    def test_host_limit(self):
+        workspace, files = self.workspace(pages=8)
+        started = time.time()
+        download_files(
+            workspace, files, workers=8,
+            host_limits={"127.0.0.1": 2}
+        )
+        assert time.time() - started >= 4 * LATENCY
+
+    def test_download_retry(self):
+        workspace, files = self.workspace(prefix="flaky", pages=2)
+        download_files(workspace, files, workers=2, backoff=0)
+        for ocrd_file in files:
+            assert os.path.exists(
+                os.path.join(self.directory, ocrd_file.local_filename))
+        assert SlowContentServer.requested["/flaky/0001.tif"] == 2
+
+    def test_download_missing(self):
+        workspace, files = self.workspace(prefix="missing", pages=2)
+        with self.assertRaises(DownloadError):
+            download_files(workspace, files, workers=2, backoff=0)
+        # Client errors are not retried.
+        assert SlowContentServer.requested["/missing/0001.tif"] == 1
+        assert files[0].local_filename is None
+
+    def test_host_limiter(self):
+        limiter = HostLimiter({"foo.bar": 2}, default=1)
+        assert limiter.limit("https://foo.bar/0001.tif") == 2
+        assert limiter.limit("https://bar.foo/0001.tif") == 1
+        assert limiter.semaphore("https://foo.bar/0001.tif") is\
+            limiter.semaphore("https://foo.bar/0002.tif")
+
+    def test_download_files_cached(self):
+        cache = ImageCache(
+            os.path.join(self.directory, "cache"), max_size=1024 ** 2
+        )
+        workspace, files = self.workspace(pages=4)
+        download_files(workspace, files, workers=4, cache=cache)
+
+        other = os.path.join(self.directory, "other")
+        os.makedirs(other)
+        workspace = Workspace(Resolver(), other, mets=OcrdMets.empty_mets())
+        files = [
+            workspace.add_file(
+                "MAX",
+                ID=ocrd_file.ID,
+                pageId=ocrd_file.pageId,
+                mimetype="image/tiff",
+                url=f"{self.base_url}/img/{i:04}.tif",
+            )
+            for i, ocrd_file in enumerate(files, start=1)
+        ]
+        download_files(workspace, files, workers=4, cache=cache)
+
+        assert all(count == 1 for count in
+                   SlowContentServer.requested.values())
+        for ocrd_file in files:
+            path = os.path.join(other, ocrd_file.local_filename)
+            with open(path, "rb") as img_file:
+                assert img_file.read().startswith(b"/img/")
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+
+"""Testing the estimates of how long tasks take."""
+
+import os
+import shutil
+import tempfile
+import time
+from unittest import (
+    TestCase as UnitTestCase,
+    mock,
+)
+
+from flask_testing import TestCase
+from ocrd.resolver import Resolver
+from PIL import Image
+from sqlalchemy import event
+
+from ocrd_butler.api import tasks as api_tasks
+from ocrd_butler.config import TestingConfig
+from ocrd_butler.database import models as db_model
+from ocrd_butler.execution.checkpoints import Checkpoints
+from ocrd_butler.execution.estimate import image_megapixels
+from ocrd_butler.execution.mets import IndexedWorkspace
+from ocrd_butler.factory import create_app, db
+
+
+def history(wall: float = 20.0, pages: int = 10,
+            megapixels: float = None) -> dict:
+    """ The results of a task that succeeded. """
+    return {
+        "prepared": {"pages": pages, "megapixels": megapixels},
+        "steps": [{"name": "ocrd-tesserocr-recognize", "status": "COMPLETED",
+                   "pages": pages, "usage": {"wall": wall}}],
+    }
+
+
+class EstimateTests(TestCase):
+    """Test the estimates in the status of tasks."""
+
+    def create_app(self):
+        return create_app(config=TestingConfig)
+
+    def setUp(self):
+        db.create_all()
+        self.results = tempfile.mkdtemp()
+        self.config = mock.patch.dict(self.app.config, {
+            "TASK_ESTIMATE": True,
+            "TASK_ESTIMATE_TTL": 0,
+            "TASK_ESTIMATE_WORKERS": 2,
+            "OCRD_BUTLER_RESULTS": self.results,
+        })
+        self.config.start()
+        self.workflow_id = self.client.post("/api/workflows", json=dict(
+            name="Workflow",
+            description="Some foobar workflow.",
+            processors=[{"name": "ocrd-tesserocr-recognize"}]
+        )).json["id"]
+
+    def tearDown(self):
+        self.config.stop()
+        db.session.remove()
+        db.drop_all()
+        shutil.rmtree(self.results, ignore_errors=True)
+
+    def add_task(self, status: str, results: dict = None,
+                 page_count: int = None) -> db_model.Task:
+        return db_model.Task.add(
+            src="http://foo.bar/mets.xml", workflow_id=self.workflow_id,
+            status=status, results=results or {}, page_count=page_count,
+        )
+
+    def estimate(self, task: db_model.Task) -> dict:
+        response = self.client.get(f"/api/tasks/{task.uid}/status")
+        assert response.status_code == 200
+        return response.json["estimate"]
+
+    def test_no_history(self):
+        task = self.add_task("CREATED", page_count=10)
+        assert self.estimate(task) is None
+
+    def test_created(self):
+        self.add_task("SUCCESS", history(wall=20.0, pages=10))
+        self.add_task("SUCCESS", history(wall=60.0, pages=20))
+        with mock.patch("ocrd_butler.api.tasks.fetch_page_counts",
+                        return_value=[30]):
+            response = self.client.post("/api/tasks", json=dict(
+                workflow_id=self.workflow_id, src="http://foo.bar/mets.xml",
+            ))
+        assert response.json["estimate"] == {
+            "duration": 75.0, "remaining": 75.0, "waiting": None,
+            "queued_ahead": None, "eta": None,
+        }
+        # Finished tasks have none.
+        task = self.add_task("SUCCESS", history())
+        assert self.estimate(task) is None
+
+    def test_queued(self):
+        self.add_task("SUCCESS", history(wall=20.0, pages=10))
+        running = self.add_task("STARTED", page_count=10)
+        self.add_task("PENDING", page_count=20)
+        task = self.add_task("PENDING", page_count=10)
+        self.add_task("PENDING", page_count=50)
+
+        estimate = self.estimate(task)
+        # The running task and the one queued before, on two workers.
+        assert estimate["queued_ahead"] == 2
+        assert estimate["waiting"] == 30.0
+        assert estimate["remaining"] == 20.0
+        assert estimate["eta"] is not None
+
+        # The running task is halfway through its only step.
+        checkpoints = Checkpoints(f"{self.results}/{running.uid}")
+        checkpoints.data["prepared"] = {
+            "pages": 10, "megapixels": None, "finished": time.time() - 10,
+        }
+        checkpoints.save()
+        estimate = self.estimate(running)
+        assert estimate["duration"] == 20.0
+        assert 9.0 <= estimate["remaining"] <= 10.0
+        assert estimate["queued_ahead"] == 0
+
+    def test_queued_routed(self):
+        """ Only the tasks of the same queue are ahead, queried at once. """
+        self.add_task("SUCCESS", history(wall=20.0, pages=10))
+        self.add_task("STARTED", page_count=10)
+        self.add_task("STARTED", page_count=100)
+        db_model.Task.add(src="http://foo.bar/mets.xml", priority=9,
+                          workflow_id=self.workflow_id, status="PENDING",
+                          page_count=10)
+        self.add_task("PENDING")
+        self.add_task("PENDING", page_count=20)
+        task = self.add_task("PENDING", page_count=10)
+        self.add_task("PENDING", page_count=10)
+
+        statements = []
+
+        def count(*args):
+            statements.append(args[2])
+
+        engine = db.get_engine(self.app)
+        event.listen(engine, "before_cursor_execute", count)
+        try:
+            with mock.patch.dict(self.app.config, TASK_ROUTING=True):
+                estimate = self.estimate(task)
+                queries = len(statements)
+                for index in range(5):
+                    db_model.Task.add(
+                        src="http://foo.bar/mets.xml", status="STARTED",
+                        page_count=10, workflow_id=self.client.post(
+                            "/api/workflows", json=dict(
+                                name=f"Workflow {index}",
+                                processors=[
+                                    {"name": "ocrd-tesserocr-recognize"}
+                                ]
+                            )).json["id"],
+                    )
+                del statements[:]
+                assert self.estimate(task)["queued_ahead"] == 7
+        finally:
+            event.remove(engine, "before_cursor_execute", count)
+        # The running task and the one queued before, on the four workers
+        # of the queue of small tasks.
+        assert estimate["queued_ahead"] == 2
+        assert estimate["waiting"] == 15.0
+        assert len(statements) == queries
+
+    def test_estimates_kept(self):
+        """ The checkpoints of running tasks are read once until the
+        throughput is learned again. """
+        self.add_task("SUCCESS", history(wall=20.0, pages=10))
+        self.add_task("STARTED", page_count=10)
+        task = self.add_task("PENDING", page_count=10)
+        with mock.patch.dict(self.app.config, TASK_ESTIMATE_TTL=3600), \
+                mock.patch("ocrd_butler.api.tasks.Checkpoints",
+                           wraps=Checkpoints) as checkpoints:
+            api_tasks._throughput["learned"] = None
+            for _ in range(3):
+                assert self.estimate(task)["waiting"] == 10.0
+            assert checkpoints.call_count == 1
+
+    def test_megapixels(self):
+        self.add_task("SUCCESS", history(wall=20.0, pages=10, megapixels=40))
+        running = self.add_task("STARTED", page_count=10)
+        checkpoints = Checkpoints(f"{self.results}/{running.uid}")
+        checkpoints.data["prepared"] = {
+            "pages": 10, "megapixels": 80.0, "finished": time.time() + 10,
+        }
+        checkpoints.save()
+        # Twice the megapixels of the former run.
+        assert self.estimate(running)["remaining"] == 40.0
+
+    def test_throughput_learned_again(self):
+        self.add_task("SUCCESS", history(wall=20.0, pages=10))
+        with mock.patch.dict(self.app.config, TASK_ESTIMATE_TTL=3600):
+            api_tasks._throughput["learned"] = None
+            assert api_tasks.processor_throughput()["processors"][
+                "ocrd-tesserocr-recognize"]["page"] == 2.0
+            self.add_task("SUCCESS", history(wall=40.0, pages=10))
+            assert api_tasks.processor_throughput()["processors"][
+                "ocrd-tesserocr-recognize"]["page"] == 2.0
+        assert api_tasks.processor_throughput()["processors"][
+            "ocrd-tesserocr-recognize"]["page"] == 3.0
+
+
+class MegapixelsTests(UnitTestCase):
+    """Test reading the sizes of the images of a workspace."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_image_megapixels(self):
+        Resolver().workspace_from_nothing(self.directory)
+        workspace = IndexedWorkspace(Resolver(), self.directory)
+        for page, size in ((1, (1000, 2000)), (2, (500, 1000))):
+            path = os.path.join(self.directory, "MAX", f"{page}.png")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            Image.new("L", size).save(path)
+            workspace.add_file("MAX", ID=f"MAX_{page}", pageId=f"P{page}",
+                               mimetype="image/png", url=f"MAX/{page}.png")
+        workspace.add_file("MAX", ID="MAX_3", pageId="P3",
+                           mimetype="image/png", url="http://foo.bar/3.png")
+        workspace.save_mets()
+        assert image_megapixels(workspace, "MAX") == 2.5
+        assert image_megapixels(workspace, "OTHER") is None
@@ -73,12 +73,13 @@ class FrontendTests(TestCase):
                 tasks.append(task)
             return (
                 200, {},
-                json.dumps(
-                    [
+                json.dumps({
+                    "tasks": [
                         task.to_json()
                         for task in tasks
-                    ]
-                )
+                    ],
+                    "next": None,
+                })
             )
 
         responses.add_callback(
@@ -98,17 +99,6 @@ class FrontendTests(TestCase):
             responses.DELETE, "http://localhost/api/tasks/uid",
             callback=delete_api_task_callback)
 
-        def api_get_taskinfo_callback(request):
-            return (200, {}, json.dumps({
-                "task_id": 1,
-                "state": "PENDING",
-                "result": None,
-            }))
-
-        responses.add_callback(
-            responses.GET, "http://localhost:5555/api/task/info/worker_task.id",
-            callback=api_get_taskinfo_callback)
-
         responses.add(
             method=responses.POST,
             url="http://localhost/api/tasks/1/run",
@@ -188,6 +178,79 @@ class FrontendTests(TestCase):
         assert download_links[3].links == {'/download/txt/uid'}
         assert download_links[4].links == {'/log/uid'}
 
+    @responses.activate
+    @mock.patch("ocrd_butler.frontend.tasks.task_information")
+    def test_task_steps(self, mock_task_information):
+        """Check if the steps of a task are shown on its page."""
+        mock_task_information.return_value = TASK_INFO
+        task = self._create_task("uid")
+        task.workflow = models.Workflow.create(
+            name="W", description="W", processors=[])
+        responses.add(
+            responses.GET, "http://localhost/api/tasks/uid",
+            body=json.dumps(task.to_json()), status=200)
+        responses.add(
+            responses.GET, "http://localhost/api/tasks/uid/steps",
+            body=json.dumps([{
+                "name": "ocrd-dummy",
+                "output_file_grp": "OCR-D-DUMMY",
+                "status": "COMPLETED",
+                "pages": 3,
+                "usage": {
+                    "wall": 2.5, "utime": 1.25, "stime": 0.5,
+                    "maxrss": 3 * 1024 ** 2, "read_bytes": 512,
+                    "write_bytes": 0,
+                },
+            }]), status=200)
+
+        responses.add(
+            responses.GET, "http://localhost/api/tasks/uid/status",
+            body=json.dumps({"status": "STARTED", "estimate": {
+                "duration": 3725.0, "remaining": 600.4, "waiting": 0.0,
+                "queued_ahead": 0, "eta": "2021-03-01T12:10:00+00:00",
+            }}), status=200)
+
+        response = self.client.get("/task/uid")
+        self.assert200(response)
+        html = HTML(html=response.data)
+        cells = [td.text for td in html.find("table.steps > tbody > tr > td")]
+        assert cells == [
+            "1", "ocrd-dummy", "OCR-D-DUMMY", "COMPLETED", "3",
+            "2.5s", "1.2s", "0.5s", "3.0 MiB", "512 B", "0 B",
+        ]
+        assert html.find(".estimate", first=True).text.split("\n") == [
+            "Estimated runtime: 1:02:05", "Remaining: 0:10:00",
+            "ETA: 2021-03-01T12:10:00+00:00",
+        ]
+
+    @responses.activate
+    def test_task_timings(self):
+        """Check if the timings of a task are shown from its events."""
+        task = self._create_task("uid")
+        task.workflow = models.Workflow.create(
+            name="W", description="W", processors=[])
+        responses.add(
+            responses.GET, "http://localhost/api/tasks/uid",
+            body=json.dumps(dict(task.to_json(), timings={
+                "received": 1614600000.0, "started": 1614600030.0,
+                "succeeded": 1614600150.0, "finished": 1614600150.0,
+                "runtime": 120.0, "queue_wait": 30.0,
+            })), status=200)
+        responses.add(
+            responses.GET, "http://localhost/api/tasks/uid/steps",
+            body=json.dumps([]), status=200)
+        responses.add(
+            responses.GET, "http://localhost/api/tasks/uid/status",
+            body=json.dumps({"status": "SUCCESS"}), status=200)
+
+        response = self.client.get("/task/uid")
+        self.assert200(response)
+        html = HTML(html=response.data)
+        times = html.find("table > tr > td")[7].text.split("\n")
+        assert times[0].startswith("Started: ")
+        assert times[1].startswith("Succeeded: ")
+        assert times[2:] == ["Runtime: 0:02:00", "Queued: 0:00:30"]
+
     def get_workflow_id(self):
         """Create a workflow for the tests."""
         workflow_response = self.client.post("/api/workflows", json=dict(
@@ -304,13 +367,16 @@ class FrontendTests(TestCase):
 
         mock_requests_get.return_value = type('', (object,), {
             "text": "42er log",
-            "status_code": 200
+            "status_code": 200,
+            "headers": {"X-Log-Offset": "8"},
         })()
 
-        response = self.client.get("/log/42")
+        response = self.client.get("/log/42?offset=0")
 
         assert response.status_code == 200
         assert response.data == b"42er log"
+        assert response.headers["X-Log-Offset"] == "8"
+        assert mock_requests_get.call_args[1]["params"]["offset"] == "0"
 
     @mock.patch("requests.get")
     def test_frontend_page_zip(self, mock_requests_get):
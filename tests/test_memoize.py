@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+"""Testing the memoization of workflow steps."""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from unittest import TestCase
+
+from ocrd.resolver import Resolver
+
+from ocrd_butler.execution.cache import StepCache
+from ocrd_butler.execution.memoize import (
+    page_keys,
+    run_step_cached,
+)
+from ocrd_butler.execution.tasks import _run_processor
+
+from . import require_ocrd_processors
+from .test_pages import create_workspace
+
+
+class MemoizeTests(TestCase):
+    """Test taking the output of steps from the step cache."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = StepCache(
+            os.path.join(self.directory, "cache"), max_size=1024 ** 3
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def step(self, workspace, parameter="{}"):
+        return {
+            "processor": {
+                "name": "ocrd-dummy",
+                "executable": "ocrd-dummy",
+                "output_file_grp": "OCR-D-DUMMY",
+            },
+            "run_kwargs": dict(
+                mets_url=workspace.mets_target,
+                resolver=Resolver(),
+                workspace=workspace,
+                log_level="INFO",
+                input_file_grp="MAX",
+                output_file_grp="OCR-D-DUMMY",
+                parameter=parameter,
+            ),
+        }
+
+    def run_cached(self, name, change_page=None):
+        workspace = create_workspace(os.path.join(self.directory, name))
+        if change_page is not None:
+            path = os.path.join(workspace.directory, "MAX",
+                                f"FILE_{change_page:04}_MAX.jpg")
+            with open(path, "ab") as fh:
+                fh.write(b"changed")
+        step = self.step(workspace)
+        pages = []
+
+        def run(page_id=None):
+            pages.append(page_id)
+            return _run_processor(
+                "ocrd-dummy", page_id=page_id, **step["run_kwargs"]
+            )
+
+        result = run_step_cached(workspace, step, self.cache, run)
+        workspace.reload_mets()
+        files = [(f.ID, f.pageId, f.mimetype, f.local_filename)
+                 for f in workspace.mets.find_files(fileGrp="OCR-D-DUMMY")]
+        for _, _, _, local_filename in files:
+            assert os.path.exists(
+                os.path.join(workspace.directory, local_filename))
+        return result, pages, files
+
+    def test_page_keys(self):
+        """ Keys depend on the parameters and the content of the inputs. """
+        workspace = create_workspace(os.path.join(self.directory, "keys"))
+        keys = page_keys(workspace, self.step(workspace), "1.0")
+        assert sorted(keys) == ["PHYS_0001", "PHYS_0002", "PHYS_0003"]
+        assert len(set(keys.values())) == 3
+
+        other = create_workspace(os.path.join(self.directory, "other"))
+        assert page_keys(other, self.step(other), "1.0") == keys
+        assert page_keys(other, self.step(other), "1.1") != keys
+        assert page_keys(
+            other, self.step(other, '{"foo": 1}'), "1.0"
+        )["PHYS_0001"] != keys["PHYS_0001"]
+
+        os.remove(os.path.join(other.directory, "MAX", "FILE_0002_MAX.jpg"))
+        assert sorted(page_keys(other, self.step(other), "1.0")) == [
+            "PHYS_0001", "PHYS_0003"
+        ]
+
+    @require_ocrd_processors("ocrd-dummy")
+    def test_run_step_cached(self):
+        """ A second run takes all pages from the cache, a changed page is
+        processed again. """
+        first, first_pages, first_files = self.run_cached("first")
+        assert first.returncode == 0
+        assert first.cache == {"hits": 0, "misses": 3}
+        assert first_pages == [None]
+
+        second, second_pages, second_files = self.run_cached("second")
+        assert second.returncode == 0
+        assert second.cache == {"hits": 3, "misses": 0}
+        assert second_pages == []
+        assert second_files == first_files
+
+        third, third_pages, third_files = self.run_cached(
+            "third", change_page=2)
+        assert third.cache == {"hits": 2, "misses": 1}
+        assert third_pages == ["PHYS_0002"]
+        assert [f[1] for f in third_files] == [f[1] for f in first_files]
+
+        assert self.cache.record(0, 0) == {"hits": 5, "misses": 4}
+
+    def test_run_step_cached_multiple_outputs(self):
+        """ The outputs of a step with several output file groups are stored
+        and taken from the cache group by group. """
+        def run_cached(name, change_page=None):
+            workspace = create_workspace(os.path.join(self.directory, name))
+            if change_page is not None:
+                path = os.path.join(workspace.directory, "MAX",
+                                    f"FILE_{change_page:04}_MAX.jpg")
+                with open(path, "ab") as fh:
+                    fh.write(b"changed")
+            step = self.step(workspace)
+            step["processor"].update(executable=sys.executable,
+                                     output_file_grp="OCR-D-SEG,OCR-D-IMG")
+            pages = []
+
+            def run(page_id=None):
+                pages.append(page_id)
+                for page in (page_id.split(",") if page_id
+                             else ["PHYS_0001", "PHYS_0002", "PHYS_0003"]):
+                    for file_grp, mimetype in (
+                            ("OCR-D-SEG", "application/vnd.prima.page+xml"),
+                            ("OCR-D-IMG", "image/png")):
+                        workspace.add_file(
+                            file_grp, ID=f"{file_grp}_{page}", pageId=page,
+                            mimetype=mimetype, content=f"{file_grp} {page}",
+                            local_filename=f"{file_grp}/{file_grp}_{page}",
+                        )
+                workspace.save_mets()
+                return subprocess.CompletedProcess(args=[], returncode=0)
+
+            result = run_step_cached(workspace, step, self.cache, run)
+            workspace.reload_mets()
+            files = {
+                file_grp: [f.ID for f in
+                           workspace.mets.find_files(fileGrp=file_grp)]
+                for file_grp in ("OCR-D-SEG", "OCR-D-IMG")
+            }
+            return result, pages, files
+
+        first, first_pages, first_files = run_cached("first")
+        assert first.cache == {"hits": 0, "misses": 3}
+        assert first_files["OCR-D-IMG"] == [
+            "OCR-D-IMG_PHYS_0001", "OCR-D-IMG_PHYS_0002",
+            "OCR-D-IMG_PHYS_0003",
+        ]
+
+        second, second_pages, second_files = run_cached("second")
+        assert second.cache == {"hits": 3, "misses": 0}
+        assert second_pages == []
+        assert second_files == first_files
+
+        third, third_pages, third_files = run_cached("third", change_page=2)
+        assert third.cache == {"hits": 2, "misses": 1}
+        assert third_pages == ["PHYS_0002"]
+        assert third_files == first_files
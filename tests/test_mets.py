@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+"""Testing the index of METS files."""
+
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from ocrd_models import OcrdMets
+from ocrd.resolver import Resolver
+
+from ocrd_butler.execution.mets import (
+    IndexedWorkspace,
+    MetsIndex,
+    processed,
+)
+
+from .test_pages import create_workspace
+
+
+class MetsIndexTests(TestCase):
+    """Test indexing METS files and updating the index."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        create_workspace(os.path.join(self.directory, "ws"))
+        self.workspace = IndexedWorkspace(
+            Resolver(), os.path.join(self.directory, "ws")
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def add_output(self, file_grp="OUT", pages=(1, 2, 3)):
+        """ Add a file group like a processor, i.e. to the METS file. """
+        mets = OcrdMets(filename=self.workspace.mets_target)
+        for i in pages:
+            mets.add_file(
+                file_grp, ID=f"{file_grp}_{i:04}", pageId=f"PHYS_{i:04}",
+                mimetype="application/vnd.prima.page+xml",
+                url=f"{file_grp}/{file_grp}_{i:04}.xml",
+            )
+        with open(self.workspace.mets_target, "wb") as fh:
+            fh.write(mets.to_xml(xmllint=True))
+
+    def test_index(self):
+        index = self.workspace.index
+        assert index.pages == ["PHYS_0001", "PHYS_0002", "PHYS_0003"]
+        assert index.file_groups == ["MAX"]
+        assert index.files("MAX")[0] == {
+            "ID": "FILE_0001_MAX", "mimetype": "image/jpeg",
+            "url": "MAX/FILE_0001_MAX.jpg", "pageId": "PHYS_0001",
+            "checksum": None,
+        }
+        assert list(index.by_page("MAX")) == index.pages
+        assert index.files("FOO") == []
+
+    def test_processed(self):
+        self.add_output(pages=(2, 1))
+        # Unchanged until the processor is done.
+        assert self.workspace.index.file_groups == ["MAX"]
+        processed(self.workspace, "OUT")
+        index = self.workspace.index
+        assert index.file_groups == ["MAX", "OUT"]
+        assert [f["ID"] for f in index.files("OUT")] == [
+            "OUT_0002", "OUT_0001"
+        ]
+        assert index.by_page("OUT")["PHYS_0001"][0]["ID"] == "OUT_0001"
+        assert index.files("OUT") == MetsIndex.from_file(
+            self.workspace.mets_target
+        ).files("OUT")
+
+    def test_mets_parsed_on_use(self):
+        self.add_output()
+        processed(self.workspace, "OUT")
+        assert self.workspace._mets is None
+        assert "OUT" in self.workspace.mets.file_groups
+        assert self.workspace._mets is not None
+
+    def test_save_mets(self):
+        self.workspace.mets.remove_file_group(
+            "MAX", recursive=True, force=True
+        )
+        self.workspace.save_mets()
+        assert self.workspace.index.file_groups == []
+
+    def test_update_removed(self):
+        self.add_output()
+        processed(self.workspace, "OUT")
+        create_workspace(os.path.join(self.directory, "other"))
+        shutil.copyfile(
+            os.path.join(self.directory, "other", "mets.xml"),
+            self.workspace.mets_target
+        )
+        processed(self.workspace, "OUT")
+        assert self.workspace.index.file_groups == ["MAX"]
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+
+"""Testing the migrations of the database."""
+
+from datetime import datetime
+import os
+import shutil
+import tempfile
+import threading
+from unittest import (
+    TestCase,
+    mock,
+)
+
+from sqlalchemy import (
+    create_engine,
+    inspect,
+)
+
+from ocrd_butler.database import db
+from ocrd_butler.database.migrations import (
+    MIGRATIONS,
+    MigrationError,
+    add_columns,
+    applied_versions,
+    task_batches,
+    task_indexes,
+    task_page_count,
+    task_status_changed,
+    upgrade,
+)
+from ocrd_butler.database.models import (
+    Task,
+    TaskEvent,
+    Workflow,
+)
+
+
+# The tasks table before the migrations.
+FORMER_TASKS = """
+CREATE TABLE tasks (
+    id INTEGER NOT NULL PRIMARY KEY,
+    uid VARCHAR(64),
+    src VARCHAR(255),
+    workflow_id INTEGER REFERENCES workflows (id),
+    description VARCHAR(1024),
+    parameters JSON,
+    default_file_grp VARCHAR(64),
+    worker_task_id VARCHAR(64),
+    status VARCHAR(64),
+    results JSON
+)
+"""
+
+
+class MigrationsTests(TestCase):
+    """Test bringing the database of a former version up to date."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.engine = create_engine(
+            f"sqlite:///{os.path.join(self.directory, 'butler.db')}"
+        )
+
+    def tearDown(self):
+        self.engine.dispose()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_upgrade_former(self):
+        db.Model.metadata.create_all(
+            bind=self.engine,
+            tables=[Workflow.__table__, TaskEvent.__table__],
+        )
+        self.engine.execute(FORMER_TASKS)
+        self.engine.execute(
+            "INSERT INTO tasks (uid, src, status, results) VALUES "
+            "('a', 'http://foo.bar/mets.xml', 'SUCCESS', NULL), "
+            "('b', 'http://foo.bar/mets.xml', 'SUCCESS', "
+            "'{\"prepared\": {\"finished\": 1614600000.0}, "
+            "\"steps\": [{\"finished\": 1614600300.0}]}'), "
+            "('c', 'http://foo.bar/mets.xml', 'CREATED', NULL), "
+            "('d', 'http://foo.bar/mets.xml', 'SUCCESS', NULL), "
+            "('e', 'http://foo.bar/mets.xml', 'CREATED', NULL)"
+        )
+        self.engine.execute(
+            "INSERT INTO task_events (task_uid, state, timestamp) VALUES "
+            "('a', 'STARTED', '2021-03-01 12:00:00.000000'), "
+            "('a', 'SUCCESS', '2021-03-01 12:05:00.000000'), "
+            "('d', 'SUCCESS', '2021-03-02 12:00:00.000000')"
+        )
+
+        started = datetime.utcnow()
+        assert upgrade(self.engine) == [1, 2, 3, 4, 5, 6]
+        inspector = inspect(self.engine)
+        columns = {column["name"] for column in inspector.get_columns("tasks")}
+        assert {"batch_id", "priority", "page_count", "status_changed",
+                "created", "updated"} <= columns
+        indexes = {index["name"]: index
+                   for index in inspector.get_indexes("tasks")}
+        assert indexes["ix_tasks_uid"]["unique"]
+        assert indexes["ix_tasks_status_id"]["column_names"] == [
+            "status", "id"
+        ]
+        assert {"ix_tasks_workflow_id", "ix_tasks_worker_task_id",
+                "ix_tasks_batch_id", "ix_tasks_created",
+                "ix_tasks_updated"} <= set(indexes)
+        rows = self.engine.execute(
+            "SELECT uid, priority, created, updated FROM tasks ORDER BY uid"
+        ).fetchall()
+        assert [tuple(row) for row in rows][:4] == [
+            ("a", 0, "2021-03-01 12:00:00.000000",
+             "2021-03-01 12:05:00.000000"),
+            # By the checkpoints in the results.
+            ("b", 0, "2021-03-01 12:00:00.000000",
+             "2021-03-01 12:05:00.000000"),
+            # Created when the next task was.
+            ("c", 0, "2021-03-02 12:00:00.000000",
+             "2021-03-02 12:00:00.000000"),
+            ("d", 0, "2021-03-02 12:00:00.000000",
+             "2021-03-02 12:00:00.000000"),
+        ]
+        # Created now, without a task after it.
+        assert rows[4].created == rows[4].updated
+        assert rows[4].created >= started.isoformat(" ")
+
+        assert upgrade(self.engine) == []
+
+    def test_upgrade_duplicate_uids(self):
+        """ Tasks sharing an uid stop the migrations before the unique index
+        of the uids, with the uids to clean up. """
+        db.Model.metadata.create_all(
+            bind=self.engine,
+            tables=[Workflow.__table__, TaskEvent.__table__],
+        )
+        self.engine.execute(FORMER_TASKS)
+        self.engine.execute(
+            "INSERT INTO tasks (uid, src, status) VALUES "
+            "('a', 'http://foo.bar/mets.xml', 'SUCCESS'), "
+            "('b', 'http://foo.bar/mets.xml', 'SUCCESS'), "
+            "('a', 'http://foo.bar/mets.xml', 'CREATED')"
+        )
+        with self.assertRaisesRegex(MigrationError, r"a \(2 times\)\."):
+            upgrade(self.engine)
+        with self.engine.connect() as connection:
+            assert applied_versions(connection) == {1, 2, 3}
+
+        self.engine.execute("DELETE FROM tasks WHERE status = 'CREATED'")
+        assert upgrade(self.engine) == [4, 5, 6]
+
+    def test_upgrade_concurrently(self):
+        """ Processes starting at once migrate one after the other. """
+        url = f"sqlite:///{os.path.join(self.directory, 'butler.db')}"
+        db.Model.metadata.create_all(
+            bind=self.engine,
+            tables=[Workflow.__table__, TaskEvent.__table__],
+        )
+        self.engine.execute(FORMER_TASKS)
+        applied = []
+
+        def migrate():
+            engine = create_engine(url)
+            applied.append(upgrade(engine))
+            engine.dispose()
+
+        threads = [threading.Thread(target=migrate) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert sorted(applied) == [[]] * 3 + [[1, 2, 3, 4, 5, 6]]
+        assert os.path.exists(os.path.join(self.directory,
+                                           "butler.db.migrate.lock"))
+
+    def test_add_columns_added_meanwhile(self):
+        """ A column added by another process in the meantime is fine. """
+        db.Model.metadata.create_all(bind=self.engine)
+        with self.engine.begin() as connection, \
+                mock.patch("ocrd_butler.database.migrations.inspect",
+                           side_effect=[mock.Mock(get_columns=lambda name: []),
+                                        inspect(connection)]):
+            add_columns(connection, Task.__table__, "priority")
+
+    def test_upgrade_current(self):
+        db.Model.metadata.create_all(bind=self.engine)
+        assert upgrade(self.engine) == [
+            version for version, _ in MIGRATIONS
+        ]
+        versions = dict(self.engine.execute(
+            "SELECT version, description FROM schema_migrations"
+        ).fetchall())
+        version = {
+            migration: version for version, migration in MIGRATIONS
+        }[task_indexes]
+        assert versions[version] == "The indexes of the lookups of tasks."
+
+    def test_upgrade_batches(self):
+        """ A database of the butler before batches and priorities. """
+        db.Model.metadata.create_all(bind=self.engine,
+                                     tables=[Workflow.__table__])
+        self.engine.execute(FORMER_TASKS)
+        self.engine.execute(
+            "INSERT INTO tasks (uid, src, status) VALUES "
+            "('a', 'http://foo.bar/mets.xml', 'SUCCESS')"
+        )
+        with self.engine.begin() as connection:
+            task_batches(connection)
+            task_batches(connection)
+        columns = {column["name"]
+                   for column in inspect(self.engine).get_columns("tasks")}
+        assert {"batch_id", "priority"} <= columns
+        assert self.engine.execute(
+            "SELECT priority FROM tasks"
+        ).scalar() == 0
+
+    def test_upgrade_page_count(self):
+        """ A database of the butler before the page counts. """
+        db.Model.metadata.create_all(bind=self.engine,
+                                     tables=[Workflow.__table__])
+        self.engine.execute(FORMER_TASKS)
+        with self.engine.begin() as connection:
+            task_batches(connection)
+            task_page_count(connection)
+        self.engine.execute(
+            "INSERT INTO tasks (uid, page_count) VALUES ('a', 42)"
+        )
+        assert self.engine.execute(
+            "SELECT page_count FROM tasks"
+        ).scalar() == 42
+
+    def test_upgrade_status_changed(self):
+        """ A database of the butler before the time of the last status. """
+        db.Model.metadata.create_all(bind=self.engine,
+                                     tables=[Workflow.__table__])
+        self.engine.execute(FORMER_TASKS)
+        with self.engine.begin() as connection:
+            task_batches(connection)
+            task_page_count(connection)
+            task_status_changed(connection)
+        self.engine.execute(
+            "INSERT INTO tasks (uid, status_changed) VALUES "
+            "('a', '2021-03-01 12:00:00.000000')"
+        )
+        assert self.engine.execute(
+            "SELECT status_changed FROM tasks"
+        ).scalar() == "2021-03-01 12:00:00.000000"
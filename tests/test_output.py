@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+"""Testing the incremental reading of processor output."""
+
+import os
+import subprocess
+import sys
+import threading
+import time
+from unittest import TestCase
+
+from ocrd_butler.execution.output import (
+    Watchdog,
+    run_streaming,
+)
+
+
+def gone(pid):
+    """ Check if the process exited, ignoring zombies nobody reaped yet. """
+    try:
+        with open(f"/proc/{pid}/stat") as stat:
+            return stat.read().rsplit(")", 1)[1].split()[0] == "Z"
+    except FileNotFoundError:
+        return True
+
+
+class RunStreamingTests(TestCase):
+    """Test running a command with streamed output."""
+
+    def test_lines_arrive_while_running(self):
+        arrived = []
+        script = (
+            "import sys, time\n"
+            "for i in range(3):\n"
+            "    print(f'line {i}', flush=True)\n"
+            "    time.sleep(0.2)\n"
+            "print('error', file=sys.stderr)\n"
+            "sys.exit(3)\n"
+        )
+        result = run_streaming(
+            [sys.executable, "-c", script],
+            lambda line: arrived.append((line, time.time())),
+            limit=1024
+        )
+        assert result.returncode == 3
+        assert [line for line, _ in arrived] == [
+            "line 0", "line 1", "line 2", "error"
+        ]
+        assert arrived[-1][1] - arrived[0][1] >= 0.4
+        assert result.stdout == b"line 0\nline 1\nline 2\nerror\n"
+
+    def test_output_limit(self):
+        lines = []
+        script = "for i in range(100000):\n    print(f'line {i:06}')\n"
+        result = run_streaming(
+            [sys.executable, "-c", script], lines.append, limit=120
+        )
+        assert len(lines) == 100000
+        assert len(result.stdout) <= 120
+        assert result.stdout.endswith(b"line 099999\n")
+
+    def test_long_line(self):
+        lines = []
+        script = "print('x' * 200000)"
+        result = run_streaming(
+            [sys.executable, "-c", script], lines.append, limit=1000
+        )
+        assert "".join(lines) == "x" * 200000
+        assert len(result.stdout) <= 1000
+
+    def test_usage(self):
+        script = (
+            "data = bytearray(64 * 1024 ** 2)\n"
+            "sum(range(3000000))\n"
+        )
+        result = run_streaming(
+            [sys.executable, "-c", script], lambda line: None, limit=1024
+        )
+        assert result.returncode == 0
+        assert set(result.usage) == {
+            "wall", "utime", "stime", "maxrss", "read_bytes", "write_bytes"
+        }
+        assert result.usage["wall"] >= result.usage["utime"] > 0
+        assert result.usage["maxrss"] >= 64 * 1024 ** 2
+
+    def test_killed(self):
+        result = run_streaming(
+            [sys.executable, "-c", "import os; os.kill(os.getpid(), 9)"],
+            lambda line: None, limit=1024
+        )
+        assert result.returncode == -9
+
+    def test_stopped(self):
+        """ The process and its children are killed on request. """
+        stop = threading.Event()
+        lines = []
+
+        def on_line(line):
+            lines.append(line)
+            stop.set()
+
+        started = time.monotonic()
+        result = run_streaming(
+            ["sh", "-c", "sleep 60 & echo $!; wait"], on_line, limit=1024,
+            should_stop=stop.is_set
+        )
+        assert time.monotonic() - started < 10
+        assert result.stopped == "stopped"
+        assert result.returncode == -15
+        assert gone(int(lines[0]))
+
+    def test_timeout(self):
+        result = run_streaming(
+            ["sleep", "60"], lambda line: None, limit=1024, timeout=0.5
+        )
+        assert result.stopped == "timeout"
+        assert result.usage["wall"] < 10
+
+    def test_not_stopped(self):
+        result = run_streaming(
+            ["true"], lambda line: None, limit=1024,
+            should_stop=lambda: False, timeout=60
+        )
+        assert result.returncode == 0
+        assert result.stopped is None
+
+    def test_env_and_cpus(self):
+        cpu = min(os.sched_getaffinity(0))
+        lines = []
+        result = run_streaming(
+            [sys.executable, "-c",
+             "import os; print(os.environ['OMP_THREAD_LIMIT'], "
+             "sorted(os.sched_getaffinity(0)))"],
+            lines.append, limit=1024,
+            env=dict(os.environ, OMP_THREAD_LIMIT="2"), cpus=[cpu],
+        )
+        assert result.returncode == 0
+        assert lines == [f"2 [{cpu}]"]
+
+    def test_watchdog_kill(self):
+        """ Processes ignoring SIGTERM are killed after the grace time. """
+        process = subprocess.Popen(
+            ["sh", "-c", "trap '' TERM; echo; sleep 60 & wait"],
+            stdout=subprocess.PIPE, start_new_session=True,
+        )
+        process.stdout.readline()
+        with Watchdog(process.pid, lambda: True, interval=0.1,
+                      grace=0.5) as watchdog:
+            process.wait(timeout=10)
+        process.stdout.close()
+        assert watchdog.reason == "stopped"
+        assert process.returncode == -9
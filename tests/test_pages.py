@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+"""Testing the page parallel execution of processors."""
+
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from ocrd.resolver import Resolver
+from ocrd.workspace import Workspace
+from ocrd_models import OcrdMets
+
+from ocrd_butler.execution.pages import (
+    create_shard,
+    merge_shard,
+    remove_shard,
+    split_pages,
+)
+from ocrd_butler.execution.tasks import (
+    _run_processor,
+    _run_processor_parallel,
+)
+
+from . import require_ocrd_processors
+
+
+CURRENT_DIR = os.path.dirname(__file__)
+
+
+def create_workspace(directory: str, pages: int = 3) -> Workspace:
+    """ Create a workspace with the test images in file group ``MAX``. """
+    os.makedirs(directory)
+    workspace = Workspace(Resolver(), directory, mets=OcrdMets.empty_mets())
+    for i in range(1, pages + 1):
+        src = os.path.join(CURRENT_DIR, "files", f"0000000{(i - 1) % 3 + 1}.jpg")
+        with open(src, "rb") as img_file:
+            workspace.add_file(
+                "MAX",
+                ID=f"FILE_{i:04}_MAX",
+                pageId=f"PHYS_{i:04}",
+                mimetype="image/jpeg",
+                local_filename=f"MAX/FILE_{i:04}_MAX.jpg",
+                content=img_file.read(),
+            )
+    workspace.save_mets()
+    return workspace
+
+
+class PagesTests(TestCase):
+    """Test splitting workspaces in page ranges."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_split_pages(self):
+        pages = [f"P{i}" for i in range(10)]
+        ranges = split_pages(pages, 3)
+        assert [len(page_range) for page_range in ranges] == [4, 3, 3]
+        assert sum(ranges, []) == pages
+        assert split_pages(pages, 1) == [pages]
+        assert split_pages(pages[:2], 8) == [["P0"], ["P1"]]
+
+    def test_merge_shards(self):
+        workspace = create_workspace(os.path.join(self.directory, "ws"))
+        agents = [agent.name for agent in workspace.mets.agents]
+        shards = [create_shard(workspace, f"test-{i}") for i in range(2)]
+        for index, shard in enumerate(shards):
+            shard_mets = OcrdMets(filename=shard)
+            shard_mets.add_agent(name=f"agent-{index}")
+            shard_mets.add_file(
+                "OUT",
+                ID=f"OUT_{index}",
+                pageId=f"PHYS_000{index + 1}",
+                mimetype="application/vnd.prima.page+xml",
+                url=f"OUT/OUT_{index}.xml",
+            )
+            with open(shard, "w") as mets_file:
+                mets_file.write(shard_mets.to_xml().decode("utf-8"))
+
+        assert merge_shard(workspace, shards[0]) == 1
+        assert merge_shard(workspace, shards[1], agents=False) == 1
+        # Merging again doesn't add anything.
+        assert merge_shard(workspace, shards[1], agents=False) == 0
+
+        assert [f.ID for f in workspace.mets.find_files(fileGrp="OUT")] == [
+            "OUT_0", "OUT_1"
+        ]
+        assert [agent.name for agent in workspace.mets.agents] == agents + [
+            "agent-0"
+        ]
+
+        for shard in shards:
+            remove_shard(shard)
+            assert not os.path.exists(shard)
+
+    @require_ocrd_processors("ocrd-dummy")
+    def test_run_processor_parallel(self):
+        """ The parallel run gives the same result as the serial one. """
+        results = []
+        for name, parallel in (("serial", 1), ("parallel", 3)):
+            workspace = create_workspace(
+                os.path.join(self.directory, name), pages=5
+            )
+            kwargs = dict(
+                mets_url=workspace.mets_target,
+                resolver=Resolver(),
+                workspace=workspace,
+                log_level="INFO",
+                input_file_grp="MAX",
+                output_file_grp="OCR-D-DUMMY",
+                parameter="{}",
+            )
+            if parallel > 1:
+                result = _run_processor_parallel(
+                    "ocrd-dummy", parallel=parallel, **kwargs
+                )
+            else:
+                result = _run_processor("ocrd-dummy", **kwargs)
+            assert result.returncode == 0
+
+            workspace.reload_mets()
+            files = [
+                (f.ID, f.pageId, f.mimetype, f.url)
+                for f in workspace.mets.find_files(fileGrp="OCR-D-DUMMY")
+            ]
+            images = []
+            for f in workspace.mets.find_files(
+                    fileGrp="OCR-D-DUMMY", mimetype="image/jpeg"):
+                with open(os.path.join(workspace.directory, f.url), "rb") as fh:
+                    images.append(fh.read())
+            results.append((
+                files, images, len(workspace.mets.agents),
+                sorted(os.listdir(workspace.directory)),
+            ))
+
+        assert len(results[0][0]) == 10
+        assert results[0] == results[1]
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+
+"""Testing the pipelined execution of workflows."""
+
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from unittest import (
+    TestCase,
+    mock,
+)
+
+from ocrd.resolver import Resolver
+
+from ocrd_butler.execution.checkpoints import Checkpoints
+from ocrd_butler.execution.pipeline import run_pipeline
+from ocrd_butler.execution.tasks import (
+    _run_processor,
+    _run_steps_pipelined,
+)
+
+from . import require_ocrd_processors
+from .test_pages import create_workspace
+
+
+class PipelineTests(TestCase):
+    """Test streaming batches of pages through the steps."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.workspace = create_workspace(
+            os.path.join(self.directory, "ws"), pages=6
+        )
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def run_step(self, step, mets_url, page_id):
+        with self.lock:
+            self.calls.append((step, page_id))
+        time.sleep(0.1)
+        return subprocess.CompletedProcess(
+            args=[step], returncode=0 if step != "fail" else 1
+        )
+
+    def test_run_pipeline(self):
+        started = time.time()
+        failure = run_pipeline(
+            self.workspace, ["bin", "seg", "ocr"], self.run_step,
+            output_file_grps=[], batch_size=2,
+        )
+        duration = time.time() - started
+        assert failure is None
+        # Every step saw every batch in page order.
+        for step in ("bin", "seg", "ocr"):
+            assert [page_id for name, page_id in self.calls
+                    if name == step] == [
+                "PHYS_0001,PHYS_0002", "PHYS_0003,PHYS_0004",
+                "PHYS_0005,PHYS_0006",
+            ]
+        # 3 steps over 3 batches take 5 instead of 9 slots.
+        assert duration < 0.8
+        assert not [name for name in os.listdir(self.workspace.directory)
+                    if name.startswith("mets.batch-")]
+
+    def test_run_pipeline_workers(self):
+        started = time.time()
+        run_pipeline(
+            self.workspace, ["bin", "seg"], self.run_step,
+            output_file_grps=[], batch_size=1, workers=[3, 3],
+        )
+        assert len(self.calls) == 12
+        assert time.time() - started < 0.6
+
+    def test_run_pipeline_failure(self):
+        failure = run_pipeline(
+            self.workspace, ["bin", "fail", "ocr"], self.run_step,
+            output_file_grps=[], batch_size=2, queue_size=1,
+        )
+        assert failure.step == "fail"
+        assert failure.index == 1
+        assert failure.batch == 0
+        assert failure.result.returncode == 1
+        assert "ocr" not in [name for name, page_id in self.calls]
+        assert not [name for name in os.listdir(self.workspace.directory)
+                    if name.startswith("mets.batch-")]
+
+    def test_run_steps_pipelined_equal_steps(self):
+        """ Equal steps of a workflow are booked apart. """
+        step = {
+            "processor": {"name": "ocrd-foo", "executable": "ocrd-foo",
+                          "output_file_grp": "FOO", "parallel": 1},
+            "run_kwargs": {"input_file_grp": "MAX", "parameter": "{}"},
+        }
+        calls = []
+
+        def run_processor(executable, page_id=None, **kwargs):
+            calls.append(page_id)
+            result = subprocess.CompletedProcess(args=[executable],
+                                                 returncode=0)
+            result.usage = {"wall": 1, "utime": len(calls), "stime": 0,
+                            "maxrss": 0, "read_bytes": 0, "write_bytes": 0}
+            return result
+
+        checkpoints = Checkpoints(self.workspace.directory)
+        checkpoints.prepared(self.workspace)
+        with mock.patch("ocrd_butler.execution.tasks._run_processor",
+                        run_processor):
+            _run_steps_pipelined(
+                {"uid": "foo"}, [step, dict(step)], self.workspace,
+                checkpoints, batch_size=6, queue_size=1,
+            )
+        assert [entry["usage"]["utime"] for entry
+                in checkpoints.steps] == [1, 2]
+
+    @require_ocrd_processors("ocrd-dummy")
+    def test_run_pipeline_dummy(self):
+        """ The pipelined run gives the same METS as the serial one. """
+        steps = [("MAX", "OCR-D-DUMMY-1"), ("OCR-D-DUMMY-1", "OCR-D-DUMMY-2")]
+
+        def run_step(step, mets_url, page_id=None):
+            return _run_processor(
+                "ocrd-dummy",
+                mets_url=mets_url,
+                resolver=Resolver(),
+                workspace=workspace,
+                log_level="INFO",
+                input_file_grp=step[0],
+                output_file_grp=step[1],
+                parameter="{}",
+                page_id=page_id,
+            )
+
+        results = []
+        for name in ("serial", "pipelined"):
+            workspace = create_workspace(
+                os.path.join(self.directory, name), pages=5
+            )
+            if name == "serial":
+                for step in steps:
+                    assert run_step(
+                        step, workspace.mets_target
+                    ).returncode == 0
+            else:
+                assert run_pipeline(
+                    workspace, steps, run_step,
+                    output_file_grps=[step[1] for step in steps],
+                    batch_size=2,
+                ) is None
+            workspace.reload_mets()
+            results.append((
+                [(f.fileGrp, f.ID, f.pageId, f.url)
+                 for f in workspace.mets.find_files()],
+                [agent.name for agent in workspace.mets.agents],
+            ))
+
+        assert len(results[0][0]) == 20
+        assert results[0] == results[1]
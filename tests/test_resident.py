@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+"""Testing the resident processor workers."""
+
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from ocrd.resolver import Resolver
+
+from ocrd_butler.execution.resident import resident_workers
+from ocrd_butler.execution.tasks import _run_processor
+
+from . import require_ocrd_processors
+from .test_pages import create_workspace
+
+
+DUMMY = "ocrd.processor.builtin.dummy_processor:DummyProcessor"
+
+
+class ResidentWorkerTests(TestCase):
+    """Test running processors by resident workers."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        resident_workers.stop()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def run_dummy(self, name, resident=None, **kwargs):
+        workspace = create_workspace(os.path.join(self.directory, name))
+        lines = []
+        result = _run_processor(
+            "ocrd-dummy",
+            mets_url=workspace.mets_target,
+            resolver=Resolver(),
+            workspace=workspace,
+            log_level="INFO",
+            input_file_grp="MAX",
+            output_file_grp="OCR-D-DUMMY",
+            parameter="{}",
+            on_line=lines.append,
+            resident=resident,
+            **kwargs
+        )
+        workspace.reload_mets()
+        files = [(f.ID, f.pageId, f.mimetype, f.url)
+                 for f in workspace.mets.find_files(fileGrp="OCR-D-DUMMY")]
+        agents = [agent.name for agent in workspace.mets.agents]
+        return result, lines, files, agents
+
+    @require_ocrd_processors("ocrd-dummy")
+    def test_resident(self):
+        """ A resident worker gives the same result as the executable. """
+        cli = self.run_dummy("cli")
+        first = self.run_dummy("resident-1", resident=DUMMY)
+        second = self.run_dummy("resident-2", resident=DUMMY, page_id="PHYS_0002")
+
+        assert len(resident_workers.workers) == 1
+        assert cli[0].returncode == first[0].returncode == 0
+        assert first[2:] == cli[2:]
+        # The output of the processor is passed on.
+        assert any("cp " in line for line in first[1])
+        assert first[0].usage["wall"] > 0
+        assert first[0].usage["maxrss"] > 0
+
+        assert [f[1] for f in second[2]] == ["PHYS_0002", "PHYS_0002"]
+
+    @require_ocrd_processors("ocrd-dummy")
+    def test_resident_failure(self):
+        """ A failing job is a failed step, the worker keeps running. """
+        workspace = create_workspace(os.path.join(self.directory, "failure"))
+        result = _run_processor(
+            "ocrd-dummy",
+            mets_url=workspace.mets_target,
+            resolver=Resolver(),
+            workspace=workspace,
+            log_level="INFO",
+            input_file_grp="MAX,FOO",
+            output_file_grp="OCR-D-DUMMY",
+            parameter="{}",
+            resident=DUMMY,
+        )
+        assert result.returncode == 1
+        assert b"Traceback" in result.stdout
+        worker = next(iter(resident_workers.workers.values()))
+        assert worker.alive
+
+    @require_ocrd_processors("ocrd-dummy")
+    def test_resident_fallback(self):
+        """ Without a working resident worker the executable is run. """
+        result, lines, files, agents = self.run_dummy(
+            "fallback", resident="ocrd_butler.foo:Bar"
+        )
+        assert result.returncode == 0
+        assert len(files) == 6
+        assert any("ModuleNotFoundError" in line for line in lines)
+
+    @require_ocrd_processors("ocrd-dummy")
+    def test_resident_busy(self):
+        """ Jobs for a busy worker run the executable. """
+        worker = resident_workers.acquire(DUMMY, {})
+        try:
+            result, lines, files, agents = self.run_dummy(
+                "busy", resident=DUMMY
+            )
+        finally:
+            worker.lock.release()
+        assert result.returncode == 0
+        assert len(files) == 6
+        assert result.args[0] == "ocrd-dummy"
+
+    @require_ocrd_processors("ocrd-dummy")
+    def test_resident_cpus(self):
+        """ Workers are bound to their CPUs from the start, and take jobs
+        bound to the same ones only. """
+        cpu = min(os.sched_getaffinity(0))
+        worker = resident_workers.acquire(DUMMY, {}, cpus=[cpu])
+        worker.lock.release()
+        assert os.sched_getaffinity(worker.process.pid) == {cpu}
+        other = resident_workers.acquire(DUMMY, {})
+        other.lock.release()
+        assert other is not worker
+        assert resident_workers.acquire(DUMMY, {}, cpus=[cpu]) is worker
+        worker.lock.release()
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+
+"""Testing the ledger of host resources."""
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from unittest import TestCase
+
+from ocrd.resolver import Resolver
+
+from ocrd_butler.execution.resources import ResourceLedger
+from ocrd_butler.execution.stop import TaskStopped
+from ocrd_butler.execution.tasks import _run_processor
+
+from . import require_ocrd_processors
+from .test_pages import create_workspace
+
+
+GB = 1024 ** 3
+
+
+class ResourceLedgerTests(TestCase):
+    """Test reserving cores and memory of the host."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.ledger = ResourceLedger(
+            os.path.join(self.directory, "ledger"), cores=4, memory=8 * GB,
+            poll=0.05,
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def reservations(self):
+        with open(os.path.join(self.ledger.directory, "ledger.json")) as fh:
+            return json.load(fh)["reservations"]
+
+    def test_reserve(self):
+        with self.ledger.reserve("ocrd-foo", cores=2, memory=6 * GB) as needed:
+            assert needed == {"cores": 2, "memory": 6 * GB}
+            assert len(self.reservations()) == 1
+        assert self.reservations() == {}
+
+    def test_reserve_waits(self):
+        """ A processor waits until another one released enough memory. """
+        events = []
+
+        def heavy():
+            with self.ledger.reserve("ocrd-heavy", cores=1, memory=6 * GB):
+                events.append("heavy")
+                time.sleep(0.3)
+            events.append("heavy done")
+
+        thread = threading.Thread(target=heavy)
+        thread.start()
+        while not events:
+            time.sleep(0.01)
+        # Fits besides the heavy one.
+        with self.ledger.reserve("ocrd-cheap", cores=1, memory=1 * GB):
+            events.append("cheap")
+        with self.ledger.reserve("ocrd-heavy", cores=1, memory=6 * GB):
+            events.append("heavy 2")
+        thread.join()
+        assert events == ["heavy", "cheap", "heavy done", "heavy 2"]
+
+    def test_capped(self):
+        """ Processors needing more than the host have it for themselves. """
+        with self.ledger.reserve("ocrd-huge", cores=16, memory=64 * GB) \
+                as needed:
+            assert needed == {"cores": 4, "memory": 8 * GB}
+
+    def test_dead_process(self):
+        """ Reservations of processes that died are dropped. """
+        process = subprocess.Popen(["true"])
+        process.wait()
+        with self.ledger._locked("ledger") as ledger:
+            ledger["reservations"] = {"dead": {
+                "pid": process.pid, "cores": 4, "memory": 8 * GB,
+            }}
+        with self.ledger.reserve("ocrd-foo", cores=1, memory=GB):
+            assert list(self.reservations().values())[0]["pid"] == os.getpid()
+
+    def test_stop_while_waiting(self):
+        with self.ledger.reserve("ocrd-heavy", cores=4, memory=GB):
+            with self.assertRaises(TaskStopped):
+                with self.ledger.reserve("ocrd-foo", cores=1, memory=GB,
+                                         should_stop=lambda: True):
+                    pass
+
+    def test_pin_cpus(self):
+        self.ledger.pin_cpus = True
+        available = sorted(os.sched_getaffinity(0))
+        with self.ledger.reserve("ocrd-foo", cores=1, memory=GB) as first:
+            with self.ledger.reserve("ocrd-bar", cores=1.5, memory=GB) \
+                    as second:
+                assert first["cpus"] == available[:1]
+                assert len(second["cpus"]) == min(2, len(available))
+                if len(available) > 2:
+                    assert first["cpus"][0] not in second["cpus"]
+
+    def test_learn(self):
+        assert self.ledger.requirements("ocrd-foo") == {
+            "cores": 1, "memory": 2 * GB
+        }
+        self.ledger.learn("ocrd-foo", {
+            "wall": 10, "utime": 25, "stime": 4, "maxrss": 3 * GB,
+        })
+        assert self.ledger.requirements("ocrd-foo") == {
+            "cores": 3, "memory": 3 * GB
+        }
+        # A cheaper run lowers the requirements slowly.
+        self.ledger.learn("ocrd-foo", {
+            "wall": 10, "utime": 5, "stime": 0, "maxrss": GB,
+        })
+        assert self.ledger.requirements("ocrd-foo") == {
+            "cores": 2.7, "memory": int(3 * GB * 0.9)
+        }
+        # Given requirements win.
+        assert self.ledger.requirements("ocrd-foo", cores=1)["cores"] == 1
+
+    def test_learn_capped(self):
+        """ A run using all the cores it was limited to raises them, until a
+        run with room to spare shows the processor needs no more. """
+        busy = {"wall": 10, "utime": 9.5, "stime": 0, "maxrss": GB}
+        self.ledger.learn("ocrd-foo", busy, cap=1)
+        assert self.ledger.requirements("ocrd-foo")["cores"] == 2
+        self.ledger.learn("ocrd-foo", dict(busy, utime=19), cap=2)
+        assert self.ledger.requirements("ocrd-foo")["cores"] == 3
+        self.ledger.learn("ocrd-foo", dict(busy, utime=19), cap=3)
+        assert self.ledger.requirements("ocrd-foo")["cores"] == 2.7
+        for _ in range(10):
+            self.ledger.learn("ocrd-foo", dict(busy, utime=19), cap=2)
+        assert self.ledger.requirements("ocrd-foo")["cores"] == 2
+        # Never more than the host has.
+        self.ledger.learn("ocrd-bar", dict(busy, utime=38), cap=4)
+        assert self.ledger.requirements("ocrd-bar")["cores"] == 4
+
+    def test_run_processor_capped(self):
+        """ A processor busy with all the cores reserved for it by default
+        gets more next time. """
+        workspace = create_workspace(os.path.join(self.directory, "ws"))
+        executable = os.path.join(self.directory, "ocrd-busy")
+        with open(executable, "w") as fh:
+            fh.write(f"#!{sys.executable}\n"
+                     "import time\n"
+                     "started = time.process_time()\n"
+                     "while time.process_time() - started < 0.5:\n"
+                     "    pass\n")
+        os.chmod(executable, 0o755)
+        result = _run_processor(
+            executable,
+            mets_url=workspace.mets_target,
+            resolver=Resolver(),
+            workspace=workspace,
+            log_level="INFO",
+            input_file_grp="MAX",
+            output_file_grp="OCR-D-BUSY",
+            parameter="{}",
+            ledger=self.ledger,
+        )
+        assert result.returncode == 0
+        assert self.ledger.requirements(executable)["cores"] == 2
+
+    @require_ocrd_processors("ocrd-dummy")
+    def test_run_processor(self):
+        workspace = create_workspace(os.path.join(self.directory, "ws"))
+        result = _run_processor(
+            "ocrd-dummy",
+            mets_url=workspace.mets_target,
+            resolver=Resolver(),
+            workspace=workspace,
+            log_level="INFO",
+            input_file_grp="MAX",
+            output_file_grp="OCR-D-DUMMY",
+            parameter="{}",
+            ledger=self.ledger,
+        )
+        assert result.returncode == 0
+        assert self.reservations() == {}
+        learned = self.ledger.requirements("ocrd-dummy")
+        assert learned["memory"] == result.usage["maxrss"]
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+"""Testing the routing of tasks to queues."""
+
+import os
+from unittest import mock
+
+import responses
+from flask_testing import TestCase
+
+from ocrd_butler.api.tasks import task_signature
+from ocrd_butler.config import TestingConfig
+from ocrd_butler.execution.routing import (
+    count_pages,
+    fetch_page_count,
+    task_queue,
+)
+from ocrd_butler.factory import create_app, db
+
+
+CURRENT_DIR = os.path.dirname(__file__)
+METS_URL = "http://foo.bar/mets.xml"
+
+
+class RoutingTests(TestCase):
+    """Test routing tasks by priority and size."""
+
+    def setUp(self):
+        db.create_all()
+        with open(os.path.join(CURRENT_DIR, "files", "PPN821881744.mets.xml"),
+                  "rb") as mets_file:
+            self.mets = mets_file.read()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    def create_app(self):
+        return create_app(config=TestingConfig)
+
+    def config(self, **values):
+        return mock.patch.dict(
+            self.app.config, dict(dict(TASK_ROUTING=True), **values)
+        )
+
+    def test_count_pages(self):
+        assert count_pages(self.mets, "MAX") == 3
+        assert count_pages(self.mets, "DEFAULT") == 3
+        assert count_pages(self.mets, "FOO") is None
+
+    @responses.activate
+    def test_fetch_page_count(self):
+        responses.add(responses.GET, METS_URL, body=self.mets)
+        responses.add(responses.GET, "http://foo.bar/image.jpg", body=b"xyz")
+        assert fetch_page_count(METS_URL, "MAX") == 3
+        assert fetch_page_count("http://foo.bar/image.jpg", "MAX") is None
+        assert fetch_page_count("http://foo.bar/missing.xml", "MAX") is None
+
+    def test_task_queue(self):
+        assert task_queue({"page_count": 3}, self.app.config) is None
+        with self.config():
+            assert task_queue({"page_count": 3}, self.app.config) == "small"
+            assert task_queue({"page_count": 51}, self.app.config) == "medium"
+            assert task_queue({"page_count": None}, self.app.config) == "large"
+            assert task_queue({"page_count": 2000, "priority": 5},
+                              self.app.config) == "urgent"
+
+    @responses.activate
+    def test_create_task_routed(self):
+        """ The page count of a task is estimated when it is created. """
+        responses.add(responses.GET, METS_URL, body=self.mets)
+        workflow_id = self.client.post("/api/workflows", json=dict(
+            name="New Workflow",
+            description="Some foobar workflow.",
+            processors=[{"name": "ocrd-dummy"}]
+        )).json["id"]
+
+        response = self.client.post("/api/tasks", json=dict(
+            workflow_id=workflow_id, src=METS_URL, priority=7))
+        task = self.client.get(f"/api/tasks/{response.json['uid']}").json
+        assert task["priority"] == 7
+        assert task["page_count"] is None
+
+        with self.config():
+            response = self.client.post("/api/tasks/batch", json=dict(tasks=[
+                dict(workflow_id=workflow_id, src=METS_URL),
+                dict(workflow_id=workflow_id, src=METS_URL, priority=9),
+            ]))
+            tasks = [self.client.get(f"/api/tasks/{uid}").json
+                     for uid in response.json["uids"]]
+            assert [task["page_count"] for task in tasks] == [3, 3]
+            assert [task_signature(task).options.get("queue")
+                    for task in tasks] == ["small", "urgent"]
+
+            with mock.patch.dict(self.app.config, STEP_CHAIN=True):
+                links = task_signature(tasks[0]).tasks
+            assert [link.options["queue"] for link in links] == \
+                ["small"] * 3
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+"""Testing scratch workspaces and publishing their results."""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from unittest import (
+    TestCase,
+    mock,
+)
+
+from ocrd_models import OcrdMets
+from ocrd.resolver import Resolver
+
+from ocrd_butler.execution.mets import IndexedWorkspace
+from ocrd_butler.execution.scratch import (
+    OWNER_FILE,
+    create_scratch,
+    publish,
+    sweep_scratch,
+)
+
+from .test_pages import create_workspace
+
+
+class ScratchTests(TestCase):
+    """Test publishing scratch workspaces."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.results = os.path.join(self.directory, "results")
+        os.makedirs(self.results)
+        self.scratch = create_scratch(
+            os.path.join(self.directory, "scratch"), "uid"
+        )
+        shutil.rmtree(self.scratch)
+        create_workspace(self.scratch)
+        self.workspace = IndexedWorkspace(Resolver(), self.scratch)
+        for file_grp in ("OCR-D-TMP", "OCR-D-OUT"):
+            for page in (1, 2):
+                self.workspace.add_file(
+                    file_grp, ID=f"{file_grp}_{page}",
+                    pageId=f"PHYS_{page:04}", mimetype="text/plain",
+                    local_filename=f"{file_grp}/{file_grp}_{page}.txt",
+                    content=f"{file_grp} {page}",
+                )
+        self.workspace.save_mets()
+        with open(os.path.join(self.scratch, "butler-steps.json"), "w") as fh:
+            fh.write("{}")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_publish(self):
+        dst_dir = os.path.join(self.results, "uid")
+        os.makedirs(dst_dir)
+        with open(os.path.join(dst_dir, "butler-stop"), "w"):
+            pass
+        published = publish(self.workspace, dst_dir, ["MAX", "OCR-D-OUT"],
+                            ["butler-steps.json", "missing.json"])
+        assert published == 5
+        assert sorted(os.listdir(dst_dir)) == [
+            "MAX", "OCR-D-OUT", "butler-steps.json", "mets.xml"
+        ]
+        with open(os.path.join(dst_dir, "OCR-D-OUT", "OCR-D-OUT_2.txt")) as fh:
+            assert fh.read() == "OCR-D-OUT 2"
+        mets = OcrdMets(filename=os.path.join(dst_dir, "mets.xml"))
+        assert mets.file_groups == ["MAX", "OCR-D-OUT"]
+        # Nothing left behind beside the results.
+        assert os.listdir(self.results) == ["uid"]
+
+    def test_publish_failed(self):
+        dst_dir = os.path.join(self.results, "uid")
+        os.makedirs(dst_dir)
+        with mock.patch("ocrd_butler.execution.scratch._copy",
+                        side_effect=OSError("No space left on device")):
+            with self.assertRaises(OSError):
+                publish(self.workspace, dst_dir, ["OCR-D-OUT"])
+        assert os.listdir(self.results) == ["uid"]
+        assert os.listdir(dst_dir) == []
+
+    def test_sweep(self):
+        root = os.path.dirname(self.scratch)
+        mine = create_scratch(root, "mine")
+        dead = subprocess.Popen([sys.executable, "-c", "pass"])
+        dead.wait()
+        abandoned = create_scratch(root, "abandoned")
+        with open(os.path.join(abandoned, OWNER_FILE), "r+") as fh:
+            host = fh.read().split()[0]
+            fh.seek(0)
+            fh.truncate()
+            fh.write(f"{host} {dead.pid}")
+        assert sweep_scratch(root) == [abandoned]
+        assert os.path.isdir(mine)
+        # Without an owner, e.g. the test workspace, it is kept.
+        assert os.path.isdir(self.scratch)
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+
+"""Testing the channel of the task states."""
+
+import json
+import os
+from unittest import mock
+
+from flask_testing import TestCase
+import redis
+
+from ocrd_butler.config import TestingConfig
+from ocrd_butler.database import models as db_model
+from ocrd_butler.execution import states
+from ocrd_butler.execution.states import (
+    LocalChannel,
+    RedisChannel,
+    StateWriter,
+    apply_transitions,
+    load_timings,
+    transition,
+)
+from ocrd_butler.execution.tasks import worker_process_shutdown_handler
+from ocrd_butler.factory import create_app, db
+
+
+class StatesTests(TestCase):
+    """Test writing the states sent by the workers."""
+
+    def create_app(self):
+        return create_app(config=TestingConfig)
+
+    def setUp(self):
+        db.create_all()
+        workflow_id = self.client.post("/api/workflows", json=dict(
+            name="Workflow",
+            description="Some foobar workflow.",
+            processors=[{"name": "ocrd-tesserocr-recognize"}]
+        )).json["id"]
+        self.uids = [
+            db_model.Task.add(
+                src="http://foo.bar/mets.xml", workflow_id=workflow_id
+            ).uid
+            for _ in range(2)
+        ]
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    def status(self, uid: str) -> str:
+        db.session.expire_all()
+        return db_model.Task.get(uid=uid).status
+
+    def test_apply_transitions(self):
+        first, second = self.uids
+        assert apply_transitions([
+            transition(first, "STARTED", timestamp=10.0),
+            transition(second, "STARTED", timestamp=11.0),
+            transition(first, "SUCCESS", {"steps": []}, timestamp=12.0),
+            transition("unknown", "STARTED", timestamp=12.0),
+        ]) == 2
+        assert self.status(first) == "SUCCESS"
+        assert db_model.Task.get(uid=first).results == {"steps": []}
+        assert self.status(second) == "STARTED"
+
+        # A state arriving late doesn't overwrite a newer one.
+        assert apply_transitions([
+            transition(first, "STARTED", timestamp=11.0),
+            transition(second, "FAILURE", timestamp=13.0),
+        ]) == 1
+        assert self.status(first) == "SUCCESS"
+        assert self.status(second) == "FAILURE"
+
+    def test_events(self):
+        first, second = self.uids
+        apply_transitions([
+            transition(first, "STARTED", timestamp=10.0,
+                       hostname="celery@worker1"),
+            transition(first, "SUCCESS", {}, timestamp=70.0,
+                       hostname="celery@worker1"),
+            transition(second, "STARTED", timestamp=20.0,
+                       hostname="celery@worker2"),
+        ])
+        events = self.client.get(f"/api/tasks/{first}/events").json
+        assert events == [
+            {"state": "STARTED", "timestamp": "1970-01-01T00:00:10+00:00",
+             "hostname": "celery@worker1"},
+            {"state": "SUCCESS", "timestamp": "1970-01-01T00:01:10+00:00",
+             "hostname": "celery@worker1"},
+        ]
+
+        timings = load_timings()
+        assert timings[first]["started"] == 10.0
+        assert timings[first]["runtime"] == 60.0
+        assert timings[second]["finished"] is None
+        assert list(load_timings([second])) == [second]
+
+        tasks = {task["uid"]: task for task in
+                 self.client.get("/api/tasks").json["tasks"]}
+        assert tasks[first]["timings"]["succeeded"] == 70.0
+        assert self.client.get(f"/api/tasks/{second}").json[
+            "timings"]["started"] == 20.0
+
+        self.client.delete(f"/api/tasks/{first}")
+        assert db_model.TaskEvent.query.filter_by(task_uid=first).count() \
+            == 0
+        assert db_model.TaskEvent.query.filter_by(task_uid=second).count() \
+            == 1
+
+    def test_stopped_task_kept_revoked(self):
+        uid = self.uids[0]
+        apply_transitions([transition(uid, "STARTED", timestamp=1.0)])
+        with mock.patch("ocrd_butler.api.tasks.request_stop"):
+            assert self.client.post(f"/api/tasks/{uid}/stop").status_code \
+                == 200
+        apply_transitions([transition(uid, "STARTED", timestamp=2.0)])
+        assert self.status(uid) == "REVOKED"
+
+    def test_local_channel(self):
+        channel = LocalChannel(self.app, interval=0.01, batch_size=2)
+        for uid in self.uids:
+            channel.send(transition(uid, "STARTED"))
+        channel.send(transition(self.uids[0], "SUCCESS", {"steps": []}))
+        channel.flush()
+        assert self.status(self.uids[0]) == "SUCCESS"
+        assert self.status(self.uids[1]) == "STARTED"
+
+    def test_finished_state_flushed(self):
+        """ The last state of a task is written before send_state returns,
+        the others before the worker process exits. """
+        channel = LocalChannel(self.app, interval=0.2)
+        with mock.patch.dict(states._channel, pid=os.getpid(),
+                             channel=channel):
+            states.send_state(self.app, self.uids[0], "STARTED")
+            assert self.status(self.uids[0]) != "STARTED"
+            states.send_state(self.app, self.uids[0], "SUCCESS",
+                              {"steps": []})
+            assert self.status(self.uids[0]) == "SUCCESS"
+
+            states.send_state(self.app, self.uids[1], "STARTED")
+            assert self.status(self.uids[1]) != "STARTED"
+            worker_process_shutdown_handler()
+            assert self.status(self.uids[1]) == "STARTED"
+
+    def test_redis_channel_unreachable(self):
+        channel = RedisChannel(self.app, "redis://localhost:6379")
+        with mock.patch.object(channel.redis, "rpush",
+                               side_effect=redis.ConnectionError("down")):
+            channel.send(transition(self.uids[0], "STARTED"))
+        assert self.status(self.uids[0]) == "STARTED"
+
+    def test_state_writer(self):
+        sent = [json.dumps(transition(uid, "STARTED")) for uid in self.uids]
+        writer = StateWriter(self.app, "redis://localhost:6379", interval=0)
+        writer.redis = mock.Mock()
+        writer.redis.blpop.return_value = (states.STATE_KEY, sent[0])
+        writer.redis.pipeline.return_value.execute.return_value = [
+            sent[1:], True
+        ]
+        assert writer.write_batch() == 2
+        assert self.status(self.uids[0]) == "STARTED"
+        assert self.status(self.uids[1]) == "STARTED"
+
+        # A batch that can't be written is pushed back.
+        with mock.patch("ocrd_butler.execution.states.apply_transitions",
+                        side_effect=RuntimeError("database gone")):
+            try:
+                writer.write_batch()
+            except RuntimeError:
+                pass
+        writer.redis.lpush.assert_called_once_with(
+            states.STATE_KEY, sent[1], sent[0]
+        )
+
+        writer.redis.blpop.return_value = None
+        assert writer.write_batch() is None
+
+    def test_state_channel(self):
+        with mock.patch.dict(states._channel, pid=None, channel=None):
+            assert isinstance(states.state_channel(self.app),
+                              states.DirectChannel)
+            with mock.patch.dict(self.app.config,
+                                 TASK_STATE_CHANNEL="redis://localhost:6379"):
+                # Kept in the same process.
+                assert isinstance(states.state_channel(self.app),
+                                  states.DirectChannel)
+                states._channel["pid"] = None
+                assert isinstance(states.state_channel(self.app),
+                                  RedisChannel)
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+"""Testing the update of workspaces to changed METS files."""
+
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from ocrd.resolver import Resolver
+
+from ocrd_butler.execution.mets import (
+    IndexedWorkspace,
+    MetsIndex,
+)
+from ocrd_butler.execution.update import (
+    carry_over,
+    load_source,
+    remove_unused,
+    reuse_images,
+    save_source,
+    sort_file_groups,
+    source_pages,
+)
+
+from .test_pages import create_workspace
+
+
+class UpdateTests(TestCase):
+    """Test taking over the output of unchanged pages."""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.directory = os.path.join(self.tmp, "ws")
+        create_workspace(self.directory)
+        self.workspace = IndexedWorkspace(Resolver(), self.directory)
+        for page in (1, 2, 3):
+            self.workspace.add_file(
+                "OUT", ID=f"OUT_{page}", pageId=f"PHYS_{page:04}",
+                mimetype="text/plain", local_filename=f"OUT/OUT_{page}.txt",
+                content=f"OUT {page}",
+            )
+        self.workspace.save_mets()
+        self.former = self.workspace.index
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def test_source(self):
+        assert load_source(self.directory) is None
+        source = source_pages(self.former, "MAX")
+        assert source["PHYS_0001"] == {
+            "url": "MAX/FILE_0001_MAX.jpg", "checksum": None
+        }
+        save_source(self.directory, source)
+        assert load_source(self.directory) == source
+
+    def test_reuse_images(self):
+        files = list(self.workspace.mets.find_files(fileGrp="MAX"))
+        for ocrd_file in files:
+            ocrd_file.url = f"http://foo.bar/{ocrd_file.ID}.jpg"
+        source = {"PHYS_0001": {"url": "1.jpg", "checksum": None},
+                  "PHYS_0002": {"url": "2.jpg", "checksum": "new"}}
+        former = {"PHYS_0001": {"url": "1.jpg", "checksum": None,
+                                "local": "MAX/FILE_0001_MAX.jpg"},
+                  "PHYS_0002": {"url": "2.jpg", "checksum": None,
+                                "local": "MAX/FILE_0002_MAX.jpg"}}
+        pages = ["PHYS_0001", "PHYS_0002", "PHYS_0003"]
+        assert reuse_images(self.workspace, files, pages, source, former) == 1
+        assert [ocrd_file.url for ocrd_file in files] == [
+            "MAX/FILE_0001_MAX.jpg", "http://foo.bar/FILE_0002_MAX.jpg",
+            "http://foo.bar/FILE_0003_MAX.jpg",
+        ]
+
+    def test_carry_over(self):
+        self.workspace.mets.remove_file_group(
+            "OUT", recursive=True, force=True
+        )
+        self.workspace.save_mets()
+        assert carry_over(self.workspace, self.former,
+                          ["PHYS_0003", "PHYS_0001"]) == 2
+        self.workspace.save_mets()
+        assert [f["ID"] for f in self.workspace.index.files("OUT")] == [
+            "OUT_1", "OUT_3"
+        ]
+        assert remove_unused(self.workspace, self.former) == 1
+        assert sorted(os.listdir(os.path.join(self.directory, "OUT"))) == [
+            "OUT_1.txt", "OUT_3.txt"
+        ]
+
+    def test_sort_file_groups(self):
+        self.workspace.mets.remove_file(ID="OUT_1")
+        self.workspace.mets.add_file(
+            "OUT", ID="OUT_1", pageId="PHYS_0001", mimetype="text/plain",
+            url="OUT/OUT_1.txt",
+        )
+        self.workspace.save_mets()
+        assert [f["ID"] for f in self.workspace.index.files("OUT")] == [
+            "OUT_2", "OUT_3", "OUT_1"
+        ]
+        sort_file_groups(self.workspace, ["OUT", "MISSING"])
+        self.workspace.save_mets()
+        assert [f["ID"] for f in MetsIndex.from_file(
+            self.workspace.mets_target
+        ).files("OUT")] == ["OUT_1", "OUT_2", "OUT_3"]